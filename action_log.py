@@ -0,0 +1,210 @@
+"""Buffered writer for ``actions.log``.
+
+``GlobalLoggerMiddleware`` only puts records into a bounded queue. A single
+daemon thread keeps the file open, serialises records in batches and
+rotates the file by size or age, compressing rotated files to
+``actions.log.<YYYYmmdd-HHMMSS>.gz``. Handler latency therefore no longer
+depends on disk latency; records are dropped when the queue is full.
+
+Every gunicorn worker appends to the same file. Batches are written and
+the file is rotated under an exclusive ``flock`` on ``actions.log.lock``;
+rotation renames the file before compressing it, and the other workers
+reopen the path once its inode changes (as ``WatchedFileHandler`` does),
+so no worker keeps writing into a file that is already rotated away.
+"""
+
+from __future__ import annotations
+
+import atexit
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+from log_utils import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: one worker only
+    fcntl = None
+
+ACTIONS_LOG_PATH = os.getenv("ACTIONS_LOG_PATH", "actions.log")
+ACTIONS_LOG_MAX_BYTES = int(os.getenv("ACTIONS_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+ACTIONS_LOG_ROTATE_SECONDS = float(os.getenv("ACTIONS_LOG_ROTATE_SECONDS", "86400"))
+ACTIONS_LOG_QUEUE_SIZE = int(os.getenv("ACTIONS_LOG_QUEUE_SIZE", "10000"))
+
+_STOP = object()
+# Suffix added by ``ActionLogWriter._rotate`` and ``_compress``
+_ROTATED = re.compile(r"\.(\d{8}-\d{6})(?:-(\d+))?\.gz$")
+
+
+class ActionLogWriter:
+    """Append JSON lines from a background thread with size/time rotation."""
+
+    batch_size = 500
+
+    def __init__(
+        self,
+        path: str = ACTIONS_LOG_PATH,
+        max_bytes: int = ACTIONS_LOG_MAX_BYTES,
+        rotate_seconds: float = ACTIONS_LOG_ROTATE_SECONDS,
+        queue_size: int = ACTIONS_LOG_QUEUE_SIZE,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._file: TextIO | None = None
+        self._lock_file: TextIO | None = None
+        self._opened_at = 0.0
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def write(self, entry: dict[str, Any]) -> None:
+        """Queue ``entry`` for writing; never blocks the caller."""
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5) -> None:
+        """Write out queued records and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="action-log", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(entry is _STOP for entry in batch):
+                batch = [entry for entry in batch if entry is not _STOP]
+                stop = True
+            try:
+                self._write_batch(batch)
+            except Exception:
+                logger.exception("Failed to write actions.log batch")
+        for f in (self._file, self._lock_file):
+            if f is not None:
+                f.close()
+        self._file = self._lock_file = None
+
+    def _write_batch(self, batch: list[dict[str, Any]]) -> None:
+        if not batch:
+            return
+        data = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch)
+        rotated = None
+        with self._locked():
+            f = self._open()
+            f.write(data)
+            f.flush()
+            if self._should_rotate(f):
+                rotated = self._rotate()
+        if rotated is not None:
+            self._compress(rotated)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the lock shared by all workers appending to ``path``."""
+        if fcntl is None:
+            yield
+            return
+        if self._lock_file is None:
+            self._lock_file = open(f"{self.path}.lock", "a")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> TextIO:
+        if self._file is not None:
+            # Another worker may have rotated the file since our last batch
+            try:
+                moved = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                moved = True
+            if moved:
+                self._file.close()
+                self._file = None
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._opened_at = time.time()
+        return self._file
+
+    def _should_rotate(self, f: TextIO) -> bool:
+        if self.max_bytes and f.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self) -> str:
+        """Move the live file aside (under the lock); returns its new name."""
+        self._file.close()
+        self._file = None
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = f"{self.path}.{stamp}"
+        suffix = 1
+        while os.path.exists(target) or os.path.exists(f"{target}.gz"):
+            target = f"{self.path}.{stamp}-{suffix}"
+            suffix += 1
+        os.rename(self.path, target)
+        return target
+
+    @staticmethod
+    def _compress(path: str) -> None:
+        with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+
+
+def rotated_files(directory: str | Path, name: str = "actions.log") -> list[Path]:
+    """The live ``name`` in ``directory`` and the files rotated out of it.
+
+    Skips ``<name>.lock`` and a rotated file still being compressed.
+    """
+    return sorted(
+        (match for match in Path(directory).glob(f"{name}*")
+         if match.name == name or _ROTATED.fullmatch(match.name[len(name):])),
+        key=rotation_order,
+    )
+
+
+def rotation_order(path: Path) -> tuple:
+    """Sort key: rotated files oldest first, each live file after its own."""
+    match = _ROTATED.search(path.name)
+    if match is None:
+        return (path.name, 1, "", 0)
+    return (path.name[: match.start()], 0, match.group(1), int(match.group(2) or 0))
+
+
+action_log = ActionLogWriter()
+atexit.register(action_log.close)
@@ -1,36 +1,50 @@
-from aiogram import Router
-from aiogram.types import Message
+from aiogram import F, Router
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from datetime import datetime
+from html import escape
+import hashlib
 
 from keyboards import menu_keyboard
-from supabase_client import supabase, with_supabase_retry
+from menu_routing import MenuAction
+from job_expiry import expires_at
+from job_search import job_index
+from my_jobs import invalidate_my_jobs
 from stats_logger import StatsLogger
+from subscriptions import notify_subscribers
+from user_cache import user_cache
+from write_outbox import write_outbox
 
-router = Router()
+router = Router(name="add_job")
 
 # 💼 Состояния FSM
 class AddJob(StatesGroup):
     title = State()
     description = State()
     price = State()
+    duplicate = State()
+
+# Выбор при похожем объявлении того же автора
+duplicate_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text="♻️ Обновить старое", callback_data="dup:refresh"),
+    InlineKeyboardButton(text="➕ Разместить новое", callback_data="dup:new"),
+]])
+
+def job_content_key(job: dict) -> str:
+    """Stable key of a job's content; repeated inserts of the same job collide on it."""
+    raw = "\x1f".join(str(job[k]) for k in ("user_id", "title", "description", "price"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
 
 # 🚀 Старт добавления подработки
-@router.message(lambda m: "разместить подработку" in m.text.lower())
+@router.message(MenuAction("add_job"), flags={"throttle": "add_job"})
 async def start_add_job(message: Message, state: FSMContext):
     StatsLogger.log(event="click_add_job")
     user_id = message.from_user.id
 
     # Проверяем регистрацию пользователя
     try:
-        result = await with_supabase_retry(
-            lambda: supabase.table("users")
-            .select("id")
-            .eq("telegram_id", user_id)
-            .execute()
-        )
-        registered = bool(getattr(result, "data", []))
+        registered = await user_cache.get(user_id) is not None
     except Exception as e:
         StatsLogger.log(event="supabase_error", message=str(e))
         registered = False
@@ -68,20 +82,15 @@ async def get_price(message: Message, state: FSMContext):
     await state.update_data(price=price_text)
     data = await state.get_data()
 
-    # Получаем контакт и город пользователя из Supabase
+    # Получаем контакт и город пользователя (из кэша или Supabase)
     user_id = message.from_user.id
     try:
-        user_data = await with_supabase_retry(
-            lambda: supabase.table("users")
-            .select("city,phone")
-            .eq("telegram_id", user_id)
-            .execute()
-        )
-        user = user_data.data[0] if getattr(user_data, "data", []) else {}
+        user = await user_cache.get(user_id) or {}
     except Exception as e:
         StatsLogger.log(event="supabase_error", message=str(e))
         user = {}
 
+    created_at = datetime.utcnow()
     job = {
         "user_id": str(user_id),
         "title": data["title"],
@@ -89,15 +98,57 @@ async def get_price(message: Message, state: FSMContext):
         "price": data["price"],
         "city": user.get("city", "Не указан"),
         "contact": user.get("phone", "Не указан"),
-        "created_at": datetime.utcnow().isoformat()
+        "created_at": created_at.isoformat(),
+        "expires_at": expires_at(created_at),
     }
+    job["dedup_key"] = job_content_key(job)
+
+    # 🔁 Похожее объявление того же автора в том же городе: предлагаем обновить его
+    duplicate = job_index.find_near_duplicate(job, user_id=user_id)
+    if duplicate is not None and duplicate.get("dedup_key"):
+        StatsLogger.log(event="job_near_duplicate")
+        await state.update_data(job=job, duplicate=duplicate)
+        await state.set_state(AddJob.duplicate)
+        await message.answer(
+            "🔁 Похоже, вы уже размещали такую подработку:\n\n"
+            f"<b>{escape(str(duplicate.get('title', '')))}</b>\n"
+            f"💰 {escape(str(duplicate.get('price', '')))} руб. · 📍 {escape(str(duplicate.get('city', '')))}\n\n"
+            "Обновить старое объявление (оно поднимется в выдаче и продлится) или разместить новое?",
+            reply_markup=duplicate_keyboard,
+        )
+        return
+
+    await _publish(message, state, job)
+
 
-    # Сохраняем подработку в Supabase
+async def _publish(message: Message, state: FSMContext, job: dict) -> None:
+    user_id = int(job["user_id"])
+
+    # Сохраняем подработку в локальный outbox, в Supabase она уйдёт фоном;
+    # повторная доставка того же апдейта не создаёт дубль
     try:
-        await with_supabase_retry(lambda: supabase.table("jobs").insert(job).execute())
-        StatsLogger.log(event="job_created")
+        created = await write_outbox.submit(
+            "jobs",
+            job,
+            key=f"jobs:{job['dedup_key']}",
+            on_conflict="dedup_key",
+            ignore_duplicates=True,
+        )
     except Exception as e:
-        StatsLogger.log(event="supabase_error", message=str(e))
+        StatsLogger.log(event="outbox_error", message=str(e))
+        await message.answer("⚠️ Не удалось сохранить подработку. Попробуйте указать оплату ещё раз.")
+        return
+
+    if created:
+        job_index.add(job)
+        invalidate_my_jobs(user_id)
+        StatsLogger.log(event="job_created")
+        try:
+            await notify_subscribers(job)
+        except Exception as e:
+            StatsLogger.log(event="notify_error", message=str(e))
+    else:
+        StatsLogger.log(event="job_duplicate")
 
     await message.answer(
         f"✅ <b>Подработка размещена!</b>\n\n"
@@ -109,3 +160,47 @@ async def get_price(message: Message, state: FSMContext):
         reply_markup=menu_keyboard
     )
     await state.clear()
+
+# ♻️ Обновление старого объявления вместо нового
+async def _refresh(message: Message, state: FSMContext, job: dict, duplicate: dict) -> None:
+    user_id = int(job["user_id"])
+    # Upsert по dedup_key старой строки: текст, цена, даты публикации и
+    # истечения заменяются, строка остаётся той же
+    refreshed = {**job, "dedup_key": duplicate["dedup_key"], "reminded_at": None}
+    try:
+        await write_outbox.submit(
+            "jobs",
+            refreshed,
+            key=f"jobs:refresh:{duplicate['dedup_key']}:{job['dedup_key']}",
+            on_conflict="dedup_key",
+        )
+    except Exception as e:
+        StatsLogger.log(event="outbox_error", message=str(e))
+        await message.answer("⚠️ Не удалось обновить объявление, попробуйте позже.", reply_markup=menu_keyboard)
+        await state.clear()
+        return
+
+    job_index.add(refreshed)
+    invalidate_my_jobs(user_id)
+    StatsLogger.log(event="job_refreshed")
+    await message.answer(
+        f"♻️ <b>Объявление обновлено!</b>\n\n<b>{escape(job['title'])}</b> снова в начале выдачи.",
+        reply_markup=menu_keyboard,
+    )
+    await state.clear()
+
+
+@router.callback_query(AddJob.duplicate, F.data.in_({"dup:refresh", "dup:new"}))
+async def resolve_duplicate(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    data = await state.get_data()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if callback.data == "dup:refresh":
+        await _refresh(callback.message, state, data["job"], data["duplicate"])
+    else:
+        await _publish(callback.message, state, data["job"])
+
+
+@router.callback_query(F.data.startswith("dup:"))
+async def stale_duplicate_choice(callback: CallbackQuery):
+    await callback.answer("Этот выбор уже неактуален")
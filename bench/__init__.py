@@ -0,0 +1 @@
+"""Load tests of the bot against local stand-ins for Telegram and Supabase."""
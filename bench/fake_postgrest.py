@@ -0,0 +1,312 @@
+"""In-memory stand-in for Supabase's PostgREST endpoint.
+
+Implements the part of the PostgREST protocol the bot uses through
+``postgrest-py``: ``select`` with column lists, ``eq``/``neq``/``gt``/
+``gte``/``lt``/``lte``/``in``/``is``/``like``/``ilike`` filters, ``or``
+groups, ``order``, ``limit``/``offset`` and ``Range`` paging, inserts and
+upserts (``on_conflict`` with merge or ignore resolution), updates and
+deletes. Tables are created on first use and rows get a serial ``id``.
+
+Every request can be delayed (``latency`` plus uniform ``jitter``) and
+failed with a 503 at ``error_rate`` to exercise retries and the circuit
+breaker.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from aiohttp import web
+
+_OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "in", "is", "like", "ilike"}
+
+
+@dataclass
+class FaultConfig:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+
+@dataclass
+class Table:
+    rows: list[dict[str, Any]] = field(default_factory=list)
+    next_id: int = 1
+    # Columns known to be unique: ``id`` and every ``on_conflict`` target
+    unique: set[str] = field(default_factory=lambda: {"id"})
+    # column -> value -> row, built on first lookup; keeps conflict checks
+    # and equality filters cheap so the fake does not skew measurements
+    indexes: dict[str, dict[Any, dict[str, Any]]] = field(default_factory=dict)
+
+    def index(self, column: str) -> dict[Any, dict[str, Any]]:
+        index = self.indexes.get(column)
+        if index is None:
+            index = self.indexes[column] = {
+                row[column]: row for row in self.rows if row.get(column) is not None
+            }
+        return index
+
+    def append(self, row: dict[str, Any]) -> dict[str, Any]:
+        stored = {"id": self.next_id, **row}
+        self.next_id += 1
+        self.rows.append(stored)
+        for column, index in self.indexes.items():
+            if stored.get(column) is not None:
+                index.setdefault(stored[column], stored)
+        return stored
+
+
+def _coerce(value: str, sample: Any) -> Any:
+    """Convert a filter value to the type of the stored column."""
+    if isinstance(sample, bool):
+        return value.lower() == "true"
+    if isinstance(sample, (int, float)):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _like(pattern: str, value: Any, flags: int = 0) -> bool:
+    regex = "^" + ".*".join(re.escape(part) for part in pattern.replace("%", "*").split("*")) + "$"
+    return re.match(regex, str(value), flags | re.DOTALL) is not None
+
+
+def _split_top(text: str) -> list[str]:
+    """Split ``a,b,and(c,d)`` on commas outside parentheses."""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def compile_condition(column: str, expression: str) -> Callable[[dict], bool]:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition(".")
+    if op not in _OPERATORS:
+        raise ValueError(f"Unsupported operator {op!r}")
+    if op != "in" and len(raw) > 1 and raw[0] == raw[-1] == '"':
+        raw = raw[1:-1]  # quoted values may contain reserved characters
+
+    def check(row: dict) -> bool:
+        value = row.get(column)
+        if op == "is":
+            result = value is None if raw == "null" else value is (raw == "true")
+        elif op == "in":
+            options = [item.strip('"') for item in _split_top(raw.strip("()"))]
+            result = value is not None and any(_coerce(item, value) == value for item in options)
+        elif value is None:
+            result = False
+        elif op == "like":
+            result = _like(raw, value)
+        elif op == "ilike":
+            result = _like(raw, value, re.IGNORECASE)
+        else:
+            other = _coerce(raw, value)
+            if type(other) is not type(value) and not isinstance(value, (int, float)):
+                value = str(value)
+            result = {
+                "eq": value == other,
+                "neq": value != other,
+                "gt": value > other,
+                "gte": value >= other,
+                "lt": value < other,
+                "lte": value <= other,
+            }[op]
+        return result != negate
+
+    return check
+
+
+def compile_group(kind: str, body: str) -> Callable[[dict], bool]:
+    """``or=(a.eq.1,and(b.gt.2,c.lt.3))`` style logical groups."""
+    checks = []
+    for part in _split_top(body.strip()[1:-1]):
+        match = re.match(r"^(not\.)?(and|or)(\(.*\))$", part)
+        if match:
+            inner = compile_group(match.group(2), match.group(3))
+            checks.append((lambda f: lambda row: not f(row))(inner) if match.group(1) else inner)
+        else:
+            column, _, expression = part.partition(".")
+            checks.append(compile_condition(column, expression))
+    combine = any if kind == "or" else all
+    return lambda row: combine(check(row) for check in checks)
+
+
+class FakePostgrest:
+    """Tables and request handling of the fake server."""
+
+    _RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+    def __init__(self, faults: FaultConfig | None = None) -> None:
+        self.faults = faults or FaultConfig()
+        self.tables: dict[str, Table] = {}
+        self.requests = 0
+        self.errors = 0
+
+    def table(self, name: str) -> Table:
+        return self.tables.setdefault(name, Table())
+
+    def seed(self, name: str, rows: list[dict[str, Any]], unique: tuple[str, ...] = ()) -> None:
+        table = self.table(name)
+        table.unique.update(unique)
+        for row in rows:
+            table.append(row)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/rest/v1/{table}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        faults = self.faults
+        delay = faults.latency + random.uniform(0, faults.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if faults.error_rate and random.random() < faults.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {"code": "503", "message": "Injected failure", "details": None, "hint": None},
+                status=503,
+            )
+        try:
+            return await self._dispatch(request)
+        except (ValueError, KeyError) as e:
+            return web.json_response(
+                {"code": "PGRST100", "message": str(e), "details": None, "hint": None},
+                status=400,
+            )
+
+    async def _dispatch(self, request: web.Request) -> web.Response:
+        table = self.table(request.match_info["table"])
+        params = request.query
+        prefer = request.headers.get("Prefer", "")
+        if request.method in ("GET", "HEAD"):
+            rows = self._select(table, params, request.headers.get("Range"))
+            if request.method == "HEAD":
+                return web.Response(status=200)
+            return web.json_response(rows)
+        if request.method == "POST":
+            payload = await request.json()
+            rows = payload if isinstance(payload, list) else [payload]
+            written = self._write(table, rows, params.get("on_conflict"), prefer)
+            return self._written(written, prefer, status=201)
+        if request.method == "PATCH":
+            changes = await request.json()
+            matched = [row for row in table.rows if self._matches(row, params)]
+            for row in matched:
+                row.update(changes)
+            table.indexes.clear()
+            return self._written(matched, prefer)
+        if request.method == "DELETE":
+            matched = [row for row in table.rows if self._matches(row, params)]
+            ids = {id(row) for row in matched}
+            table.rows = [row for row in table.rows if id(row) not in ids]
+            table.indexes.clear()
+            return self._written(matched, prefer)
+        return web.Response(status=405)
+
+    @staticmethod
+    def _written(rows: list[dict], prefer: str, status: int = 200) -> web.Response:
+        if "return=minimal" in prefer:
+            return web.Response(status=status)
+        return web.json_response(rows, status=status)
+
+    def _matches(self, row: dict, params) -> bool:
+        for key, value in params.items():
+            if key in self._RESERVED:
+                continue
+            if key in ("or", "and"):
+                check = compile_group(key, value)
+            elif key in ("not.or", "not.and"):
+                inner = compile_group(key[4:], value)
+                check = lambda r, f=inner: not f(r)  # noqa: E731
+            else:
+                check = compile_condition(key, value)
+            if not check(row):
+                return False
+        return True
+
+    def _candidates(self, table: Table, params) -> list[dict]:
+        """Rows an ``eq`` filter on a unique column narrows the scan to."""
+        for column in table.unique:
+            value = params.get(column, "")
+            if value.startswith("eq."):
+                raw = value[3:]
+                index = table.index(column)
+                row = index.get(int(raw)) if raw.lstrip("-").isdigit() else None
+                row = row or index.get(raw)
+                return [row] if row is not None else []
+        return table.rows
+
+    def _select(self, table: Table, params, range_header: str | None) -> list[dict]:
+        result = [row for row in self._candidates(table, params) if self._matches(row, params)]
+        orders = [item for value in params.getall("order", []) for item in value.split(",")]
+        for spec in reversed(orders):
+            column, *modifiers = spec.split(".")
+            desc = "desc" in modifiers
+            nulls_first = "nullsfirst" in modifiers if "nullsfirst" in modifiers or "nullslast" in modifiers else desc
+            present = [row for row in result if row.get(column) is not None]
+            missing = [row for row in result if row.get(column) is None]
+            present.sort(key=lambda row: row[column], reverse=desc)
+            result = missing + present if nulls_first else present + missing
+        start = int(params.get("offset", 0))
+        end = None
+        if range_header:
+            first, _, last = range_header.partition("-")
+            start, end = int(first), int(last) + 1 if last else None
+        if "limit" in params:
+            limit_end = start + int(params["limit"])
+            end = limit_end if end is None else min(end, limit_end)
+        result = result[start:end]
+        columns = params.get("select", "*")
+        if columns != "*":
+            names = [name.strip() for name in columns.split(",")]
+            result = [{name: row.get(name) for name in names} for row in result]
+        return [dict(row) for row in result]
+
+    def _write(self, table: Table, rows: list[dict], on_conflict: str | None, prefer: str) -> list[dict]:
+        written = []
+        ignore = "resolution=ignore-duplicates" in prefer
+        merge = "resolution=merge-duplicates" in prefer
+        for row in rows:
+            existing = None
+            if on_conflict or merge:
+                columns = [column.strip() for column in (on_conflict or "id").split(",")]
+                if len(columns) == 1:
+                    column = columns[0]
+                    table.unique.add(column)
+                    if row.get(column) is not None:
+                        existing = table.index(column).get(row[column])
+                else:
+                    # Composite targets are rare here; a scan is fine
+                    key = [row.get(column) for column in columns]
+                    existing = next(
+                        (other for other in table.rows if [other.get(column) for column in columns] == key),
+                        None,
+                    )
+            if existing is not None:
+                if ignore:
+                    continue
+                existing.update(row)
+                written.append(dict(existing))
+                continue
+            written.append(dict(table.append(row)))
+        return written
+
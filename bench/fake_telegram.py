@@ -0,0 +1,103 @@
+"""In-memory stand-in for the Telegram Bot API.
+
+Point the bot at it with ``TelegramAPIServer.from_base(url)``. Every
+method succeeds: ``sendMessage``/``editMessageText`` return a message,
+``getUpdates`` returns nothing and everything else returns ``true``.
+Optional ``latency`` delays each call, and ``flood_limit`` answers
+``sendMessage`` with 429 once more than that many messages were sent in
+the last second, as Telegram does for bots that exceed ~30 msg/s.
+
+``chats`` counts the ``sendMessage`` calls per chat, so that a broadcast
+can be checked for lost and duplicated messages.
+
+``on_message(chat_id, method)`` is called for every message the bot sends
+so that a load generator can match replies to the updates it posted.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from typing import Any, Callable
+
+from aiohttp import web
+
+_MESSAGE_METHODS = {"sendmessage", "editmessagetext", "sendphoto", "senddocument"}
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        flood_limit: int = 0,
+        on_message: Callable[[int, str], None] | None = None,
+    ) -> None:
+        self.latency = latency
+        self.flood_limit = flood_limit
+        self.on_message = on_message
+        self.calls: dict[str, int] = {}
+        self.sent = 0
+        self.flood_waits = 0
+        self.chats: Counter[int] = Counter()
+        self._recent: deque[float] = deque()
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def _flooded(self) -> bool:
+        if not self.flood_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and self._recent[0] < now - 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.flood_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method not in _MESSAGE_METHODS:
+            result: Any = [] if method == "getupdates" else True
+            if method == "getme":
+                result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+            return web.json_response({"ok": True, "result": result})
+
+        if method == "sendmessage" and self._flooded():
+            self.flood_waits += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+                status=429,
+            )
+        chat_id = int(form.get("chat_id", 0))
+        self._message_id += 1
+        self.sent += 1
+        if method == "sendmessage":
+            self.chats[chat_id] += 1
+        if self.on_message is not None:
+            self.on_message(chat_id, method)
+        markup = form.get("reply_markup")
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": int(form.get("message_id", 0)) or self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": form.get("text", ""),
+                **({"reply_markup": json.loads(markup)} if markup and "inline_keyboard" in markup else {}),
+            },
+        })
@@ -0,0 +1,331 @@
+"""Run the real aiohttp app from ``main.create_app`` against local fakes.
+
+The fakes (:mod:`bench.fake_postgrest`, :mod:`bench.fake_telegram`) run on
+their own event loop in a background thread, so their work does not show
+up as event-loop lag of the bot; they still share the GIL with it, which
+keeps absolute numbers pessimistic but comparable between runs. The bot is
+imported in-process with its environment pointed at the fakes and at a
+scratch working directory, served on a local port and driven over HTTP
+exactly as Telegram drives the webhook.
+
+Latency of an update is measured from posting it to the webhook until the
+bot's reply reaches the fake Telegram API.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+
+from bench.fake_postgrest import FakePostgrest, FaultConfig
+from bench.fake_telegram import FakeTelegram
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCH_TOKEN = "123456:BENCH-token"
+BENCH_KEY = "bench.bench.bench"
+CITIES = ["Минск", "Гомель", "Брест", "Гродно", "Витебск", "Могилёв"]
+WORDS = ["курьер", "грузчик", "официант", "промоутер", "бариста", "сборщик", "водитель", "уборка"]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, ``q`` in 0..100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(values: list[float], scale: float = 1000.0) -> dict[str, float]:
+    """p50/p95/p99/max of ``values`` (seconds) in milliseconds by default."""
+    return {
+        "p50": round(percentile(values, 50) * scale, 2),
+        "p95": round(percentile(values, 95) * scale, 2),
+        "p99": round(percentile(values, 99) * scale, 2),
+        "max": round(max(values, default=0.0) * scale, 2),
+        "mean": round(statistics.fmean(values) * scale, 2) if values else 0.0,
+    }
+
+
+def add_fake_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options shared by the tools that run the bot against the fakes."""
+    parser.add_argument("--jobs", type=int, default=2000, help="jobs seeded into the fake database")
+    parser.add_argument("--seed-users", type=int, default=1000, help="users seeded into the fake database")
+    parser.add_argument("--pg-latency", type=float, default=0.01, help="fake PostgREST latency, seconds")
+    parser.add_argument("--pg-jitter", type=float, default=0.01, help="uniform extra latency, seconds")
+    parser.add_argument("--pg-error-rate", type=float, default=0.0, help="share of requests failing with 503")
+    parser.add_argument("--tg-latency", type=float, default=0.02, help="fake Telegram API latency, seconds")
+    parser.add_argument(
+        "--flood-limit", type=int, default=None,
+        help="fake Telegram messages/sec before 429 (default: 30 for broadcast, off otherwise)",
+    )
+
+
+def fault_config(args: argparse.Namespace) -> FaultConfig:
+    return FaultConfig(latency=args.pg_latency, jitter=args.pg_jitter, error_rate=args.pg_error_rate)
+
+
+def seed(env: BenchEnvironment, jobs: int, users: int) -> None:
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    env.postgrest.seed(
+        "users",
+        [
+            {"telegram_id": 5_000_000 + n, "username": f"seed{n}", "name": f"Seed {n}",
+             "city": random.choice(CITIES), "phone": "+375290000000", "created_at": now}
+            for n in range(users)
+        ],
+        unique=("telegram_id",),
+    )
+    env.postgrest.seed(
+        "jobs",
+        [
+            {"user_id": str(5_000_000 + n % max(users, 1)), "title": f"{random.choice(WORDS).capitalize()} {n}",
+             "description": " ".join(random.choices(WORDS, k=6)), "price": str(random.randrange(20, 200)),
+             "city": random.choice(CITIES), "contact": "+375290000000", "created_at": now,
+             "dedup_key": f"seed-{n}"}
+            for n in range(jobs)
+        ],
+        unique=("dedup_key",),
+    )
+
+
+class ServerThread:
+    """Serve aiohttp applications from a private loop in a daemon thread."""
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bench-fakes", daemon=True)
+        self._runners: list[web.AppRunner] = []
+
+    def start(self, *apps: web.Application) -> list[str]:
+        self._thread.start()
+        return [
+            asyncio.run_coroutine_threadsafe(self._serve(app), self.loop).result()
+            for app in apps
+        ]
+
+    async def _serve(self, app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        self._runners.append(runner)
+        host, port = runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    def stop(self) -> None:
+        async def _cleanup() -> None:
+            for runner in self._runners:
+                await runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(_cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+class LoopLagMonitor:
+    """Sample how late the event loop wakes up from a short sleep."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+
+class BenchEnvironment:
+    """Fakes, the bot app and a client that talks to its webhook."""
+
+    def __init__(
+        self,
+        workdir: str | Path,
+        faults: FaultConfig | None = None,
+        telegram_latency: float = 0.0,
+        flood_limit: int = 0,
+        admin_id: int = 0,
+        reply_timeout: float = 10.0,
+        env: dict[str, str] | None = None,
+    ) -> None:
+        self.workdir = Path(workdir)
+        self.admin_id = admin_id
+        self.reply_timeout = reply_timeout
+        self.extra_env = env or {}
+        self.postgrest = FakePostgrest(faults)
+        self.telegram = FakeTelegram(
+            latency=telegram_latency, flood_limit=flood_limit, on_message=self._on_message
+        )
+        self.servers = ServerThread()
+        self.main: Any = None
+        self.url = ""
+        self._cwd = os.getcwd()
+        self._runner: web.AppRunner | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # chat id -> futures of updates still waiting for a reply, oldest first
+        self._waiters: dict[int, deque[asyncio.Future]] = {}
+        self._ids = itertools.count(1)
+        self.ack_latencies: list[float] = []
+        self.rejected = 0
+
+    # --- lifecycle ------------------------------------------------------------------
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        postgrest_url, telegram_url = self.servers.start(self.postgrest.app(), self.telegram.app())
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        os.chdir(self.workdir)
+        os.environ.update({
+            "BOT_TOKEN": BENCH_TOKEN,
+            "SUPABASE_URL": postgrest_url,
+            "SUPABASE_KEY": BENCH_KEY,
+            "ADMIN_ID": str(self.admin_id),
+            "IS_PROD": "0",
+            # Virtual users type far faster than people; measure the bot, not the throttle
+            "THROTTLE_ENABLED": "0",
+            **self.extra_env,
+        })
+        if str(REPO_ROOT) not in sys.path:
+            sys.path.insert(0, str(REPO_ROOT))
+
+        import log_utils  # noqa: F401 - installs the log handlers
+
+        # Keep the log files at their usual level but only warnings on the
+        # console, whose speed depends on the terminal rather than on the
+        # bot; stderr, so that stdout carries just the report
+        for handler in logging.getLogger().handlers:
+            if type(handler) is logging.StreamHandler and handler.stream is sys.stdout:
+                handler.setLevel(logging.WARNING)
+                handler.setStream(sys.stderr)
+
+        import main  # configured through the environment above
+        from aiogram.client.telegram import TelegramAPIServer
+
+        self.main = main
+        main.bot.session.api = TelegramAPIServer.from_base(telegram_url)
+        app = await main.create_app()
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}{main.WEBHOOK_PATH}"
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+        )
+        # The indexes load in the background on startup; wait for them
+        await main.job_index.ensure_loaded()
+        await main.subscription_index.ensure_loaded()
+
+    async def stop(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+        self.servers.stop()
+        os.chdir(self._cwd)
+
+    # --- traffic ------------------------------------------------------------------------
+
+    def message_update(self, chat_id: int, text: str, **extra: Any) -> dict[str, Any]:
+        return {
+            "update_id": next(self._ids),
+            "message": {
+                "message_id": next(self._ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"u{chat_id}"},
+                "text": text,
+                **extra,
+            },
+        }
+
+    def callback_update(self, chat_id: int, data: str, message_id: int = 1) -> dict[str, Any]:
+        return {
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "bench",
+                },
+            },
+        }
+
+    async def post(self, update: dict[str, Any]) -> int:
+        start = time.perf_counter()
+        async with self._session.post(self.url, json=update) as response:
+            await response.read()
+        self.ack_latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            self.rejected += 1
+        return response.status
+
+    async def send(self, update: dict[str, Any], chat_id: int) -> float | None:
+        """Post ``update`` and return seconds until the bot replied to ``chat_id``.
+
+        Returns ``None`` when the update was rejected or no reply came within
+        ``reply_timeout``. Several updates of one chat may be in flight; the
+        oldest one is credited with the next reply.
+        """
+        future = self._loop.create_future()
+        self._waiters.setdefault(chat_id, deque()).append(future)
+        start = time.perf_counter()
+        try:
+            if await self.post(update) != 200:
+                return None
+            replied_at = await asyncio.wait_for(future, self.reply_timeout)
+            return replied_at - start
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(chat_id)
+            if waiters is not None and future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(chat_id, None)
+
+    def _on_message(self, chat_id: int, method: str) -> None:
+        # Called on the fakes' thread
+        self._loop.call_soon_threadsafe(self._resolve, chat_id, time.perf_counter())
+
+    def _resolve(self, chat_id: int, replied_at: float) -> None:
+        waiters = self._waiters.get(chat_id)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(replied_at)
+                break
+        if not waiters:
+            self._waiters.pop(chat_id, None)
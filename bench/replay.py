@@ -0,0 +1,353 @@
+"""Replay ``actions.log`` against the bot as a load profile.
+
+Usage::
+
+    python -m bench.replay actions.log
+    python -m bench.replay logs/ --speed 10 --limit 5000
+    python -m bench.replay actions.log.20250101-000000.gz --rate 100
+
+Reads the live log and its rotated ``actions.log.<stamp>[-n].gz`` files
+(pass the log, a rotated file or a directory holding them) as a stream,
+rebuilds a Telegram update from every entry and posts the updates to the
+bot, running against the fakes of :mod:`bench.harness`, on the original
+schedule. ``--speed`` divides the original inter-arrival times, ``--rate``
+replaces them with a fixed rate. The replay is open-loop: an update is
+posted on schedule whether or not earlier ones were answered, as real
+users do.
+
+User ids are mapped to synthetic ids and message texts are scrubbed
+before they reach the bot: commands, keyboard labels and numbers are kept
+so that the same handlers run, every other word is replaced by a stable
+pseudoword of the same length and alphabet, and phone numbers keep their
+country and operator code only. ``--keep-text`` disables scrubbing for
+logs that hold no personal data.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from bench.harness import (
+    BenchEnvironment,
+    LoopLagMonitor,
+    REPO_ROOT,
+    add_fake_arguments,
+    fault_config,
+    seed,
+    summarize,
+)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+FIRST_USER_ID = 1_000_000
+# Words up to this length ("в", "до", "за") carry no personal data
+SHORT_WORD = 2
+# Digit runs at least this long are treated as phone numbers
+PHONE_DIGITS = 7
+PHONE_PREFIX = 5
+
+_PHONE = re.compile(r"\+?\d[\d ()-]{5,}\d")
+_TOKEN = re.compile(r"\d+|[^\W\d_]+")
+_CYRILLIC = "абвгдежзиклмнопрстуфхцчшэюя"
+_LATIN = "abcdefghijklmnopqrstuvwxyz"
+
+
+# --- reading ------------------------------------------------------------------------------
+
+def log_files(paths: Iterable[str | Path]) -> list[Path]:
+    """Expand ``paths`` into log files, oldest first.
+
+    A directory stands for every ``actions.log*`` file in it; a live log
+    comes after the files rotated out of it.
+    """
+    # Imported late, like the bot itself: see BenchEnvironment.start()
+    from action_log import rotated_files, rotation_order
+
+    files: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(rotated_files(path))
+        else:
+            files.append(path)
+    return sorted(dict.fromkeys(files), key=rotation_order)
+
+
+def read_lines(files: Iterable[Path]) -> Iterator[str]:
+    for path in files:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def parse(lines: Iterable[str]) -> Iterator[dict[str, Any]]:
+    """Entries that describe a user action; malformed lines are skipped."""
+    for line in lines:
+        try:
+            entry = json.loads(line)
+            entry["at"] = datetime.strptime(entry["timestamp"], TIMESTAMP_FORMAT).timestamp()
+        except (ValueError, KeyError, TypeError):
+            continue
+        if entry.get("user_id") is None or not isinstance(entry.get("content"), dict):
+            continue
+        if entry.get("event_type") in ("Message", "CallbackQuery"):
+            yield entry
+
+
+def spread(entries: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+    """Spread entries logged within one second evenly over that second.
+
+    ``actions.log`` has one-second timestamps; replaying a second's worth
+    of actions as one burst would exaggerate the peaks.
+    """
+    for _, group in itertools.groupby(entries, key=lambda entry: int(entry["at"])):
+        group = list(group)
+        for n, entry in enumerate(group):
+            entry["at"] += n / len(group)
+            yield entry
+
+
+# --- anonymising --------------------------------------------------------------------------
+
+def _keyboard_labels() -> set[str]:
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    import keyboards
+
+    labels = set()
+    for markup in (keyboards.menu_keyboard, keyboards.register_keyboard, keyboards.phone_keyboard):
+        labels.update(button.text for row in markup.keyboard for button in row)
+    return labels
+
+
+class Anonymizer:
+    """Consistently replace user ids, usernames and free text."""
+
+    def __init__(self, salt: str, keep_text: bool = False) -> None:
+        self.salt = salt.encode()
+        self.keep_text = keep_text
+        self.labels = _keyboard_labels()
+        self._users: dict[int, int] = {}
+
+    @property
+    def users(self) -> int:
+        return len(self._users)
+
+    def user_id(self, original: int) -> int:
+        if original not in self._users:
+            self._users[original] = FIRST_USER_ID + len(self._users)
+        return self._users[original]
+
+    def _rng(self, value: str) -> random.Random:
+        digest = hashlib.blake2b(value.encode(), key=self.salt, digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+    def _phone(self, match: re.Match) -> str:
+        number = match.group()
+        if sum(char.isdigit() for char in number) < PHONE_DIGITS:
+            return number  # prices, counts
+        rng = self._rng(re.sub(r"\D", "", number))
+        kept, chars = 0, []
+        for char in number:
+            if char.isdigit():
+                kept += 1
+                if kept > PHONE_PREFIX:
+                    char = rng.choice("0123456789")
+            chars.append(char)
+        return "".join(chars)
+
+    def _word(self, word: str) -> str:
+        if word.isdigit() or len(word) <= SHORT_WORD:
+            return word
+        alphabet = _CYRILLIC if re.search("[а-яё]", word.lower()) else _LATIN
+        rng = self._rng(word.lower())
+        fake = "".join(rng.choice(alphabet) for _ in word)
+        return fake.capitalize() if word[0].isupper() else fake
+
+    def text(self, text: str | None) -> str | None:
+        if not text or self.keep_text:
+            return text
+        stripped = text.strip()
+        if stripped in self.labels:
+            return text
+        if stripped.startswith("/"):
+            command, _, rest = stripped.partition(" ")
+            return f"{command} {self.text(rest)}" if rest else command
+        text = _PHONE.sub(self._phone, text)
+        return _TOKEN.sub(lambda match: self._word(match.group()), text)
+
+    def phone(self, user_id: int) -> str:
+        rng = self._rng(str(user_id))
+        return "+37529" + "".join(rng.choice("0123456789") for _ in range(7))
+
+
+# --- updates ------------------------------------------------------------------------------
+
+def build_update(env: BenchEnvironment, entry: dict[str, Any], anonymizer: Anonymizer) -> tuple[int, dict[str, Any]]:
+    """``(chat_id, update)`` equivalent to the logged action."""
+    chat_id = anonymizer.user_id(entry["user_id"])
+    content = entry["content"]
+    if entry["event_type"] == "CallbackQuery":
+        return chat_id, env.callback_update(chat_id, content.get("data") or "", content.get("message_id") or 1)
+
+    kind = content.get("content_type") or "text"
+    if kind == "contact":
+        extra = {"contact": {"phone_number": anonymizer.phone(chat_id), "first_name": "Bench", "user_id": chat_id}}
+        update = env.message_update(chat_id, "", **extra)
+        del update["message"]["text"]
+    elif kind in ("photo", "document"):
+        caption = anonymizer.text(content.get("caption"))
+        if kind == "photo":
+            extra = {"photo": [{"file_id": "bench", "file_unique_id": "bench", "width": 1, "height": 1}]}
+        else:
+            extra = {"document": {"file_id": "bench", "file_unique_id": "bench", "file_name": "bench.bin"}}
+        update = env.message_update(chat_id, "", **extra, **({"caption": caption} if caption else {}))
+        del update["message"]["text"]
+    else:
+        update = env.message_update(chat_id, anonymizer.text(content.get("text")) or "")
+    return chat_id, update
+
+
+def schedule(entries: Iterable[dict[str, Any]], speed: float = 1.0, rate: float | None = None) -> Iterator[tuple[float, dict[str, Any]]]:
+    """``(offset, entry)`` pairs, offsets in seconds from the replay start.
+
+    Long gaps in the log (nights, outages) are replayed as they are; use
+    ``--rate`` for a steady load instead.
+    """
+    first = None
+    for n, entry in enumerate(entries):
+        if rate:
+            yield n / rate, entry
+            continue
+        if first is None:
+            first = entry["at"]
+        yield (entry["at"] - first) / speed, entry
+
+
+# --- driver -------------------------------------------------------------------------------
+
+async def replay(env: BenchEnvironment, args: argparse.Namespace) -> dict[str, Any]:
+    anonymizer = Anonymizer(args.salt, keep_text=args.keep_text)
+    entries = spread(parse(read_lines(log_files(args.paths))))
+    if args.limit:
+        entries = itertools.islice(entries, args.limit)
+
+    latencies: list[float] = []
+    lateness: list[float] = []
+    kinds: dict[str, int] = {}
+    failures = 0
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    tasks: set[asyncio.Task] = set()
+
+    async def deliver(chat_id: int, update: dict[str, Any]) -> None:
+        nonlocal failures
+        try:
+            latency = await env.send(update, chat_id)
+        finally:
+            in_flight.release()
+        if latency is None:
+            failures += 1
+        else:
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    for offset, entry in schedule(entries, args.speed, args.rate):
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await in_flight.acquire()
+        lateness.append(max(0.0, time.perf_counter() - started - offset))
+        chat_id, update = build_update(env, entry, anonymizer)
+        kind = "callback" if "callback_query" in update else entry["content"].get("content_type") or "text"
+        kinds[kind] = kinds.get(kind, 0) + 1
+        task = asyncio.create_task(deliver(chat_id, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    # Not every update gets a reply (e.g. unknown callbacks); those show
+    # up as failures after ``reply_timeout``
+    sent = sum(kinds.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "updates": sent,
+        "users": anonymizer.users,
+        "kinds": kinds,
+        "answered": len(latencies),
+        "failures": failures,
+        "updates_per_sec": round(sent / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "lateness_ms": summarize(lateness),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="joby-replay-") as workdir:
+        env = BenchEnvironment(
+            workdir,
+            faults=fault_config(args),
+            telegram_latency=args.tg_latency,
+            flood_limit=args.flood_limit or 0,
+            reply_timeout=args.reply_timeout,
+        )
+        seed(env, args.jobs, args.seed_users)
+        await env.start()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        try:
+            result = await replay(env, args)
+        finally:
+            await monitor.stop()
+            await env.stop()
+    return {
+        "profile": f"replay@{args.rate:g}/s" if args.rate else f"replay@{args.speed:g}x",
+        **result,
+        "ack_ms": summarize(env.ack_latencies),
+        "rejected": env.rejected,
+        "loop_lag_ms": summarize(monitor.samples),
+        "postgrest": {"requests": env.postgrest.requests, "injected_errors": env.postgrest.errors},
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="actions.log, rotated .gz files or directories")
+    timing = parser.add_mutually_exclusive_group()
+    timing.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    timing.add_argument("--rate", type=float, help="ignore recorded times and post N updates per second")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N actions")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="cap on unanswered updates")
+    parser.add_argument("--reply-timeout", type=float, default=5.0, help="seconds to wait for a reply")
+    parser.add_argument("--keep-text", action="store_true", help="post message texts unchanged")
+    parser.add_argument("--salt", default="joby-replay", help="salt of the text pseudonymisation")
+    add_fake_arguments(parser)
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if args.speed <= 0 or (args.rate is not None and args.rate <= 0):
+        parser.error("--speed and --rate must be positive")
+    # The app runs in a scratch directory; resolve paths before it starts
+    args.paths = [Path(path).resolve() for path in args.paths]
+    if args.output:
+        args.output = args.output.resolve()
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    print(report)
+    if args.output:
+        args.output.write_text(report + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""Load test of the webhook app with latency/throughput regression checks.
+
+Usage::
+
+    python -m bench.run mixed --rate 50 --duration 30
+    python -m bench.run search --rate 100 --pg-latency 0.02 --check
+    python -m bench.run broadcast --recipients 2000 --flood-limit 30
+    python -m bench.run broadcast --recipients 500 --flood-limit 10 --restart-after 0.5
+    python -m bench.run mixed --rate 50 --repeat 3 --update-baseline
+
+Virtual users walk through the bot's flows (/start, full registration,
+adding a job, searching) while a token bucket keeps the total rate of
+posted updates at ``--rate``. The ``broadcast`` scenario measures how fast
+``/broadcast`` drains through the delivery scheduler and fails when a
+recipient got the message twice or not at all; a ``--flood-limit`` below
+``DELIVERY_RATE`` makes the fake API answer 429, and ``--restart-after``
+stops and restarts the scheduler midway, so the run also covers
+``RetryAfter`` handling and resuming from the outbox. ``--check`` compares
+the result with ``bench/baseline.json`` and exits with status 1 when a
+metric is worse than the baseline by more than ``--tolerance``; tail
+latencies are noisy, so use ``--repeat`` to compare medians of several runs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from bench.harness import (
+    CITIES,
+    WORDS,
+    BenchEnvironment,
+    LoopLagMonitor,
+    add_fake_arguments,
+    fault_config,
+    seed,
+    summarize,
+)
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+ADMIN_ID = 999
+# Upper bound for stopping the delivery scheduler or the whole bot
+STOP_TIMEOUT = 30.0
+
+# metric path -> True if higher is better
+CHECKED_METRICS = {
+    "latency_ms.p95": False,
+    "latency_ms.p99": False,
+    "loop_lag_ms.p99": False,
+    "updates_per_sec": True,
+    "messages_per_sec": True,
+}
+
+
+# --- scenarios ----------------------------------------------------------------------------
+
+class VirtualUser:
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id
+        self.registered = False
+        self.jobs = 0
+
+
+def register_flow(user: VirtualUser) -> Iterator[tuple[str, str]]:
+    yield "start", "/start"
+    yield "register", "🔐 Зарегистрироваться"
+    yield "register", f"Bench {user.id}"
+    yield "register", random.choice(CITIES)
+    yield "register", f"+37529{user.id % 10_000_000:07d}"
+    user.registered = True
+
+
+def start_flow(user: VirtualUser) -> Iterator[tuple[str, str]]:
+    yield "start", "/start"
+
+
+def add_job_flow(user: VirtualUser) -> Iterator[tuple[str, str]]:
+    if not user.registered:
+        yield from register_flow(user)
+    user.jobs += 1
+    yield "add_job", "➕ Разместить подработку"
+    yield "add_job", f"{random.choice(WORDS).capitalize()} #{user.jobs}"
+    yield "add_job", f"Нагрузочный тест, пользователь {user.id}"
+    yield "add_job", str(random.randrange(20, 200))
+
+
+def search_flow(user: VirtualUser) -> Iterator[tuple[str, str]]:
+    yield "search", "📢 Найти подработку"
+    yield "search", f"{random.choice(WORDS)} {random.choice(CITIES)}"
+
+
+def mixed_flow(user: VirtualUser) -> Iterator[tuple[str, str]]:
+    flow = random.choices(
+        [start_flow, search_flow, add_job_flow, register_flow],
+        weights=[2, 5, 2, 1],
+    )[0]
+    yield from flow(user)
+
+
+SCENARIOS: dict[str, Callable[[VirtualUser], Iterator[tuple[str, str]]]] = {
+    "start": start_flow,
+    "registration": register_flow,
+    "add_job": add_job_flow,
+    "search": search_flow,
+    "mixed": mixed_flow,
+}
+
+
+# --- runners ------------------------------------------------------------------------------
+
+async def run_flows(env: BenchEnvironment, args: argparse.Namespace) -> dict[str, Any]:
+    from rate_limit import TokenBucket
+
+    flow = SCENARIOS[args.scenario]
+    pacer = TokenBucket(args.rate, capacity=1)
+    latencies: list[float] = []
+    steps: dict[str, list[float]] = {}
+    failures = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def virtual_user(n: int) -> None:
+        nonlocal failures
+        user = VirtualUser(1_000_000 + n)
+        while time.perf_counter() < deadline:
+            for kind, text in flow(user):
+                try:
+                    await asyncio.wait_for(pacer.acquire(), deadline - time.perf_counter())
+                except asyncio.TimeoutError:
+                    return
+                latency = await env.send(env.message_update(user.id, text), user.id)
+                if latency is None:
+                    failures += 1
+                    break  # the conversation is out of sync; start a new flow
+                latencies.append(latency)
+                steps.setdefault(kind, []).append(latency)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(n) for n in range(args.users)))
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "updates": len(latencies),
+        "failures": failures,
+        "updates_per_sec": round(len(latencies) / elapsed, 2),
+        "latency_ms": summarize(latencies),
+        "steps": {kind: {"count": len(values), **summarize(values)} for kind, values in sorted(steps.items())},
+    }
+
+
+def broadcast_timeout(args: argparse.Namespace) -> float:
+    """Seconds a broadcast may take before its missing messages count as lost.
+
+    The drain rate is the slower of the scheduler's ``DELIVERY_RATE`` and
+    the fake's flood limit; twice the time that takes plus a margin leaves
+    room for flood waits and a restart. ``--duration`` only raises it.
+    """
+    rate = float(os.getenv("DELIVERY_RATE", "25"))
+    if args.flood_limit:
+        rate = min(rate, args.flood_limit)
+    return max(args.duration, 2 * args.recipients / rate + 10)
+
+
+async def run_broadcast(env: BenchEnvironment, args: argparse.Namespace) -> dict[str, Any]:
+    await asyncio.sleep(0.5)  # let the startup notification to the admin go out
+    sent_before = env.telegram.sent
+    started = time.perf_counter()
+    ack = await env.send(env.message_update(ADMIN_ID, "/broadcast Нагрузочный тест рассылки"), ADMIN_ID)
+    if ack is None:
+        raise RuntimeError("/broadcast was not acknowledged")
+    target = sent_before + args.recipients + 1  # + the admin's confirmation
+    deadline = started + broadcast_timeout(args)
+    restarted = False
+    while env.telegram.sent < target and time.perf_counter() < deadline:
+        if args.restart_after and not restarted and env.telegram.sent - sent_before >= args.restart_after * args.recipients:
+            # A worker restart mid-broadcast: messages in flight finish,
+            # the rest must be picked up again from the outbox
+            await asyncio.wait_for(env.main.delivery.stop(), STOP_TIMEOUT)
+            env.main.delivery.start()
+            restarted = True
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    delivered = env.telegram.sent - sent_before - 1
+    # Seeded users (see harness.seed) are the recipients
+    received = [env.telegram.chats[5_000_000 + n] for n in range(args.recipients)]
+    return {
+        "recipients": args.recipients,
+        "delivered": delivered,
+        "lost": received.count(0),
+        "duplicated": sum(1 for count in received if count > 1),
+        "restarted": restarted,
+        "duration_s": round(elapsed, 2),
+        "messages_per_sec": round(delivered / elapsed, 2),
+        "flood_waits": env.telegram.flood_waits,
+        "delivery": env.main.delivery.stats(),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="joby-bench-") as workdir:
+        env = BenchEnvironment(
+            workdir,
+            faults=fault_config(args),
+            telegram_latency=args.tg_latency,
+            flood_limit=args.flood_limit,
+            admin_id=ADMIN_ID,
+        )
+        # Every seeded user receives the broadcast
+        users = args.recipients if args.scenario == "broadcast" else args.seed_users
+        seed(env, args.jobs, users)
+        await env.start()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        # A scenario stuck on the bot must still end with a report or an error
+        timeout = broadcast_timeout(args) if args.scenario == "broadcast" else args.duration
+        try:
+            if args.scenario == "broadcast":
+                scenario = run_broadcast(env, args)
+            else:
+                scenario = run_flows(env, args)
+            result = await asyncio.wait_for(scenario, timeout + STOP_TIMEOUT)
+        finally:
+            await monitor.stop()
+            try:
+                await asyncio.wait_for(env.stop(), STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"Bot shutdown took over {STOP_TIMEOUT:g}s; abandoned", file=sys.stderr)
+    return {
+        "profile": profile_name(args),
+        **result,
+        "ack_ms": summarize(env.ack_latencies),
+        "rejected": env.rejected,
+        "loop_lag_ms": summarize(monitor.samples),
+        "postgrest": {"requests": env.postgrest.requests, "injected_errors": env.postgrest.errors},
+    }
+
+
+# --- baseline -----------------------------------------------------------------------------
+
+def profile_name(args: argparse.Namespace) -> str:
+    if args.scenario == "broadcast":
+        return f"broadcast@{args.recipients}"
+    return f"{args.scenario}@{args.rate:g}"
+
+
+def _lookup(result: dict[str, Any], path: str) -> float | None:
+    value: Any = result
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], tolerance: float, slack_ms: float) -> list[str]:
+    """Metrics of ``result`` that regressed against ``baseline``."""
+    regressions = []
+    for path, higher_is_better in CHECKED_METRICS.items():
+        current, expected = _lookup(result, path), _lookup(baseline, path)
+        if current is None or expected is None:
+            continue
+        if higher_is_better:
+            limit = expected * (1 - tolerance)
+            worse = current < limit
+        else:
+            # Absolute slack keeps sub-millisecond noise from failing the run
+            limit = expected * (1 + tolerance) + slack_ms
+            worse = current > limit
+        if worse:
+            regressions.append(f"{path}: {current} (baseline {expected}, limit {round(limit, 2)})")
+    return regressions
+
+
+def _set(result: dict[str, Any], path: str, value: float) -> None:
+    *parents, leaf = path.split(".")
+    for part in parents:
+        result = result[part]
+    result[leaf] = value
+
+
+def run_repeated(argv: list[str], repeat: int) -> dict[str, Any]:
+    """Run the benchmark ``repeat`` times in fresh processes and take medians.
+
+    The bot keeps module-level state, so every run needs its own
+    interpreter. Checked metrics are replaced by their median over the runs;
+    the rest of the report is that of the run with the median p95 latency.
+    """
+    results = []
+    for n in range(repeat):
+        print(f"Run {n + 1}/{repeat}", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.run", *argv],
+            check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+        results.append(json.loads(output))
+    ordered = sorted(results, key=lambda result: _lookup(result, "latency_ms.p95") or 0)
+    combined = json.loads(json.dumps(ordered[len(ordered) // 2]))
+    for path in CHECKED_METRICS:
+        values = [value for value in (_lookup(result, path) for result in results) if value is not None]
+        if values:
+            _set(combined, path, round(statistics.median(values), 2))
+    combined["runs"] = repeat
+    return combined
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=[*SCENARIOS, "broadcast"])
+    parser.add_argument("--rate", type=float, default=50, help="updates per second")
+    parser.add_argument(
+        "--duration", type=float, default=20,
+        help="seconds; for broadcast, the least time to wait for delivery",
+    )
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--recipients", type=int, default=1000, help="broadcast recipients")
+    parser.add_argument(
+        "--restart-after", type=float, default=0,
+        help="restart the delivery scheduler once this share of the broadcast is sent",
+    )
+    add_fake_arguments(parser)
+    parser.add_argument("--check", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--repeat", type=int, default=1, help="runs to take the median of")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    parser.add_argument("--slack-ms", type=float, default=5.0, help="allowed absolute latency regression")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+    if args.flood_limit is None:
+        args.flood_limit = 30 if args.scenario == "broadcast" else 0
+    # The app runs in a scratch directory; resolve paths before it starts
+    args.baseline = args.baseline.resolve()
+    if args.output:
+        args.output = args.output.resolve()
+
+    if args.repeat > 1:
+        # Same scenario without the options handled by this process
+        options = {"--check", "--update-baseline", "--repeat", "--output", "--baseline"}
+        child_argv, skip = [], False
+        for arg in argv:
+            if skip:
+                skip = False
+                continue
+            name = arg.split("=", 1)[0]
+            if name in options:
+                skip = "=" not in arg and name in {"--repeat", "--output", "--baseline"}
+                continue
+            child_argv.append(arg)
+        result = run_repeated(child_argv, args.repeat)
+    else:
+        result = asyncio.run(run(args))
+    report = json.dumps(result, ensure_ascii=False, indent=2)
+    print(report)
+    if args.output:
+        args.output.write_text(report + "\n", encoding="utf-8")
+    if result.get("lost") or result.get("duplicated"):
+        print(f"Broadcast lost {result['lost']} and duplicated {result['duplicated']} messages", file=sys.stderr)
+        return 1
+
+    baselines = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    if args.update_baseline:
+        baselines[result["profile"]] = result
+        args.baseline.write_text(json.dumps(baselines, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline for {result['profile']} saved to {args.baseline}", file=sys.stderr)
+    if args.check:
+        baseline = baselines.get(result["profile"])
+        if baseline is None:
+            print(f"No baseline for {result['profile']}", file=sys.stderr)
+            return 1
+        regressions = compare(result, baseline, args.tolerance, args.slack_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+import os
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from cache import TTLCache
+from log_utils import logger
+
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "3600"))
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """Drop updates whose ``update_id`` was already seen.
+
+    Telegram redelivers updates when the webhook answers slowly; without
+    this filter a redelivered ``/start`` or price step would run its
+    handler, and its writes, a second time. Seen ids are kept in a
+    bounded TTL/LRU cache, so a duplicate costs one dictionary lookup.
+    """
+
+    def __init__(self, maxsize: int = UPDATE_DEDUP_SIZE, ttl: float = UPDATE_DEDUP_TTL) -> None:
+        self._seen = TTLCache(maxsize, ttl)
+        self.duplicates = 0
+
+    async def __call__(self, handler, event: Update, data):
+        if event.update_id in self._seen:
+            self.duplicates += 1
+            logger.info(f"Skipping duplicate update {event.update_id}")
+            return None
+        self._seen.set(event.update_id, True)
+        return await handler(event, data)
@@ -0,0 +1,387 @@
+"""Rate-limited delivery of notifications and broadcasts.
+
+Messages are first written to a persistent outbox (a local SQLite
+database, see :mod:`local_db`) and then sent by a single scheduler task.
+The task respects a global token bucket (Telegram allows about 30
+messages per second per bot) and per-chat buckets (about one message per
+second per chat), and limits the number of concurrent requests. A
+``TelegramRetryAfter`` pauses the global bucket for the requested time,
+halves its rate and puts the message back into the outbox without counting
+it as a failed attempt; every message sent afterwards raises the rate
+again, by about one message per second each second, up to
+``DELIVERY_RATE`` (additive increase, multiplicative decrease). Other errors are retried with exponential backoff, and chats that
+blocked the bot or do not exist are marked as failed immediately.
+Pending messages survive restarts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from local_db import DATA_DIR, LocalDB
+from log_utils import logger
+from rate_limit import KeyedBuckets, TokenBucket
+
+DELIVERY_DB_PATH = os.getenv("DELIVERY_DB_PATH", str(DATA_DIR / "outbox.sqlite3"))
+DELIVERY_RATE = float(os.getenv("DELIVERY_RATE", "25"))
+DELIVERY_PER_CHAT_RATE = float(os.getenv("DELIVERY_PER_CHAT_RATE", "1"))
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "10"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_RETENTION = float(os.getenv("DELIVERY_RETENTION", str(7 * 24 * 3600)))
+
+PENDING, SENDING, SENT, FAILED = "pending", "sending", "sent", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    markup TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    owner TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_batch ON outbox (batch, status);
+"""
+
+
+@dataclass
+class _Delivery:
+    id: int
+    batch: str
+    chat_id: int
+    attempts: int
+
+
+class DeliveryScheduler:
+    """Drain the outbox within Telegram's global and per-chat limits."""
+
+    claim_timeout = 120.0
+    poll_interval = 1.0
+    # Floor of the global rate after repeated flood waits
+    min_rate = 1.0
+    # Finished batches are forgotten this often, not only at startup
+    purge_interval = 3600.0
+
+    def __init__(
+        self,
+        path: str = DELIVERY_DB_PATH,
+        rate: float = DELIVERY_RATE,
+        per_chat_rate: float = DELIVERY_PER_CHAT_RATE,
+        concurrency: int = DELIVERY_CONCURRENCY,
+        max_attempts: int = DELIVERY_MAX_ATTEMPTS,
+    ) -> None:
+        self.bot: Any = None
+        # Start the scheduler on the first enqueue; off when another
+        # component (see :mod:`scheduler`) decides where it runs
+        self.autostart = True
+        # Identifies this process's claims in the shared outbox
+        self._owner = uuid.uuid4().hex
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self._db = LocalDB(path, _SCHEMA)
+        # Tiny burst allowance only: Telegram counts messages over a sliding
+        # window, so a full second of burst would trigger flood control
+        self.rate = rate
+        self._global = TokenBucket(rate, capacity=max(1.0, rate / 20))
+        # Flood waits until then belong to the one that already cut the rate
+        self._slowed_until = 0.0
+        self._chats = KeyedBuckets(per_chat_rate, capacity=1)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._batches: dict[str, tuple[str, InlineKeyboardMarkup | None]] = {}
+        self._results: list[tuple[str, int, float, str | None, int]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self._inflight: set[asyncio.Task] = set()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.flood_waits = 0
+
+    # --- producer side ------------------------------------------------------------------
+
+    async def enqueue(
+        self,
+        chat_ids: Iterable[int],
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> str:
+        """Persist one message for every chat and return the batch id."""
+        batch = uuid.uuid4().hex[:12]
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        count = await self._db.run(self._insert, batch, text, markup, list(dict.fromkeys(chat_ids)))
+        logger.info(f"Delivery batch {batch}: {count} messages queued")
+        self._ensure_started()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return batch
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, batch: str, text: str, markup: str | None, chat_ids: list[int]) -> int:
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT INTO batches (id, text, markup, created_at) VALUES (?, ?, ?, ?)",
+                (batch, text, markup, now),
+            )
+            conn.executemany(
+                "INSERT INTO outbox (batch, chat_id, next_attempt_at) VALUES (?, ?, ?)",
+                [(batch, chat_id, now) for chat_id in chat_ids],
+            )
+        return len(chat_ids)
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def setup(self, bot: Any, autostart: bool = True) -> None:
+        self.bot = bot
+        self.autostart = autostart
+
+    def _ensure_started(self) -> None:
+        if self._task is None and self.bot is not None and self.autostart:
+            self.start()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop claiming new messages and wait for the ones in flight."""
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._flush_results()
+        # Anything still claimed goes back to the queue for the next start
+        await self._db.run(self._release_claims)
+        await self._db.close()
+
+    # --- scheduler --------------------------------------------------------------------------
+
+    async def _run(self) -> None:
+        next_purge = 0.0
+        # The flag ends the loop if an enqueue during stop() makes wait_for()
+        # return instead of passing the cancellation on
+        while not self._stopping:
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + self.purge_interval
+                try:
+                    await self._db.run(self._purge)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Delivery outbox purge failed")
+            try:
+                rows = await self._db.run(self._claim, self.concurrency * 4)
+                if not rows:
+                    await self._flush_results()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                for row in rows:
+                    await self._dispatch(row)
+                await self._flush_results()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Delivery scheduler error")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _dispatch(self, row: _Delivery) -> None:
+        chat = self._chats.get(row.chat_id)
+        if not chat.try_acquire():
+            self._reschedule(row, chat.delay(), attempts=row.attempts)
+            return
+        await self._slots.acquire()
+        await self._global.acquire()
+        task = asyncio.create_task(self._deliver(row))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, row: _Delivery) -> None:
+        try:
+            text, markup = await self._batch(row.batch)
+            await self.bot.send_message(chat_id=row.chat_id, text=text, reply_markup=markup)
+        except TelegramRetryAfter as e:
+            self.flood_waits += 1
+            self._slow_down(e.retry_after)
+            self._reschedule(row, e.retry_after, attempts=row.attempts, error=str(e))
+        except (TelegramForbiddenError, TelegramNotFound, TelegramBadRequest) as e:
+            self.failed += 1
+            self._results.append((FAILED, row.attempts + 1, 0.0, str(e), row.id))
+        except Exception as e:
+            attempts = row.attempts + 1
+            if attempts >= self.max_attempts:
+                self.failed += 1
+                self._results.append((FAILED, attempts, 0.0, str(e), row.id))
+            else:
+                self.retried += 1
+                backoff = min(300.0, 2 ** attempts) * random.uniform(0.5, 1.0)
+                self._reschedule(row, backoff, attempts=attempts, error=str(e))
+        else:
+            self.sent += 1
+            self._results.append((SENT, row.attempts + 1, 0.0, None, row.id))
+            self._speed_up()
+        finally:
+            self._slots.release()
+
+    def _slow_down(self, retry_after: float) -> None:
+        """Pause for ``retry_after`` and halve the global rate, once per flood wait.
+
+        Sends already in flight when Telegram starts refusing get the same
+        answer; they extend the pause but do not cut the rate again.
+        """
+        self._global.block(retry_after)
+        now = time.monotonic()
+        if now >= self._slowed_until:
+            self._global.rate = max(self.min_rate, self._global.rate / 2)
+            logger.warning(f"Delivery flood wait {retry_after}s, rate lowered to {self._global.rate:g}/s")
+        self._slowed_until = max(self._slowed_until, now + retry_after)
+
+    def _speed_up(self) -> None:
+        # +1/rate per message is about +1 message/s for every second of sending
+        bucket = self._global
+        if bucket.rate < self.rate:
+            bucket.rate = min(self.rate, bucket.rate + 1 / bucket.rate)
+
+    def _reschedule(self, row: _Delivery, delay: float, attempts: int, error: str | None = None) -> None:
+        self._results.append((PENDING, attempts, time.time() + delay, error, row.id))
+
+    async def _batch(self, batch: str) -> tuple[str, InlineKeyboardMarkup | None]:
+        cached = self._batches.get(batch)
+        if cached is None:
+            text, markup = await self._db.run(
+                lambda conn: conn.execute(
+                    "SELECT text, markup FROM batches WHERE id = ?", (batch,)
+                ).fetchone()
+            )
+            cached = (text, InlineKeyboardMarkup.model_validate_json(markup) if markup else None)
+            if len(self._batches) > 100:
+                self._batches.clear()
+            self._batches[batch] = cached
+        return cached
+
+    async def _flush_results(self) -> None:
+        if not self._results:
+            return
+        results, self._results = self._results, []
+        await self._db.run(self._store_results, results)
+
+    # --- database thread ----------------------------------------------------------------------
+
+    def _claim(self, conn: sqlite3.Connection, limit: int) -> list[_Delivery]:
+        now = time.time()
+        with conn:
+            rows = conn.execute(
+                "UPDATE outbox SET status = ?, claimed_at = ?, owner = ? WHERE id IN ("
+                " SELECT id FROM outbox"
+                " WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND claimed_at < ?)"
+                " ORDER BY next_attempt_at LIMIT ?"
+                ") RETURNING id, batch, chat_id, attempts",
+                (SENDING, now, self._owner, PENDING, now, SENDING, now - self.claim_timeout, limit),
+            ).fetchall()
+        return [_Delivery(*row) for row in rows]
+
+    @staticmethod
+    def _store_results(conn: sqlite3.Connection, results: list[tuple]) -> None:
+        with conn:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?,"
+                " last_error = ?, claimed_at = NULL WHERE id = ?",
+                results,
+            )
+
+    @staticmethod
+    def _purge(conn: sqlite3.Connection) -> None:
+        """Forget finished batches older than ``DELIVERY_RETENTION``."""
+        cutoff = time.time() - DELIVERY_RETENTION
+        with conn:
+            conn.execute(
+                "DELETE FROM outbox WHERE status IN (?, ?) AND batch IN"
+                " (SELECT id FROM batches WHERE created_at < ?)",
+                (SENT, FAILED, cutoff),
+            )
+            conn.execute(
+                "DELETE FROM batches WHERE created_at < ? AND id NOT IN (SELECT batch FROM outbox)",
+                (cutoff,),
+            )
+
+    def _release_claims(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, claimed_at = NULL WHERE status = ? AND owner = ?",
+                (PENDING, SENDING, self._owner),
+            )
+
+    # --- metrics ------------------------------------------------------------------------------
+
+    async def progress(self, batch: str | None = None) -> dict[str, int]:
+        """Message counts by status, for one batch or the whole outbox."""
+        def _count(conn: sqlite3.Connection) -> dict[str, int]:
+            if batch is None:
+                rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            else:
+                rows = conn.execute(
+                    "SELECT status, COUNT(*) FROM outbox WHERE batch = ? GROUP BY status",
+                    (batch,),
+                )
+            return dict(rows.fetchall())
+
+        return await self._db.run(_count)
+
+    async def last_batch(self) -> str | None:
+        row = await self._db.run(
+            lambda conn: conn.execute(
+                "SELECT id FROM batches ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+        )
+        return row[0] if row else None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "rate": round(self._global.rate, 2),
+            "in_flight": len(self._inflight),
+        }
+
+
+delivery = DeliveryScheduler()
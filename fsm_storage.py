@@ -0,0 +1,182 @@
+"""FSM storage backends shared between worker processes.
+
+``MemoryStorage`` keeps ``RegisterState``/``AddJob`` progress inside one
+process, so under several gunicorn workers a user's next update may land
+on a worker that knows nothing about their conversation, and everything is
+lost on restart. :class:`SQLiteStorage` keeps the state in a local SQLite
+database in WAL mode, which any number of processes on the host can share.
+
+Writes are buffered for ``flush_delay`` seconds so that the usual
+``update_data`` + ``set_state`` pair of a handler becomes one transaction;
+reads see buffered writes of the same process immediately. States that
+were not touched for ``state_ttl`` seconds are treated as abandoned and
+removed by a periodic sweep.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from local_db import DATA_DIR, LocalDB
+from log_utils import logger
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", str(DATA_DIR / "fsm.sqlite3"))
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "0.05"))
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at);
+"""
+
+_UPSERT_STATE = (
+    "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at"
+)
+_UPSERT_DATA = (
+    "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at"
+)
+
+
+class SQLiteStorage(BaseStorage):
+    """Process-shared FSM storage on top of SQLite/WAL."""
+
+    sweep_interval = 600.0
+
+    def __init__(
+        self,
+        path: str = FSM_SQLITE_PATH,
+        flush_delay: float = FSM_FLUSH_DELAY,
+        state_ttl: float = FSM_STATE_TTL,
+        key_builder: KeyBuilder | None = None,
+    ) -> None:
+        self.flush_delay = flush_delay
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._db = LocalDB(path, _SCHEMA)
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._last_sweep = 0.0
+        self._closed = False
+
+    # --- aiogram storage interface -------------------------------------------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._buffer(self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        db_key = self.key_builder.build(key)
+        pending = self._pending.get(db_key, {})
+        if "state" in pending:
+            return pending["state"]
+        row = await self._db.run(self._select, db_key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._buffer(self.key_builder.build(key), "data", data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        db_key = self.key_builder.build(key)
+        pending = self._pending.get(db_key, {})
+        if "data" in pending:
+            return pending["data"].copy()
+        row = await self._db.run(self._select, db_key)
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._db.close()
+
+    # --- write buffering --------------------------------------------------------------
+
+    def _buffer(self, db_key: str, field: str, value: Any) -> None:
+        self._pending.setdefault(db_key, {})[field] = value
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("FSM storage flush failed")
+
+    async def flush(self) -> None:
+        """Commit buffered writes in a single transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self._db.run(self._write, pending)
+        except Exception:
+            # Keep newer buffered values, restore the rest for the next flush
+            for db_key, fields in pending.items():
+                self._pending[db_key] = {**fields, **self._pending.get(db_key, {})}
+            raise
+
+    # --- database thread ----------------------------------------------------------------
+
+    def _select(self, conn: sqlite3.Connection, db_key: str) -> tuple[str | None, str] | None:
+        row = conn.execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?", (db_key,)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.state_ttl:
+            return None
+        return row[0], row[1]
+
+    def _write(self, conn: sqlite3.Connection, pending: dict[str, dict[str, Any]]) -> None:
+        now = time.time()
+        states = [(k, f["state"], now) for k, f in pending.items() if "state" in f]
+        datas = [
+            (k, json.dumps(f["data"], ensure_ascii=False), now)
+            for k, f in pending.items()
+            if "data" in f
+        ]
+        with conn:
+            conn.executemany(_UPSERT_STATE, states)
+            conn.executemany(_UPSERT_DATA, datas)
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(conn, now)
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        self._last_sweep = now
+        with conn:
+            cur = conn.execute(
+                "DELETE FROM fsm WHERE updated_at < ? OR (state IS NULL AND data = '{}')",
+                (now - self.state_ttl,),
+            )
+        if cur.rowcount:
+            logger.info(f"FSM storage: removed {cur.rowcount} expired states")
+
+
+def create_storage() -> BaseStorage:
+    """Build the FSM storage selected by ``FSM_STORAGE`` (``sqlite``/``memory``)."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown FSM_STORAGE: {FSM_STORAGE}")
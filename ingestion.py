@@ -0,0 +1,148 @@
+"""Webhook ingestion through a bounded queue and a pool of workers.
+
+``QueuedRequestHandler`` validates an incoming update, puts it into a
+queue and acknowledges Telegram right away; the Supabase round-trips and
+log writes of the handlers no longer delay the HTTP response. Updates are
+sharded by chat id over ``WEBHOOK_WORKERS`` consumer tasks, each with its
+own queue, so updates of one chat are processed one at a time and in
+order while different chats run concurrently. When a shard's queue is
+full the request is answered with 503 and Telegram redelivers it later,
+which is the backpressure signal.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+from pydantic import ValidationError
+
+from log_utils import logger
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Below gunicorn's graceful_timeout (30 s), so the rest of shutdown still runs
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))
+
+
+def update_chat_id(update: Update) -> int:
+    """Chat the update belongs to, used to keep per-chat ordering."""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Acknowledge updates immediately and process them on a worker pool."""
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        **data: Any,
+    ) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=False, **data)
+        shard_size = max(1, queue_size // workers)
+        self._queues: list[asyncio.Queue[Update]] = [
+            asyncio.Queue(maxsize=shard_size) for _ in range(workers)
+        ]
+        self._workers: list[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.processed = 0
+        self.failed = 0
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._start_workers)
+        super().register(app, path=path, **kwargs)
+
+    async def _start_workers(self, app: web.Application) -> None:
+        self._workers = [
+            asyncio.create_task(self._worker(queue), name=f"webhook-worker-{n}")
+            for n, queue in enumerate(self._queues)
+        ]
+
+    async def close(self) -> None:
+        """Finish queued updates, stop the workers and close the bot session.
+
+        Updates still queued after ``WEBHOOK_DRAIN_TIMEOUT`` seconds are
+        dropped; Telegram already has them acknowledged.
+        """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                WEBHOOK_DRAIN_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            left = sum(queue.qsize() for queue in self._queues)
+            logger.warning(f"Webhook queue not drained in {WEBHOOK_DRAIN_TIMEOUT:g} s, dropping {left} updates")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await super().close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            data = await request.json(loads=bot.session.json_loads)
+            update = Update.model_validate(data, context={"bot": bot})
+        except (ValueError, ValidationError):
+            self.invalid += 1
+            return web.Response(body="Bad Request", status=400)
+
+        queue = self._queues[update_chat_id(update) % len(self._queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(body="Busy", status=503)
+        self.accepted += 1
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
+
+    async def _worker(self, queue: asyncio.Queue[Update]) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                result = await self.dispatcher.feed_update(self.bot, update, **self.data)
+                if isinstance(result, TelegramMethod):
+                    await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Failed to process update {update.update_id}")
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict[str, int]:
+        depths = [queue.qsize() for queue in self._queues]
+        return {
+            "queue_depth": sum(depths),
+            "queue_depth_max_shard": max(depths),
+            "queue_capacity": sum(queue.maxsize for queue in self._queues),
+            "workers": len(self._workers),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "invalid": self.invalid,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
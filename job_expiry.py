@@ -0,0 +1,178 @@
+"""Expiry of job postings.
+
+Every job gets ``expires_at`` (``JOB_TTL_DAYS`` after posting). Two
+scheduled jobs (see :mod:`scheduler`), each run by one worker per host,
+keep the ``jobs`` table down to the active postings:
+
+* :func:`remind_expiring` offers the author to extend a posting
+  ``JOB_EXPIRY_NOTICE_HOURS`` before it expires, through the delivery
+  outbox with an inline "Продлить" button;
+* :func:`sweep_expired` moves expired rows to ``jobs_archive`` (or just
+  deletes them with ``JOB_ARCHIVE=0``) in batches of ``JOB_SWEEP_BATCH``,
+  at most ``JOB_SWEEP_MAX_BATCHES`` per run, so one run never holds long
+  locks or large responses.
+
+Workers drop expired jobs from their in-process search index on their own
+(:meth:`job_search.JobIndex.prune`); an extension made through another
+worker reaches their index with the next :meth:`job_search.JobIndex.refresh`.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from html import escape
+
+from aiogram import F, Router
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+
+from delivery import delivery
+from job_search import job_index, job_key, parse_timestamp
+from log_utils import logger
+from my_jobs import invalidate_my_jobs
+from stats_logger import StatsLogger
+from supabase_client import supabase, with_supabase_retry
+
+JOB_TTL_DAYS = float(os.getenv("JOB_TTL_DAYS", "14"))
+JOB_EXPIRY_NOTICE_HOURS = float(os.getenv("JOB_EXPIRY_NOTICE_HOURS", "24"))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "600"))
+JOB_SWEEP_BATCH = int(os.getenv("JOB_SWEEP_BATCH", "500"))
+JOB_SWEEP_MAX_BATCHES = int(os.getenv("JOB_SWEEP_MAX_BATCHES", "20"))
+JOB_ARCHIVE = os.getenv("JOB_ARCHIVE", "1").lower() in {"1", "true", "yes"}
+
+router = Router(name="job_expiry")
+
+
+def expires_at(created_at: datetime | None = None) -> str:
+    """``expires_at`` of a job posted at ``created_at`` (now by default, UTC)."""
+    return ((created_at or datetime.utcnow()) + timedelta(days=JOB_TTL_DAYS)).isoformat()
+
+
+def _format_date(value: str | None) -> str:
+    timestamp = parse_timestamp(value)
+    return datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y") if timestamp else "—"
+
+
+async def sweep_expired() -> int:
+    """Archive and delete expired jobs; returns how many were removed."""
+    if supabase.dummy:
+        return 0
+    removed = 0
+    for _ in range(JOB_SWEEP_MAX_BATCHES):
+        now = datetime.utcnow().isoformat()
+        result = await with_supabase_retry(
+            lambda: supabase.table("jobs")
+            .select("*")
+            .lt("expires_at", now)
+            .order("expires_at")
+            .limit(JOB_SWEEP_BATCH)
+            .execute()
+        )
+        rows = getattr(result, "data", []) or []
+        if not rows:
+            break
+        ids = [row["id"] for row in rows]
+        if JOB_ARCHIVE:
+            # ignore_duplicates: a batch archived before a failed delete is
+            # archived again on the next run
+            await with_supabase_retry(
+                lambda: supabase.table("jobs_archive")
+                .upsert(rows, on_conflict="id", ignore_duplicates=True)
+                .execute()
+            )
+        # Re-checked on delete: the author may have extended a job since
+        # the select, through this worker or another one
+        result = await with_supabase_retry(
+            lambda: supabase.table("jobs").delete().in_("id", ids).lt("expires_at", now).execute()
+        )
+        deleted = getattr(result, "data", []) or []
+        for row in deleted:
+            job_index.remove(job_key(row))
+        kept = sorted(set(ids) - {row["id"] for row in deleted})
+        if JOB_ARCHIVE and kept:
+            await with_supabase_retry(
+                lambda: supabase.table("jobs_archive").delete().in_("id", kept).execute()
+            )
+        removed += len(deleted)
+        if len(rows) < JOB_SWEEP_BATCH:
+            break
+    if removed:
+        logger.info(f"Expired jobs removed: {removed}")
+        StatsLogger.log(event="jobs_expired", count=removed, archived=JOB_ARCHIVE)
+    return removed
+
+
+async def remind_expiring() -> int:
+    """Queue a "продлить?" prompt for jobs expiring within the notice period."""
+    if supabase.dummy:
+        return 0
+    now = datetime.utcnow()
+    horizon = now + timedelta(hours=JOB_EXPIRY_NOTICE_HOURS)
+    result = await with_supabase_retry(
+        lambda: supabase.table("jobs")
+        .select("id,user_id,title,expires_at")
+        .is_("reminded_at", "null")
+        .gt("expires_at", now.isoformat())
+        .lt("expires_at", horizon.isoformat())
+        .order("expires_at")
+        .limit(JOB_SWEEP_BATCH)
+        .execute()
+    )
+    rows = getattr(result, "data", []) or []
+    if not rows:
+        return 0
+    ids = [row["id"] for row in rows]
+    # Marked before queueing: a lost reminder is better than a repeated one
+    await with_supabase_retry(
+        lambda: supabase.table("jobs")
+        .update({"reminded_at": now.isoformat()})
+        .in_("id", ids)
+        .execute()
+    )
+    for row in rows:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="♻️ Продлить", callback_data=f"job:extend:{row['id']}"),
+        ]])
+        await delivery.enqueue(
+            [int(row["user_id"])],
+            f"⏳ Объявление <b>{escape(str(row['title']))}</b> будет снято "
+            f"{_format_date(row['expires_at'])}. Продлить его ещё на {JOB_TTL_DAYS:g} дн.?",
+            reply_markup=keyboard,
+        )
+    StatsLogger.log(event="job_expiry_reminders", count=len(rows))
+    return len(rows)
+
+
+# ♻️ Продление объявления
+@router.callback_query(F.data.startswith("job:extend:"))
+async def extend_job(callback: CallbackQuery) -> None:
+    job_id = callback.data.rsplit(":", 1)[1]
+    user_id = callback.from_user.id
+    if not job_id.isdigit():
+        await callback.answer("Объявление не найдено")
+        return
+    new_expiry = expires_at()
+    try:
+        result = await with_supabase_retry(
+            lambda: supabase.table("jobs")
+            .update({"expires_at": new_expiry, "reminded_at": None})
+            .eq("id", int(job_id))
+            .eq("user_id", str(user_id))
+            .execute()
+        )
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await callback.answer("⚠️ Не удалось продлить, попробуйте позже")
+        return
+
+    rows = getattr(result, "data", []) or []
+    if not rows:
+        await callback.answer("Объявление уже снято с публикации")
+        return
+    job_index.add(rows[0])
+    invalidate_my_jobs(user_id)
+    StatsLogger.log(event="job_extended")
+    await callback.answer("Продлено")
+    await callback.message.edit_text(
+        f"✅ Объявление <b>{escape(str(rows[0].get('title', '')))}</b> продлено до {_format_date(new_expiry)}."
+    )
@@ -0,0 +1,407 @@
+"""In-process full-text index over the ``jobs`` table.
+
+The index is loaded once on startup and then updated incrementally when
+``add_job.get_price`` saves a job, so a search never scans the table.
+Jobs saved by other workers are picked up by :meth:`JobIndex.refresh`
+every ``JOB_INDEX_REFRESH_INTERVAL`` seconds: a job becomes searchable in
+every worker at most that long after it reaches Supabase (which may lag
+the posting itself while the write outbox retries). The same refresh
+re-reads jobs about to expire and jobs just pruned, so a job extended in
+another worker (:func:`job_expiry.extend_job`) keeps or regains its place
+in the search within one interval.
+Jobs leave the index when their ``expires_at`` passes (see
+:mod:`job_expiry`), checked cheaply before every search. The index also
+keeps SimHash fingerprints of the jobs for near-duplicate lookups (see
+:mod:`near_duplicates`).
+Titles and descriptions are split into words, lowercased (``ё`` → ``е``)
+and reduced with a light suffix-stripping Russian stemmer, so that
+"курьеры", "курьера" and "курьер" hit the same posting list.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Hashable, Iterable
+
+from log_utils import logger
+from near_duplicates import NearDuplicateIndex, simhash
+from supabase_client import supabase, with_supabase_retry
+
+_WORD_RE = re.compile(r"[0-9a-zа-я]+")
+_PRICE_FROM_RE = re.compile(r"\bот\s*(\d+)")
+_PRICE_TO_RE = re.compile(r"\bдо\s*(\d+)")
+
+_STOP_WORDS = frozenset(
+    "и в во на с со к ко по за из от до для о об у а но или не что как это руб р".split()
+)
+_REFLEXIVE = ("ся", "сь")
+# Longest suffixes first so that "ами" wins over "и"
+_SUFFIXES = tuple(
+    sorted(
+        (
+            "ого его ому ему ыми ими ая яя ое ее ые ие ый ий ой ую юю ых их "
+            "ать ять ить еть уть ала ила ешь ет ют ут ит ат ят ем им "
+            "ами ями иями ах ях ов ев ей ам ям ом ию ью ия ья "
+            "а я о е ы и у ю ь"
+        ).split(),
+        key=len,
+        reverse=True,
+    )
+)
+_MIN_STEM = 3
+
+JOB_INDEX_REFRESH_INTERVAL = float(os.getenv("JOB_INDEX_REFRESH_INTERVAL", "30"))
+# Rows saved out of ``created_at`` order (outbox retries, refreshed
+# duplicates) are looked up this far back on every refresh
+JOB_INDEX_REFRESH_OVERLAP = float(os.getenv("JOB_INDEX_REFRESH_OVERLAP", "300"))
+
+JOB_COLUMNS = "id,user_id,title,description,price,city,contact,created_at,expires_at,dedup_key"
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    """Strip one inflectional suffix from a Russian ``word``."""
+    if not ("а" <= word[0] <= "я"):
+        return word
+    for suffix in _REFLEXIVE:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            word = word[: -len(suffix)]
+            break
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[: -len(suffix)]
+    return word
+
+
+def city_key(city: str | None) -> str:
+    """Normalised city name used for filtering ("Санкт-Петербург" → "санкт петербург")."""
+    return " ".join(_WORD_RE.findall(normalize(city or "")))
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        stem(word)
+        for word in _WORD_RE.findall(normalize(text))
+        if word not in _STOP_WORDS
+    ]
+
+
+def job_price(job: dict[str, Any]) -> int | None:
+    try:
+        return int(job.get("price"))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(value: Any) -> float | None:
+    """Epoch seconds of an ISO timestamp; naive values are UTC as written by the bot."""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def job_key(job: dict[str, Any]) -> Hashable:
+    """Identity of ``job`` in the in-process indexes."""
+    return job.get("dedup_key") or job.get("id") or (str(job.get("user_id")), job.get("created_at"))
+
+
+class JobIndex:
+    """Inverted index of job words plus a city bucket for filtering."""
+
+    page_size = 1000
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._jobs: dict[Hashable, dict[str, Any]] = {}
+        self._tokens: dict[Hashable, frozenset[str]] = {}
+        self._postings: dict[str, set[Hashable]] = {}
+        self._by_city: dict[str, set[Hashable]] = {}
+        # (expires_at, key) min-heap; entries of re-added jobs go stale and
+        # are skipped when popped
+        self._expiry: list[tuple[float, Hashable]] = []
+        self._near = NearDuplicateIndex()
+        # Newest ``id`` and ``created_at`` seen in Supabase, for refreshes
+        self._seen_id = 0
+        self._seen_created = 0.0
+        # ids of jobs pruned since the last refresh: maybe extended elsewhere
+        self._pruned: deque[int] = deque(maxlen=self.page_size)
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def cities(self) -> Iterable[str]:
+        return self._by_city.keys()
+
+    def add(self, job: dict[str, Any]) -> None:
+        key = job_key(job)
+        if key in self._jobs:
+            self.remove(key)
+        words = tokenize(f"{job.get('title', '')} {job.get('description', '')}")
+        tokens = frozenset(words)
+        self._jobs[key] = job
+        self._tokens[key] = tokens
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(key)
+        city = city_key(job.get("city"))
+        self._by_city.setdefault(city, set()).add(key)
+        self._near.add(key, city, simhash(words))
+        expires_at = parse_timestamp(job.get("expires_at"))
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def remove(self, key: Hashable) -> dict[str, Any] | None:
+        job = self._jobs.pop(key, None)
+        if job is None:
+            return None
+        self._near.remove(key)
+        for token in self._tokens.pop(key, ()):
+            keys = self._postings.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[token]
+        city = city_key(job.get("city"))
+        keys = self._by_city.get(city)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_city[city]
+        return job
+
+    def prune(self, now: float | None = None) -> int:
+        """Drop jobs whose ``expires_at`` has passed; returns how many."""
+        now = time.time() if now is None else now
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            job = self._jobs.get(key)
+            if job is not None and parse_timestamp(job.get("expires_at")) == expires_at:
+                self.remove(key)
+                removed += 1
+                if isinstance(job.get("id"), int):
+                    self._pruned.append(job["id"])
+        return removed
+
+    def find_near_duplicate(self, job: dict[str, Any], user_id: Any = None) -> dict[str, Any] | None:
+        """Closest indexed job in the same city whose text nearly matches ``job``.
+
+        With ``user_id`` only that user's jobs are considered.
+        """
+        self.prune()
+        words = tokenize(f"{job.get('title', '')} {job.get('description', '')}")
+        for _, key in self._near.candidates(city_key(job.get("city")), simhash(words)):
+            candidate = self._jobs[key]
+            if user_id is None or str(candidate.get("user_id")) == str(user_id):
+                return candidate
+        return None
+
+    def search(
+        self,
+        text: str = "",
+        city: str | None = None,
+        min_price: int | None = None,
+        max_price: int | None = None,
+        limit: int = 10,
+    ) -> list[dict[str, Any]]:
+        """Return jobs matching any word of ``text``, best matches first."""
+        self.prune()
+        scores: dict[Hashable, int] = {}
+        tokens = set(tokenize(text))
+        if tokens:
+            for token in tokens:
+                for key in self._postings.get(token, ()):
+                    scores[key] = scores.get(key, 0) + 1
+        elif city:
+            scores = dict.fromkeys(self._by_city.get(city_key(city), ()), 0)
+        else:
+            scores = dict.fromkeys(self._jobs, 0)
+
+        city_keys = self._by_city.get(city_key(city), set()) if city else None
+        matches = []
+        for key, score in scores.items():
+            if city_keys is not None and key not in city_keys:
+                continue
+            job = self._jobs[key]
+            price = job_price(job)
+            if min_price is not None and (price is None or price < min_price):
+                continue
+            if max_price is not None and (price is None or price > max_price):
+                continue
+            matches.append((score, job.get("created_at") or "", job))
+        matches.sort(key=lambda m: (m[0], m[1]), reverse=True)
+        return [job for _, _, job in matches[:limit]]
+
+    def parse_query(self, query: str) -> dict[str, Any]:
+        """Split a free-form query into words, city and price bounds.
+
+        "курьер минск от 20 до 50" → text "курьер", city "минск",
+        min_price 20, max_price 50. A city is recognised when it matches a
+        city of an indexed job.
+        """
+        text = normalize(query)
+        params: dict[str, Any] = {"city": None, "min_price": None, "max_price": None}
+        for name, regex in (("min_price", _PRICE_FROM_RE), ("max_price", _PRICE_TO_RE)):
+            match = regex.search(text)
+            if match:
+                params[name] = int(match.group(1))
+                text = text[: match.start()] + text[match.end():]
+        padded = f" {' '.join(_WORD_RE.findall(text))} "
+        for city in sorted(self.cities, key=len, reverse=True):
+            if city and f" {city} " in padded:
+                params["city"] = city
+                padded = padded.replace(f" {city} ", " ")
+                break
+        params["text"] = padded.strip()
+        return params
+
+    async def ensure_loaded(self) -> None:
+        """Load the index once, even if several handlers ask at the same time."""
+        async with self._load_lock:
+            if not self.loaded:
+                await self.load()
+
+    async def load(self) -> None:
+        """Fill the index from the ``jobs`` table page by page."""
+        start = 0
+        while True:
+            result = await with_supabase_retry(
+                lambda: supabase.table("jobs")
+                .select(JOB_COLUMNS)
+                .order("id")
+                .range(start, start + self.page_size)
+                .execute()
+            )
+            rows = getattr(result, "data", [])
+            for row in rows:
+                self.add(row)
+                self._track(row)
+            if len(rows) < self.page_size:
+                break
+            start += self.page_size
+        self.prune()
+        self.loaded = True
+        logger.info(f"Job index loaded: {len(self)} jobs")
+
+    def _track(self, row: dict[str, Any]) -> None:
+        if isinstance(row.get("id"), int):
+            self._seen_id = max(self._seen_id, row["id"])
+        created = parse_timestamp(row.get("created_at"))
+        if created is not None:
+            self._seen_created = max(self._seen_created, created)
+
+    async def refresh(self) -> int:
+        """Add jobs saved since the last load or refresh; returns how many changed.
+
+        Fetches rows with a newer ``id`` (inserted by any worker) or a
+        ``created_at`` within ``JOB_INDEX_REFRESH_OVERLAP`` of the newest
+        one seen (duplicates refreshed in place keep their ``id``), page by
+        page in ``id`` order.
+        """
+        if supabase.dummy:
+            self.prune()
+            return 0
+        since = datetime.utcfromtimestamp(max(0.0, self._seen_created - JOB_INDEX_REFRESH_OVERLAP))
+        # Quoted: timestamps contain reserved characters (":", ".")
+        changes = f'(id.gt.{self._seen_id},created_at.gt."{since.isoformat()}")'
+        cursor, changed = 0, 0
+        while True:
+            def query(cursor=cursor) -> Any:
+                q = supabase.table("jobs").select(JOB_COLUMNS).gt("id", cursor).order("id").limit(self.page_size)
+                q.params = q.params.add("or", changes)
+                return q.execute()
+
+            rows = getattr(await with_supabase_retry(query), "data", []) or []
+            for row in rows:
+                if self._jobs.get(job_key(row)) != row:
+                    self.add(row)
+                    changed += 1
+                self._track(row)
+            if len(rows) < self.page_size:
+                break
+            cursor = rows[-1]["id"]
+        changed += await self._recheck_expiring()
+        self.prune()
+        return changed
+
+    async def _recheck_expiring(self) -> int:
+        """Re-read jobs expiring before the next refresh or just pruned.
+
+        Another worker may have extended them: the fresh ``expires_at``
+        moves them back into the index instead of pruning them here.
+        """
+        now = time.time()
+        horizon = now + 2 * JOB_INDEX_REFRESH_INTERVAL
+        ids = set(self._pruned)
+        self._pruned.clear()
+        for expires_at, key in self._expiry:
+            job = self._jobs.get(key)
+            if expires_at <= horizon and job is not None and isinstance(job.get("id"), int):
+                ids.add(job["id"])
+        if not ids:
+            return 0
+        ordered = sorted(ids)
+        live = datetime.utcfromtimestamp(now).isoformat()
+        changed = 0
+        for start in range(0, len(ordered), self.page_size):
+            chunk = ordered[start:start + self.page_size]
+            result = await with_supabase_retry(
+                lambda: supabase.table("jobs")
+                .select(JOB_COLUMNS)
+                .in_("id", chunk)
+                .gt("expires_at", live)
+                .execute()
+            )
+            for row in getattr(result, "data", []) or []:
+                if self._jobs.get(job_key(row)) != row:
+                    self.add(row)
+                    changed += 1
+        return changed
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Load the index and keep refreshing it in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await self.ensure_loaded()
+        except Exception:
+            logger.exception("Job index load failed; retrying on the next refresh")
+        while True:
+            await asyncio.sleep(JOB_INDEX_REFRESH_INTERVAL)
+            try:
+                if self.loaded:
+                    await self.refresh()
+                else:
+                    await self.ensure_loaded()
+            except Exception:
+                logger.exception("Job index refresh failed")
+
+
+job_index = JobIndex()
@@ -38,3 +38,14 @@ phone_keyboard = ReplyKeyboardMarkup(
 
 # Удаление клавиатуры
 remove_keyboard = ReplyKeyboardRemove()
+
+# Действие каждой кнопки для маршрутизации меню (menu_routing.py)
+BUTTON_ACTIONS = {
+    "📢 Найти подработку": "find_job",
+    "➕ Разместить подработку": "add_job",
+    "🧾 Мои объявления": "my_jobs",
+    "🔔 Подписки / уведомления": "subscriptions",
+    "👤 Профиль / Настройки": "profile",
+    "ℹ️ Помощь / FAQ": "help",
+    "🔐 Зарегистрироваться": "register",
+}
@@ -0,0 +1,75 @@
+"""Local SQLite databases shared by the worker processes of one host.
+
+Used for state that must survive restarts and be visible to every gunicorn
+worker: FSM storage, the delivery outbox and so on. Each database is
+opened in WAL mode so that readers do not block the writer, and all
+queries run on one dedicated thread, which keeps the event loop free and
+serialises access to the connection.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from metrics import LOCAL_DB_DURATION, track
+
+DATA_DIR = Path("data")
+
+
+class LocalDB:
+    """SQLite connection living on its own thread."""
+
+    def __init__(self, path: str | Path, schema: str = "") -> None:
+        self.path = Path(path)
+        self.schema = schema
+        self._conn: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Call ``func(conn, *args)`` on the database thread."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"sqlite-{self.path.stem}"
+            )
+        loop = asyncio.get_running_loop()
+        # Context is copied so the query is accounted to the calling handler
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, ctx.run, self._call, func, args)
+
+    def _call(self, func: Callable[..., Any], args: tuple) -> Any:
+        start = time.perf_counter()
+        try:
+            return func(self.connect(), *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            LOCAL_DB_DURATION.observe(elapsed, self.path.stem)
+            track(f"sqlite {self.path.stem}", elapsed)
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if self.schema:
+                conn.executescript(self.schema)
+            self._conn = conn
+        return self._conn
+
+    async def close(self) -> None:
+        if self._executor is None:
+            return
+        await self.run(lambda conn: self._close_conn())
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _close_conn(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,540 @@
+"""Reports over ``logs/stats.log`` and ``actions.log`` without a log pipeline.
+
+Usage::
+
+    python log_analytics.py                      # logs/stats.log and actions.log*
+    python log_analytics.py logs/ . --workers 8
+    python log_analytics.py actions.log.20250101-000000.gz --json
+
+Answers questions such as "where do users drop out of registration" or
+"p95 time to post a job" straight from the files the bot writes:
+
+* funnels over the ``RegisterState`` and ``AddJob`` steps, from the FSM
+  state :class:`logger_middleware.GlobalLoggerMiddleware` records with
+  every action, and the time from the triggering action to the last step;
+* per-user sessions (actions separated by less than ``--session-gap``):
+  count, duration and actions per session;
+* top ``StatsLogger`` events, log levels and error rates per day.
+
+Files are streamed line by line, plain or gzipped, and split into chunks
+(plain files at ``--chunk-mb`` boundaries, rotated ``.gz`` files whole)
+that ``--workers`` processes parse in parallel. A chunk reduces to
+counters, fixed-size histograms and, per user, only the flows and
+sessions still open at its edges, which are stitched together in log
+order. Memory therefore depends on the number of users, not on the
+size of the history.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+SESSION_GAP = 30 * 60
+CHUNK_MB = 64
+
+# Steps of the FSM flows in order (``State.state`` of the StatesGroup
+# classes in registration.py and add_job.py); optional steps are omitted
+FUNNELS = {
+    "registration": ["RegisterState:name", "RegisterState:city", "RegisterState:phone_choice"],
+    "add_job": ["AddJob:title", "AddJob:description", "AddJob:price"],
+}
+_GROUPS = {steps[0].split(":", 1)[0]: name for name, steps in FUNNELS.items()}
+
+_LOG_LINE = re.compile(r"\d{4}-\d\d-\d\d [\d:,]+ \[([A-Z]+)\]")
+
+
+# --- histograms ---------------------------------------------------------------------------
+
+class Histogram:
+    """Log-bucketed histogram (buckets ~9% wide) with approximate quantiles."""
+
+    _BASE = 2 ** 0.125
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.buckets: Counter[int] = Counter()
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.buckets[math.ceil(math.log(value, self._BASE)) if value > 0 else -1000] += 1
+
+    def merge(self, other: Histogram) -> None:
+        self.count += other.count
+        self.total += other.total
+        self.buckets.update(other.buckets)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Geometric middle of the bucket
+                return 0.0 if index == -1000 else self._BASE ** (index - 0.5)
+        return 0.0
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 1) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 1),
+            "p95": round(self.quantile(0.95), 1),
+            "p99": round(self.quantile(0.99), 1),
+        }
+
+
+# --- report -------------------------------------------------------------------------------
+
+@dataclass
+class Report:
+    events: Counter = field(default_factory=Counter)
+    levels: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)
+    # day -> [events, errors]
+    daily: dict[str, list[int]] = field(default_factory=dict)
+    actions: int = 0
+    users: int = 0
+    malformed: int = 0
+    sessions: Histogram = field(default_factory=Histogram)
+    session_actions: Histogram = field(default_factory=Histogram)
+    steps: dict[str, Counter] = field(default_factory=lambda: {name: Counter() for name in FUNNELS})
+    finish: dict[str, Histogram] = field(default_factory=lambda: {name: Histogram() for name in FUNNELS})
+
+    def merge(self, other: Report) -> None:
+        self.events.update(other.events)
+        self.levels.update(other.levels)
+        self.errors.update(other.errors)
+        for day, (events, errors) in other.daily.items():
+            counts = self.daily.setdefault(day, [0, 0])
+            counts[0] += events
+            counts[1] += errors
+        self.actions += other.actions
+        self.malformed += other.malformed
+        self.sessions.merge(other.sessions)
+        self.session_actions.merge(other.session_actions)
+        for name in FUNNELS:
+            self.steps[name].update(other.steps[name])
+            self.finish[name].merge(other.finish[name])
+
+
+# --- runs: sessions and funnel attempts ---------------------------------------------------
+
+@dataclass
+class _Entry:
+    __slots__ = ("at", "state", "funnel")
+
+    at: float
+    state: str | None
+    funnel: str | None
+
+
+@dataclass
+class _Session:
+    start: float
+    end: float
+    actions: int = 1
+
+
+@dataclass
+class _Attempt:
+    funnel: str
+    start: float
+    # Action that entered the flow ("➕ Разместить подработку"), if seen
+    trigger: float | None
+    reached: set[str] = field(default_factory=set)
+    finished: float | None = None
+
+
+@lru_cache(maxsize=256)
+def _funnel(state: str | None) -> str | None:
+    return _GROUPS.get(state.split(":", 1)[0]) if state else None
+
+
+@lru_cache(maxsize=4096)
+def _timestamp(value: str) -> float:
+    """``actions.log`` timestamp as epoch seconds; strptime is the hot spot."""
+    return datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+    ).timestamp()
+
+
+class Sessions:
+    """Runs of actions no more than ``gap`` seconds apart."""
+
+    name = "sessions"
+
+    def __init__(self, gap: float) -> None:
+        self.gap = gap
+
+    def member(self, entry: _Entry) -> bool:
+        return True
+
+    def joins(self, last: _Entry, entry: _Entry) -> bool:
+        return entry.at - last.at <= self.gap
+
+    def new(self, entry: _Entry, prev: _Entry | None) -> _Session:
+        return _Session(entry.at, entry.at)
+
+    def add(self, run: _Session, entry: _Entry) -> None:
+        run.end = entry.at
+        run.actions += 1
+
+    def merge(self, left: _Session, right: _Session) -> _Session:
+        return _Session(left.start, right.end, left.actions + right.actions)
+
+    def close(self, run: _Session, report: Report) -> None:
+        report.sessions.add(run.end - run.start)
+        report.session_actions.add(run.actions)
+
+
+class Funnels:
+    """Runs of actions taken within one FSM flow."""
+
+    name = "funnels"
+
+    def __init__(self, gap: float) -> None:
+        self.gap = gap
+
+    def member(self, entry: _Entry) -> bool:
+        return entry.funnel is not None
+
+    def joins(self, last: _Entry, entry: _Entry) -> bool:
+        return last.funnel == entry.funnel
+
+    def new(self, entry: _Entry, prev: _Entry | None) -> _Attempt:
+        trigger = prev.at if prev is not None and entry.at - prev.at <= self.gap else None
+        run = _Attempt(entry.funnel, entry.at, trigger)
+        self.add(run, entry)
+        return run
+
+    def add(self, run: _Attempt, entry: _Entry) -> None:
+        run.reached.add(entry.state)
+        if run.finished is None and entry.state == FUNNELS[run.funnel][-1]:
+            run.finished = entry.at
+
+    def merge(self, left: _Attempt, right: _Attempt) -> _Attempt:
+        left.reached |= right.reached
+        if left.finished is None:
+            left.finished = right.finished
+        return left
+
+    def close(self, run: _Attempt, report: Report) -> None:
+        steps = FUNNELS[run.funnel]
+        for step in steps:
+            # Strict: flows seen from the middle (log start) count from their first step only
+            if step not in run.reached:
+                break
+            report.steps[run.funnel][step] += 1
+        else:
+            report.finish[run.funnel].add(run.finished - (run.trigger or run.start))
+
+    def attach(self, run: _Attempt, prev: _Entry | None) -> None:
+        """Give a run that opened a chunk the action preceding it."""
+        if run.trigger is None and prev is not None and run.start - prev.at <= self.gap:
+            run.trigger = prev.at
+
+
+@dataclass
+class _Track:
+    """One user's runs in a chunk: the run open at each edge, per analysis."""
+
+    first: _Entry
+    last: _Entry
+    head: dict[str, Any] = field(default_factory=dict)
+    tail: dict[str, Any] = field(default_factory=dict)
+
+
+def _analyses(session_gap: float) -> list:
+    return [Sessions(session_gap), Funnels(session_gap)]
+
+
+def _track(tracks: dict[int, _Track], analyses: list, report: Report, user_id: int, entry: _Entry) -> None:
+    track = tracks.get(user_id)
+    opening = track is None
+    if opening:
+        track = tracks[user_id] = _Track(entry, entry)
+    for analysis in analyses:
+        name = analysis.name
+        run = track.tail.get(name)
+        if analysis.member(entry):
+            if run is not None and analysis.joins(track.last, entry):
+                analysis.add(run, entry)
+                continue
+            new = analysis.new(entry, None if opening else track.last)
+            if opening:
+                track.head[name] = new
+        else:
+            new = None
+        # The run open at the chunk start may continue the previous chunk
+        if run is not None and run is not track.head.get(name):
+            analysis.close(run, report)
+        track.tail[name] = new
+    track.last = entry
+
+
+# --- parsing ------------------------------------------------------------------------------
+
+@dataclass
+class Chunk:
+    path: Path
+    start: int = 0
+    end: int | None = None
+
+    @property
+    def kind(self) -> str:
+        return "actions" if "actions" in self.path.name else "stats"
+
+
+def _lines(chunk: Chunk) -> Iterator[str]:
+    if chunk.path.suffix == ".gz":
+        with gzip.open(chunk.path, "rt", encoding="utf-8", errors="replace") as f:
+            yield from f
+        return
+    with open(chunk.path, "rb") as f:
+        pos = chunk.start
+        f.seek(pos)
+        if pos:
+            # The line crossing the boundary belongs to the previous chunk
+            f.seek(pos - 1)
+            pos += len(f.readline()) - 1
+        for line in f:
+            if chunk.end is not None and pos >= chunk.end:
+                break
+            pos += len(line)
+            yield line.decode("utf-8", errors="replace")
+
+
+def _stats_line(line: str, report: Report) -> None:
+    if line.startswith("{"):
+        try:
+            entry = json.loads(line)
+            event, day = entry["event"], entry["timestamp"][:10]
+        except (ValueError, KeyError, TypeError):
+            report.malformed += 1
+            return
+        report.events[event] += 1
+        counts = report.daily.setdefault(day, [0, 0])
+        counts[0] += 1
+        if "error" in event:
+            report.errors[event] += 1
+            counts[1] += 1
+        return
+    match = _LOG_LINE.match(line)
+    if match is None:
+        # Traceback lines of a logged exception
+        return
+    report.levels[match[1]] += 1
+
+
+def analyze_chunk(chunk: Chunk, session_gap: float = SESSION_GAP) -> tuple[Report, dict[int, _Track]]:
+    """Reduce one chunk to a report and the runs open at its edges."""
+    report = Report()
+    tracks: dict[int, _Track] = {}
+    analyses = _analyses(session_gap)
+    if chunk.kind == "stats":
+        for line in _lines(chunk):
+            _stats_line(line, report)
+        return report, tracks
+    for line in _lines(chunk):
+        try:
+            entry = json.loads(line)
+            user_id = int(entry["user_id"])
+            at = _timestamp(entry["timestamp"])
+        except (ValueError, KeyError, TypeError):
+            report.malformed += 1
+            continue
+        report.actions += 1
+        state = entry.get("fsm_state")
+        _track(tracks, analyses, report, user_id, _Entry(at, state, _funnel(state)))
+    return report, tracks
+
+
+def _stitch(report: Report, users: dict[int, _Track], tracks: dict[int, _Track], analyses: list) -> None:
+    """Append the runs of the next chunk to the runs open so far."""
+    for user_id, track in tracks.items():
+        done = users.get(user_id)
+        for analysis in analyses:
+            name = analysis.name
+            open_run = done.tail.get(name) if done else None
+            head = track.head.get(name)
+            if head is not None and open_run is not None and analysis.joins(done.last, track.first):
+                run = analysis.merge(open_run, head)
+            else:
+                if open_run is not None:
+                    analysis.close(open_run, report)
+                run = head
+                if run is not None and done is not None and isinstance(analysis, Funnels):
+                    analysis.attach(run, done.last)
+            if head is None or head is track.tail.get(name):
+                tail = run if head is not None else track.tail.get(name)
+            else:
+                analysis.close(run, report)
+                tail = track.tail.get(name)
+            track.tail[name] = tail
+        track.head = {}
+        if done is not None:
+            track.first = done.first
+        users[user_id] = track
+
+
+# --- files --------------------------------------------------------------------------------
+
+def log_files(paths: Iterable[str | Path]) -> list[Path]:
+    """Expand ``paths`` into stats and action logs, each kind oldest first."""
+    # Not at module level: action_log sets up the bot's log handlers
+    from action_log import rotated_files, rotation_order
+
+    files: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(rotated_files(path, "actions.log"))
+            files.extend(rotated_files(path, "stats.log"))
+        elif path.exists():
+            files.append(path)
+    return sorted(dict.fromkeys(files), key=rotation_order)
+
+
+def chunks(files: Iterable[Path], chunk_bytes: int) -> list[Chunk]:
+    result = []
+    for path in files:
+        size = path.stat().st_size
+        if path.suffix == ".gz" or size <= chunk_bytes:
+            result.append(Chunk(path))
+            continue
+        result.extend(Chunk(path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes))
+    return result
+
+
+def analyze(paths: Iterable[str | Path], workers: int = 1, session_gap: float = SESSION_GAP, chunk_mb: float = CHUNK_MB) -> Report:
+    parts = chunks(log_files(paths), int(chunk_mb * 1024 * 1024))
+    report = Report()
+    users: dict[int, _Track] = {}
+    analyses = _analyses(session_gap)
+    if workers > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(analyze_chunk, parts, [session_gap] * len(parts))
+            for part_report, tracks in results:
+                report.merge(part_report)
+                _stitch(report, users, tracks, analyses)
+    else:
+        for part in parts:
+            part_report, tracks = analyze_chunk(part, session_gap)
+            report.merge(part_report)
+            _stitch(report, users, tracks, analyses)
+    for track in users.values():
+        for analysis in analyses:
+            run = track.tail.get(analysis.name)
+            if run is not None:
+                analysis.close(run, report)
+    report.users = len(users)
+    return report
+
+
+# --- output -------------------------------------------------------------------------------
+
+def summarize(report: Report, top: int = 20) -> dict[str, Any]:
+    total_events = sum(report.events.values())
+    funnels = {}
+    for name, steps in FUNNELS.items():
+        counts = [report.steps[name][step] for step in steps]
+        funnels[name] = {
+            "steps": [
+                {
+                    "step": step,
+                    "attempts": count,
+                    "from_previous": round(count / counts[i - 1], 3) if i and counts[i - 1] else None,
+                    "from_start": round(count / counts[0], 3) if counts[0] else None,
+                }
+                for i, (step, count) in enumerate(zip(steps, counts))
+            ],
+            "seconds_to_finish": report.finish[name].summary(),
+        }
+    return {
+        "actions": report.actions,
+        "users": report.users,
+        "malformed_lines": report.malformed,
+        "funnels": funnels,
+        "sessions": {
+            "seconds": report.sessions.summary(),
+            "actions": report.session_actions.summary(),
+        },
+        "top_events": report.events.most_common(top),
+        "log_levels": dict(report.levels),
+        "errors": {
+            "total": sum(report.errors.values()),
+            "rate": round(sum(report.errors.values()) / total_events, 4) if total_events else None,
+            "top": report.errors.most_common(top),
+            "daily": {
+                day: {"events": events, "errors": errors, "rate": round(errors / events, 4) if events else None}
+                for day, (events, errors) in sorted(report.daily.items())
+            },
+        },
+    }
+
+
+def render(summary: dict[str, Any]) -> str:
+    lines = [f"Actions: {summary['actions']}  users: {summary['users']}  malformed lines: {summary['malformed_lines']}", ""]
+    for name, funnel in summary["funnels"].items():
+        lines.append(f"Funnel {name}:")
+        for step in funnel["steps"]:
+            prev = f"{step['from_previous']:.1%}" if step["from_previous"] is not None else "-"
+            start = f"{step['from_start']:.1%}" if step["from_start"] is not None else "-"
+            lines.append(f"  {step['step']:<28} {step['attempts']:>9}  {prev:>7} of previous  {start:>7} of start")
+        finish = funnel["seconds_to_finish"]
+        lines.append(f"  time to finish, s: p50 {finish['p50']}  p95 {finish['p95']}  p99 {finish['p99']}  (n={finish['count']})")
+        lines.append("")
+    sessions = summary["sessions"]
+    lines.append(
+        f"Sessions: {sessions['seconds']['count']}  duration p50/p95 {sessions['seconds']['p50']}/"
+        f"{sessions['seconds']['p95']} s  actions p50/p95 {sessions['actions']['p50']}/{sessions['actions']['p95']}"
+    )
+    lines += ["", "Top events:"]
+    lines += [f"  {event:<30} {count:>9}" for event, count in summary["top_events"]]
+    errors = summary["errors"]
+    lines += ["", f"Errors: {errors['total']}  rate {errors['rate'] if errors['rate'] is not None else '-'}  levels {summary['log_levels']}"]
+    lines += [f"  {event:<30} {count:>9}" for event, count in errors["top"]]
+    lines += [
+        f"  {day}  {day_counts['errors']:>7} / {day_counts['events']:<9}"
+        f" {day_counts['rate'] if day_counts['rate'] is not None else '-'}"
+        for day, day_counts in errors["daily"].items()
+    ]
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=["logs", "."], help="log files or directories holding them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel parser processes")
+    parser.add_argument("--session-gap", type=float, default=SESSION_GAP, help="seconds of inactivity ending a session")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_MB, help="split plain files into chunks of this size")
+    parser.add_argument("--top", type=int, default=20, help="how many events to list")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if not log_files(args.paths):
+        parser.error("no stats.log or actions.log files found")
+
+    summary = summarize(analyze(args.paths, args.workers, args.session_gap, args.chunk_mb), args.top)
+    print(json.dumps(summary, ensure_ascii=False, indent=2) if args.json else render(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
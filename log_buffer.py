@@ -0,0 +1,125 @@
+"""Recent log and stats records kept in memory for the admin ``/logs``.
+
+The buffer is a ring of the last ``LOG_BUFFER_SIZE`` records (Python log
+records of level ``INFO`` and above and ``StatsLogger`` events) with a
+secondary ring per level and per event. Records leave all rings in the
+order they arrived, so evicting the oldest record from the main ring pops
+it from the left of its level and event rings in O(1) and a filtered
+query only walks the records that match.
+
+Only this worker's records are here, and only since it started; the
+``/logs`` handler goes to Supabase for what the buffer cannot cover.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Iterable
+
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "5000"))
+
+# Level of StatsLogger events, same as their ``logs.type``
+ACTION = "ACTION"
+
+
+@dataclass(frozen=True)
+class LogEntry:
+    timestamp: float
+    level: str
+    message: str
+    event: str | None = None
+    details: Any = field(default=None, compare=False)
+
+
+class LogBuffer:
+    """Bounded ring of :class:`LogEntry` indexed by level and event."""
+
+    def __init__(self, size: int = LOG_BUFFER_SIZE) -> None:
+        self.size = size
+        self._ring: deque[LogEntry] = deque()
+        self._by_level: dict[str, deque[LogEntry]] = {}
+        self._by_event: dict[str, deque[LogEntry]] = {}
+        # Timestamp of the newest evicted record: older ranges are incomplete
+        self.evicted_until = 0.0
+        self.started = time.time()
+        # Logging handlers and StatsLogger are called from executor threads too
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def append(self, entry: LogEntry) -> None:
+        with self._lock:
+            if len(self._ring) >= self.size:
+                self._evict()
+            self._ring.append(entry)
+            self._by_level.setdefault(entry.level, deque()).append(entry)
+            if entry.event is not None:
+                self._by_event.setdefault(entry.event, deque()).append(entry)
+
+    def _evict(self) -> None:
+        entry = self._ring.popleft()
+        self.evicted_until = entry.timestamp
+        for index, key in ((self._by_level, entry.level), (self._by_event, entry.event)):
+            if key is None:
+                continue
+            ring = index[key]
+            ring.popleft()
+            if not ring:
+                del index[key]
+
+    def covers(self, since: float) -> bool:
+        """Whether every record of this worker since ``since`` is buffered."""
+        return since >= max(self.evicted_until, self.started)
+
+    def query(
+        self,
+        level: str | None = None,
+        event: str | None = None,
+        since: float | None = None,
+        limit: int = 10,
+    ) -> list[LogEntry]:
+        """Newest first, up to ``limit`` records matching all given filters."""
+        with self._lock:
+            if event is not None:
+                candidates: Iterable[LogEntry] = reversed(self._by_event.get(event, ()))
+                if level is not None:
+                    candidates = (entry for entry in candidates if entry.level == level)
+            elif level is not None:
+                candidates = reversed(self._by_level.get(level, ()))
+            else:
+                candidates = reversed(self._ring)
+            if since is not None:
+                # Newest first: stop at the first record older than ``since``
+                candidates = _newer_than(candidates, since)
+            return list(islice(candidates, limit))
+
+    def levels(self) -> dict[str, int]:
+        with self._lock:
+            return {level: len(ring) for level, ring in self._by_level.items()}
+
+
+def _newer_than(entries: Iterable[LogEntry], since: float) -> Iterable[LogEntry]:
+    for entry in entries:
+        if entry.timestamp < since:
+            return
+        yield entry
+
+
+class BufferLogHandler(logging.Handler):
+    """Copy log records into :data:`log_buffer`."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            log_buffer.append(LogEntry(record.created, record.levelname, record.getMessage()))
+        except Exception:
+            self.handleError(record)
+
+
+log_buffer = LogBuffer()
@@ -0,0 +1,245 @@
+"""Background shipping of stats lines and ``logs`` rows.
+
+Writing ``logs/stats.log`` and inserting into the Supabase ``logs`` table
+used to happen inline for every event. Records are now put into a bounded
+in-memory queue and a single asyncio task drains it: file lines are
+appended in bulk on the default executor and rows are sent as multi-row
+inserts once ``LOG_BATCH_SIZE`` records are queued or every
+``LOG_FLUSH_INTERVAL`` seconds. When the queue is full new records are
+dropped. Rows that could not be inserted, and all rows while the Supabase
+circuit breaker is open, are handed to the write outbox (see
+:mod:`write_outbox`), which ships them once Supabase recovers. Rows left
+at interpreter exit are spilled to a file and shipped on the next start;
+every worker appends to the same spill file and reads it back under an
+exclusive ``flock``, so a row is restored by exactly one of them, and no
+more rows than fit into the queue are taken from it at a time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from log_utils import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: one worker only
+    fcntl = None
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+
+
+class LogShipper:
+    """Bounded queue of file lines and Supabase rows drained by one task."""
+
+    def __init__(
+        self,
+        path: Path,
+        spill_path: Path,
+        max_queue: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+    ) -> None:
+        self.path = path
+        self.spill_path = spill_path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._lines: list[str] = []
+        self._rows: list[dict[str, Any]] = []
+        # Records may come from executor threads (SDK logging), not only the loop
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        # Set by stop(): later records wait for flush_sync() at exit
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._lines) + len(self._rows)
+
+    def enqueue(self, line: str | None = None, row: dict[str, Any] | None = None) -> None:
+        """Queue a stats file line and/or a ``logs`` row without blocking."""
+        with self._lock:
+            if len(self) >= self.max_queue:
+                self.dropped += 1
+                return
+            if line is not None:
+                self._lines.append(line)
+            if row is not None:
+                self._rows.append(row)
+            full = len(self) >= self.batch_size
+        self._ensure_started()
+        if full:
+            self._wake()
+
+    def _ensure_started(self) -> None:
+        if self._task is not None or self._stopped:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no loop yet: records wait for start() or flush_sync()
+        self.start()
+
+    def _wake(self) -> None:
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            if asyncio.get_running_loop() is self._loop:
+                self._wakeup.set()
+                return
+        except RuntimeError:
+            pass
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self) -> None:
+        """Start the drain task on the running loop."""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._restore_spill()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the drain task and flush everything still queued."""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        # Checked as well as cancelled: a record queued during stop() can
+        # set the event as wait_for() is cancelled, which then returns
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Log shipper flush failed")
+
+    def _take(self) -> tuple[list[str], list[dict[str, Any]]]:
+        with self._lock:
+            lines, self._lines = self._lines, []
+            rows, self._rows = self._rows, []
+        return lines, rows
+
+    async def flush(self) -> None:
+        """Write queued lines and insert queued rows in batches."""
+        from supabase_client import supabase, supabase_breaker, with_supabase_retry
+
+        lines, rows = self._take()
+        loop = asyncio.get_running_loop()
+        if lines:
+            await loop.run_in_executor(None, self._write_lines, self.path, lines)
+        if rows and not supabase_breaker.available():
+            # Do not queue up calls that would be rejected anyway
+            await self._defer(rows)
+            return
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            try:
+                await with_supabase_retry(
+                    lambda: supabase.table("logs").insert(chunk).execute(),
+                    max_retries=1,
+                )
+            except Exception as e:
+                # Logged below WARNING so the failure is not shipped again
+                logger.info(f"Log shipping failed, deferring {len(chunk)} rows: {e}")
+                await self._defer(chunk)
+
+    async def _defer(self, rows: list[dict[str, Any]]) -> None:
+        from write_outbox import write_outbox
+
+        try:
+            await write_outbox.submit_many("logs", rows)
+        except Exception as e:
+            logger.info(f"Write outbox unavailable, spilling {len(rows)} rows: {e}")
+            await asyncio.get_running_loop().run_in_executor(None, self._spill, rows)
+
+    def flush_sync(self) -> None:
+        """Flush synchronously; used at interpreter exit and outside a loop."""
+        from supabase_client import supabase
+
+        lines, rows = self._take()
+        if lines:
+            self._write_lines(self.path, lines)
+        if not rows:
+            return
+        try:
+            supabase.table("logs").insert(rows).execute()
+        except Exception:
+            self._spill(rows)
+
+    @staticmethod
+    def _write_lines(path: Path, lines: list[str]) -> None:
+        path.parent.mkdir(exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    @contextmanager
+    def _spill_locked(self) -> Iterator[None]:
+        """Hold the lock shared by all workers using ``spill_path``."""
+        if fcntl is None:
+            yield
+            return
+        self.spill_path.parent.mkdir(exist_ok=True)
+        with open(f"{self.spill_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _spill(self, rows: list[dict[str, Any]]) -> None:
+        with self._spill_locked():
+            self._write_lines(
+                self.spill_path,
+                [json.dumps(row, ensure_ascii=False, default=str) for row in rows],
+            )
+
+    def _restore_spill(self) -> None:
+        if not self.spill_path.exists():
+            return
+        room = self.max_queue - len(self)
+        try:
+            with self._spill_locked():
+                with self.spill_path.open(encoding="utf-8") as f:
+                    lines = [line for line in f if line.strip()]
+                rows = [json.loads(line) for line in lines[:room]]
+                if len(lines) > room:
+                    # The rest waits for the next start instead of overflowing the queue
+                    tmp = self.spill_path.with_name(f"{self.spill_path.name}.{os.getpid()}.tmp")
+                    tmp.write_text("".join(lines[room:]), encoding="utf-8")
+                    os.replace(tmp, self.spill_path)
+                    logger.info(f"{len(lines) - room} spilled log rows left for the next start")
+                else:
+                    self.spill_path.unlink()
+        except FileNotFoundError:
+            return  # restored by another worker meanwhile
+        except Exception:
+            logger.exception("Failed to restore spilled log rows")
+            return
+        with self._lock:
+            self._rows[:0] = rows
+
+
+log_shipper = LogShipper(Path("logs/stats.log"), Path("logs/spill.jsonl"))
+atexit.register(log_shipper.flush_sync)
@@ -4,13 +4,17 @@ import sys
 import traceback
 from datetime import datetime
 
+from log_buffer import BufferLogHandler
+
 
 class SupabaseLogHandler(logging.Handler):
-    """Send WARNING+ logs to the ``logs`` table in Supabase."""
+    """Queue WARNING+ logs for the ``logs`` table in Supabase."""
 
     def emit(self, record: logging.LogRecord) -> None:  # pragma: no cover - network
         try:
-            from supabase_client import supabase  # imported lazily to avoid circular import
+            # imported lazily to avoid circular import
+            from log_shipper import log_shipper
+            from supabase_client import supabase
             if supabase.dummy:
                 return
 
@@ -24,7 +28,7 @@ class SupabaseLogHandler(logging.Handler):
                 "message": message,
                 "details": tb,
             }
-            supabase.table("logs").insert(entry).execute()
+            log_shipper.enqueue(row=entry)
         except Exception:
             # Avoid recursive logging on failure
             pass
@@ -36,9 +40,12 @@ def setup_logger() -> logging.Logger:
         level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
         handlers=[
-            logging.FileHandler("logs/stats.log", encoding="utf-8"),
+            # The file is opened on the first record rather than on import
+            logging.FileHandler("logs/stats.log", encoding="utf-8", delay=True),
             logging.StreamHandler(sys.stdout),
             SupabaseLogHandler(level=logging.WARNING),
+            # Recent records for the admin /logs command
+            BufferLogHandler(level=logging.INFO),
         ],
     )
     return logging.getLogger(__name__)
@@ -1,7 +1,7 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from datetime import datetime
-import json
+from action_log import action_log
 from log_utils import logger
 
 class GlobalLoggerMiddleware(BaseMiddleware):
@@ -40,11 +40,12 @@ class GlobalLoggerMiddleware(BaseMiddleware):
                 "user_id": user.id if user else None,
                 "username": user.username if user else None,
                 "event_type": event_type,
+                # Шаг сценария (RegisterState/AddJob) для воронок в log_analytics.py
+                "fsm_state": data.get("raw_state"),
                 "content": content
             }
 
-            with open("actions.log", "a", encoding="utf-8") as f:
-                f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+            action_log.write(log_entry)
 
         except Exception as e:
             logger.exception(f"Ошибка в GlobalLoggerMiddleware: {e}")
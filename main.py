@@ -1,10 +1,13 @@
+# Первым импортом: отсчёт холодного старта начинается здесь
+from startup_profile import startup_profile
+
 import asyncio
+import hmac
 import os
-import time
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import ErrorEvent
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from aiogram.client.default import DefaultBotProperties
 from aiohttp import web
@@ -13,10 +16,28 @@ from dotenv import load_dotenv
 from registration import router as registration_router
 from add_job import router as add_job_router
 from menu_actions import router as menu_router
+from my_jobs import router as my_jobs_router
+from job_expiry import JOB_SWEEP_INTERVAL, remind_expiring, router as job_expiry_router, sweep_expired
+from subscriptions import router as subscriptions_router
 from logger_middleware import GlobalLoggerMiddleware
+from dedup_middleware import UpdateDeduplicationMiddleware
+from timing_middleware import HandlerTimingMiddleware
+from throttling_middleware import ThrottlingMiddleware
+from menu_routing import MenuRoutingMiddleware, RoutingTimer
+from ingestion import WEBHOOK_WORKERS, QueuedRequestHandler
+from action_log import action_log
+from delivery import delivery
+from fsm_storage import create_storage
+from job_search import job_index
+from subscription_index import subscription_index
 from log_utils import logger
+from log_shipper import log_shipper
+from metrics import registry
+from scheduler import scheduler
+from stats_rollup import stats_rollup
 from stats_logger import StatsLogger
-from supabase_client import supabase, with_supabase_retry
+from supabase_client import supabase, supabase_breaker, shutdown_supabase_executor, with_supabase_retry
+from write_outbox import write_outbox
 
 # === Заглушки для режима без токена ===
 class DummySession:
@@ -55,8 +76,10 @@ IS_PROD = env_flag("IS_PROD")
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}" if WEBHOOK_HOST else None
+# /stats и /metrics: с токеном (Authorization: Bearer или ?token=), без него — только локально
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
 
-START_TIME = time.perf_counter()
+startup_profile.mark("imports")
 
 BOT_DUMMY = not BOT_TOKEN or BOT_TOKEN.lower() == "dummy"
 logger.info("BOT_DUMMY: %s", BOT_DUMMY)
@@ -69,49 +92,87 @@ if BOT_DUMMY:
     bot = DummyBot()
 else:
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=create_storage())
+# Рассылкой занимается только воркер-лидер (см. scheduler.py)
+delivery.setup(bot, autostart=False)
 
 # === Регистрация роутеров и middleware ===
 dp.include_router(registration_router)
 dp.include_router(add_job_router)
+dp.include_router(subscriptions_router)
+dp.include_router(my_jobs_router)
+dp.include_router(job_expiry_router)
 dp.include_router(menu_router)
+dp.update.outer_middleware(UpdateDeduplicationMiddleware())
+# Текст кнопки нормализуется один раз, хендлеры сверяют готовый menu_action
+menu_routing = MenuRoutingMiddleware()
+dp.message.outer_middleware(menu_routing)
+dp.callback_query.outer_middleware(menu_routing)
+# Время маршрутизации фиксируется сразу после выбора хендлера, до остальных middleware
+dp.message.middleware(RoutingTimer())
+dp.callback_query.middleware(RoutingTimer())
+# Дальше троттлинг: флуд отбрасывается до логов и запросов к Supabase
+throttling = ThrottlingMiddleware()
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
 dp.message.middleware(GlobalLoggerMiddleware())
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+startup_profile.mark("dispatcher")
 
 @dp.error()
-async def on_error(event, exception):
-    logger.exception("Unhandled error", exc_info=exception)
-    StatsLogger.log(event="unhandled_error", message=str(exception))
+async def on_error(event: ErrorEvent):
+    logger.exception("Unhandled error", exc_info=event.exception)
+    StatsLogger.log(event="unhandled_error", message=str(event.exception))
 
 # === Health check ===
-async def periodic_health_check() -> None:
-    while True:
-        issues: list[str] = []
-        if BOT_DUMMY:
-            issues.append("bot_token_missing")
-        try:
-            if not supabase.dummy:
-                await with_supabase_retry(
-                    lambda: supabase.table("users").select("id").limit(1).execute(),
-                    max_retries=1,
-                )
-        except Exception as e:
-            issues.append("supabase_error")
-            StatsLogger.log(event="supabase_error", message=f"health:{e}")
-        try:
-            if not BOT_DUMMY and not IS_PROD:
-                await bot.get_updates(limit=1, timeout=1)
-        except Exception:
-            issues.append("telegram_error")
-        if issues:
-            logger.warning(f"Health check issues: {issues}")
-            StatsLogger.log(event="health_check_issue", issues=issues)
-        await asyncio.sleep(180)
+HEALTH_CHECK_INTERVAL = 180
+
+async def health_check() -> None:
+    issues: list[str] = []
+    if BOT_DUMMY:
+        issues.append("bot_token_missing")
+    try:
+        if not supabase.dummy:
+            await with_supabase_retry(
+                lambda: supabase.table("users").select("id").limit(1).execute(),
+                max_retries=1,
+                timeout=5,
+            )
+    except Exception as e:
+        issues.append("supabase_error")
+        StatsLogger.log(event="supabase_error", message=f"health:{e}")
+    if supabase_breaker.state != supabase_breaker.CLOSED:
+        issues.append(f"supabase_circuit_{supabase_breaker.state}")
+    try:
+        if not BOT_DUMMY and not IS_PROD:
+            await bot.get_updates(limit=1, timeout=1)
+    except Exception:
+        issues.append("telegram_error")
+    if issues:
+        logger.warning(f"Health check issues: {issues}")
+        StatsLogger.log(event="health_check_issue", issues=issues)
+
+# === Фоновые задачи: по одной копии на хост, а не на каждый воркер ===
+scheduler.every("health_check", HEALTH_CHECK_INTERVAL, health_check)
+scheduler.every("job_expiry_reminders", JOB_SWEEP_INTERVAL, remind_expiring)
+scheduler.every("job_expiry_sweep", JOB_SWEEP_INTERVAL, sweep_expired)
+scheduler.service("delivery", delivery.start, delivery.stop)
 
 # === Обработчики запуска и остановки ===
 async def on_startup(app: web.Application):
     logger.info("🚀 Бот запускается...")
-    asyncio.create_task(periodic_health_check())
+    log_shipper.start()
+    write_outbox.start()
+    stats_rollup.start()
+    scheduler.start()
 
+    # Индексы подработок и подписок сами подтягивают изменения других воркеров
+    job_index.start()
+    subscription_index.start()
+
+    # set_webhook идемпотентен: каждый воркер ставит его сам, чтобы замена
+    # упавшего воркера не осталась без вебхука
     if IS_PROD and WEBHOOK_URL:
         async def _set_webhook():
             try:
@@ -127,44 +188,105 @@ async def on_startup(app: web.Application):
                 await bot.send_message(chat_id=ADMIN_ID, text="✅ Бот запущен")
             except Exception:
                 logger.warning("⚠️ Не удалось отправить сообщение админу")
-        asyncio.create_task(_notify_admin())
+        asyncio.create_task(scheduler.once("notify_admin", _notify_admin))
 
-    elapsed = time.perf_counter() - START_TIME
-    logger.info(f"Startup finished in {elapsed:.2f} sec")
+    startup_profile.mark("on_startup")
+    elapsed = startup_profile.total()
+    logger.info(f"Startup finished in {elapsed:.2f} sec: {startup_profile.snapshot()}")
     StatsLogger.log(event="startup_time", seconds=round(elapsed, 2))
+    StatsLogger.log(event="startup_profile", phases=startup_profile.snapshot())
 
 async def on_shutdown(app: web.Application):
     logger.info("🛑 Остановка бота...")
+    await scheduler.stop()
+    await delivery.stop()
+    await job_index.stop()
+    await subscription_index.stop()
+    # Вебхук не снимаем: остальные воркеры (и замена этого) продолжают работать
     try:
-        if IS_PROD:
-            await bot.delete_webhook()
         await bot.session.close()
         logger.info("✅ Сессия закрыта")
     except Exception:
         logger.exception("❌ Ошибка при остановке")
+    await dp.storage.close()
+    await log_shipper.stop()
+    # Последние минуты статистики уходят через outbox, поэтому до его остановки
+    await stats_rollup.stop()
+    await write_outbox.stop()
+    await asyncio.get_running_loop().run_in_executor(None, action_log.close)
+    shutdown_supabase_executor()
 
 # === AIOHTTP-приложение ===
 async def create_app():
     logger.info("🔧 Инициализация AIOHTTP приложения")
     app = web.Application()
+    if WEBHOOK_WORKERS > 0:
+        request_handler = QueuedRequestHandler(dispatcher=dp, bot=bot)
+    else:
+        request_handler = SimpleRequestHandler(dispatcher=dp, bot=bot)
+    # Регистрируем первым, чтобы очередь апдейтов дообработалась до on_shutdown
+    request_handler.register(app, path=WEBHOOK_PATH)
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
 
     async def ping(_request: web.Request) -> web.Response:
         return web.Response(text="pong")
 
+    def internal(handler):
+        """Отдаёт внутреннее состояние только по STATS_TOKEN или на локальный адрес."""
+        async def guarded(request: web.Request) -> web.Response:
+            if STATS_TOKEN:
+                auth = request.headers.get("Authorization", "")
+                given = auth.removeprefix("Bearer ").strip() or request.query.get("token", "")
+                allowed = hmac.compare_digest(given.encode(), STATS_TOKEN.encode())
+            else:
+                allowed = request.remote in {"127.0.0.1", "::1"}
+            if not allowed:
+                return web.Response(status=403, text="Forbidden")
+            return await handler(request)
+        return guarded
+
+    async def stats(_request: web.Request) -> web.Response:
+        ingestion = request_handler.stats() if WEBHOOK_WORKERS > 0 else {}
+        return web.json_response({
+            "ingestion": ingestion,
+            "delivery": delivery.stats(),
+            "scheduler": scheduler.stats(),
+            "stats_rollup": {"flushed": stats_rollup.flushed, "pending": stats_rollup.snapshot()},
+            "supabase": supabase_breaker.snapshot(),
+            "write_outbox": {**write_outbox.stats(), **await write_outbox.backlog()},
+        })
+
+    async def metrics(_request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    if WEBHOOK_WORKERS > 0:
+        registry.gauge(
+            "webhook_queue_depth", "Updates waiting in the ingestion queues.",
+            lambda: request_handler.stats()["queue_depth"],
+        )
+    registry.gauge("log_shipper_queue_depth", "Log records waiting to be shipped.", lambda: len(log_shipper))
+    registry.gauge("action_log_queue_depth", "Action log entries waiting to be written.", action_log.qsize)
+    registry.gauge("throttle_tracked_users", "Users with a live throttle bucket.", throttling.tracked_users)
+    registry.gauge("delivery_in_flight", "Messages being sent right now.", lambda: delivery.stats()["in_flight"])
+    registry.gauge("supabase_circuit_open", "1 while the Supabase circuit is not closed.",
+                   lambda: int(supabase_breaker.state != supabase_breaker.CLOSED))
+
     app.router.add_get("/ping", ping)
+    app.router.add_get("/metrics", internal(metrics))
+    app.router.add_get("/stats", internal(stats))
+    startup_profile.mark("create_app")
     return app
 
 # === Запуск ===
-app = None
-if IS_PROD:
-    app = asyncio.run(create_app())
-
-if __name__ == "__main__":
-    if IS_PROD:
-        web.run_app(app, host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
+# gunicorn вызывает фабрику сам, в цикле событий воркера:
+#   gunicorn main:create_app --worker-class aiohttp.GunicornWebWorker
+if __name__ == "__main__":
+    if IS_PROD:
+        web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
     else:
         if BOT_DUMMY:
             logger.error(
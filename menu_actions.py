@@ -1,17 +1,65 @@
+from html import escape
+
 from aiogram import Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message
 
-from keyboards import menu_keyboard
+from job_search import job_index
+from keyboards import menu_keyboard, remove_keyboard
+from menu_routing import MenuAction
 from stats_logger import StatsLogger
 
-router = Router()
+router = Router(name="menu")
+
+class SearchJob(StatesGroup):
+    query = State()
+
+
+def format_job(job: dict, max_description: int = 200) -> str:
+    description = str(job.get("description", ""))
+    if len(description) > max_description:
+        description = description[:max_description].rstrip() + "…"
+    return (
+        f"<b>{escape(str(job.get('title', '')))}</b>\n"
+        f"{escape(description)}\n"
+        f"💰 {escape(str(job.get('price', '')))} руб. · 📍 {escape(str(job.get('city', '')))}\n"
+        f"📞 {escape(str(job.get('contact', '')))}"
+    )
 
-@router.message(lambda m: m.text and "найти подработку" in m.text.lower())
-async def find_job(message: Message) -> None:
+
+@router.message(MenuAction("find_job"), flags={"throttle": "search"})
+async def find_job(message: Message, state: FSMContext) -> None:
     StatsLogger.log(event="click_find_job")
-    await message.answer("🔍 Поиск подработок пока не реализован.", reply_markup=menu_keyboard)
+    await message.answer(
+        "🔍 Что ищете? Напишите ключевые слова, при желании город и оплату,\n"
+        "например: <i>курьер Минск от 30 до 60</i>",
+        reply_markup=remove_keyboard,
+    )
+    await state.set_state(SearchJob.query)
+
+
+@router.message(SearchJob.query, flags={"throttle": "search"})
+async def run_search(message: Message, state: FSMContext) -> None:
+    if not (message.text and message.text.strip()):
+        await message.answer("⚠️ Напишите запрос текстом.")
+        return
+    await state.clear()
+
+    try:
+        await job_index.ensure_loaded()
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await message.answer("⚠️ Поиск временно недоступен, попробуйте позже.", reply_markup=menu_keyboard)
+        return
 
-@router.message(lambda m: m.text and "мои объявления" in m.text.lower())
-async def my_jobs(message: Message) -> None:
-    StatsLogger.log(event="click_my_jobs")
-    await message.answer("ℹ️ Раздел 'Мои объявления' пока не готов.", reply_markup=menu_keyboard)
+    params = job_index.parse_query(message.text)
+    jobs = job_index.search(**params)
+    StatsLogger.log(event="search_query", results=len(jobs), **params)
+    if not jobs:
+        await message.answer("😔 Ничего не найдено. Попробуйте другой запрос.", reply_markup=menu_keyboard)
+        return
+    await message.answer(
+        f"🔍 Найдено: {len(jobs)}\n\n" + "\n\n".join(format_job(job) for job in jobs),
+        reply_markup=menu_keyboard,
+    )
@@ -0,0 +1,104 @@
+"""Menu buttons routed by one exact lookup per message.
+
+Menu handlers used to be picked by lambdas such as ``"найти подработку"
+in m.text.lower()``: every message was lowercased and scanned again by
+each of them while aiogram tried the routers in order, and a filter
+without a ``m.text`` check failed on photos and contacts. Now
+:class:`MenuRoutingMiddleware` normalises the text once per message and
+looks it up in a table built from the keyboard labels
+(``keyboards.BUTTON_ACTIONS``); handlers match on the result with the
+:class:`MenuAction` filter, a plain comparison.
+
+The middleware also times routing: from the update reaching the
+dispatcher's message/callback observers to a handler matching
+(``bot_routing_duration_seconds``, recorded by :class:`RoutingTimer`,
+the first inner middleware, so throttling and logging are not counted),
+or to the point where no handler matched.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+from keyboards import BUTTON_ACTIONS, menu_keyboard, register_keyboard
+from metrics import ROUTING_DURATION
+from timing_middleware import handler_labels
+
+_WORD = re.compile(r"[^\W_]+")
+_MISSING = object()
+
+
+def normalize(text: str | None) -> str:
+    """Case-, emoji- and punctuation-insensitive form of a button label."""
+    if not text:
+        return ""
+    return " ".join(_WORD.findall(text.casefold().replace("ё", "е")))
+
+
+def _build_table() -> dict[str, str]:
+    table = {}
+    for markup in (menu_keyboard, register_keyboard):
+        for row in markup.keyboard:
+            for button in row:
+                action = BUTTON_ACTIONS.get(button.text)
+                if action is not None:
+                    table[normalize(button.text)] = action
+    return table
+
+
+# normalised label -> action
+MENU_TABLE = _build_table()
+# Longer texts cannot be a label; skip normalising free-form input
+_MAX_LABEL = 2 * max(map(len, BUTTON_ACTIONS))
+
+
+def resolve_action(text: str | None) -> str | None:
+    """Action of the button labelled ``text``, if it is one."""
+    if not text or len(text) > _MAX_LABEL:
+        return None
+    return MENU_TABLE.get(normalize(text))
+
+
+class MenuRoutingMiddleware(BaseMiddleware):
+    """Outer middleware: resolve ``menu_action`` once and start the routing clock."""
+
+    async def __call__(self, handler, event, data):
+        data["routing_started"] = time.perf_counter()
+        if isinstance(event, Message):
+            data["menu_action"] = resolve_action(event.text)
+        result = await handler(event, data)
+        if result is UNHANDLED:
+            ROUTING_DURATION.observe(time.perf_counter() - data["routing_started"], "unhandled", "unhandled")
+        return result
+
+
+class RoutingTimer(BaseMiddleware):
+    """Inner middleware, registered first: stop the routing clock of the matched handler."""
+
+    async def __call__(self, handler, event, data):
+        started = data.get("routing_started")
+        if started is not None:
+            ROUTING_DURATION.observe(time.perf_counter() - started, *handler_labels(data))
+        return await handler(event, data)
+
+
+class MenuAction(Filter):
+    """Match messages whose text is the button of ``action``."""
+
+    def __init__(self, action: str) -> None:
+        if action not in MENU_TABLE.values():
+            raise ValueError(f"No keyboard button for menu action {action!r}")
+        self.action = action
+
+    async def __call__(self, message: Message, menu_action: Any = _MISSING) -> bool:
+        if menu_action is _MISSING:
+            # Router used without MenuRoutingMiddleware
+            menu_action = resolve_action(message.text)
+        return menu_action == self.action
@@ -0,0 +1,229 @@
+"""In-process metrics rendered in the Prometheus text format.
+
+A deliberately small subset of what ``prometheus_client`` offers, enough
+for ``/metrics``: labelled counters and histograms that are updated from
+the event loop and from the Supabase/SQLite worker threads, and gauges
+whose value is read from a callback at scrape time (queue depths and
+similar). Every gunicorn worker keeps its own values; scrape them per
+worker or sum them in the query.
+
+:func:`breakdown` and :func:`track` collect where the time of one handler
+went (Supabase, local SQLite) for the slow-handler log.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative histogram with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            plain = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{plain} {_number(state[-1])}"
+            yield f"{self.name}_count{plain} {cumulative}"
+
+
+class Gauge:
+    """Value read from ``func`` when the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]) -> None:
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {_number(self.func())}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, func: Callable[[], float]) -> Gauge:
+        """Register a callback gauge; registering the same name again replaces it."""
+        self._metrics.pop(name, None)
+        return self._add(Gauge(name, help, func))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception:
+                # A failing gauge callback must not break the whole scrape
+                lines.pop()
+                lines.pop()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_DURATION = registry.histogram(
+    "bot_handler_duration_seconds",
+    "Time spent in update handlers.",
+    ("router", "handler"),
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total",
+    "Handlers that raised an exception.",
+    ("router", "handler"),
+)
+SUPABASE_DURATION = registry.histogram(
+    "supabase_request_duration_seconds",
+    "Duration of Supabase requests.",
+    ("table", "op"),
+)
+SUPABASE_REQUESTS = registry.counter(
+    "supabase_requests_total",
+    "Supabase requests by outcome.",
+    ("table", "op", "outcome"),
+)
+ROUTING_DURATION = registry.histogram(
+    "bot_routing_duration_seconds",
+    "Time from receiving a message or callback to matching its handler, before inner middlewares.",
+    ("router", "handler"),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025),
+)
+LOCAL_DB_DURATION = registry.histogram(
+    "local_db_duration_seconds",
+    "Duration of queries against the local SQLite databases.",
+    ("db",),
+)
+
+
+# --- per-handler breakdown -------------------------------------------------------------
+
+_breakdown: contextvars.ContextVar[dict[str, list[float]] | None] = contextvars.ContextVar(
+    "metrics_breakdown", default=None
+)
+
+
+@contextmanager
+def breakdown() -> Iterator[dict[str, list[float]]]:
+    """Collect ``{kind: [calls, seconds]}`` for everything tracked inside the block."""
+    spans: dict[str, list[float]] = {}
+    token = _breakdown.set(spans)
+    try:
+        yield spans
+    finally:
+        _breakdown.reset(token)
+
+
+def track(kind: str, seconds: float) -> None:
+    """Add ``seconds`` to the current breakdown, if one is being collected."""
+    spans = _breakdown.get()
+    if spans is not None:
+        span = spans.setdefault(kind, [0, 0.0])
+        span[0] += 1
+        span[1] += seconds
+
+
+def format_breakdown(spans: dict[str, list[float]]) -> str:
+    return ", ".join(
+        f"{kind} {seconds:.3f}s x{calls}"
+        for kind, (calls, seconds) in sorted(spans.items(), key=lambda item: -item[1][1])
+    )
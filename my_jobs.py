@@ -0,0 +1,167 @@
+import os
+from datetime import datetime
+from typing import Any
+
+from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from cache import MISSING, TTLCache
+from job_search import parse_timestamp
+from keyboards import menu_keyboard
+from menu_actions import format_job
+from menu_routing import MenuAction
+from stats_logger import StatsLogger
+from supabase_client import supabase, with_supabase_retry
+from write_outbox import write_outbox
+
+router = Router(name="my_jobs")
+
+MY_JOBS_PAGE_SIZE = int(os.getenv("MY_JOBS_PAGE_SIZE", "5"))
+MY_JOBS_CACHE_SIZE = int(os.getenv("MY_JOBS_CACHE_SIZE", "1000"))
+MY_JOBS_CACHE_TTL = float(os.getenv("MY_JOBS_CACHE_TTL", "60"))
+
+COLUMNS = "id,title,description,price,city,contact,created_at,expires_at,dedup_key"
+
+# telegram_id -> {page key: (text, keyboard)}; only the author changes
+# their listing, so ``invalidate_my_jobs`` on posting keeps it consistent
+_pages = TTLCache(MY_JOBS_CACHE_SIZE, MY_JOBS_CACHE_TTL)
+
+
+def invalidate_my_jobs(telegram_id: int) -> None:
+    _pages.pop(telegram_id)
+
+
+def _cursor(job: dict) -> str:
+    return f"{job['created_at']}|{job['id']}"
+
+
+def _keyset(direction: str, cursor: str) -> tuple[str, str]:
+    """PostgREST ``or`` filter for rows after/before ``(created_at, id)``."""
+    created_at, job_id = cursor.rsplit("|", 1)
+    op = "lt" if direction == "next" else "gt"
+    # Quoted: timestamps contain reserved characters (":", ".")
+    return (
+        f'(created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{int(job_id)}))',
+        "created_at.desc,id.desc" if direction == "next" else "created_at.asc,id.asc",
+    )
+
+
+async def _fetch(telegram_id: int, direction: str | None, cursor: str | None, limit: int) -> list[dict]:
+    """Up to ``limit`` jobs of the user, newest first, after/before ``cursor``.
+
+    Keyset pagination on ``(created_at, id)``: each page is an index range
+    scan no matter how deep it is, unlike ``offset`` which reads and
+    discards every row of the previous pages.
+    """
+    def query() -> Any:
+        q = supabase.table("jobs").select(COLUMNS).eq("user_id", str(telegram_id)).limit(limit)
+        order = "created_at.desc,id.desc"
+        if cursor:
+            keyset, order = _keyset(direction, cursor)
+            q.params = q.params.add("or", keyset)
+        q.params = q.params.set("order", order)
+        return q.execute()
+
+    result = await with_supabase_retry(query)
+    rows = getattr(result, "data", []) or []
+    return rows[::-1] if direction == "prev" else rows
+
+
+async def _render(telegram_id: int, page: int, direction: str | None, cursor: str | None) -> tuple[str, InlineKeyboardMarkup | None]:
+    size = MY_JOBS_PAGE_SIZE
+    rows = await _fetch(telegram_id, direction, cursor, size + 1)
+    if direction == "prev":
+        has_older, rows = True, rows[-size:]
+    else:
+        has_older, rows = len(rows) > size, rows[:size]
+
+    if page == 1:
+        # Jobs still waiting in the write outbox are the newest ones
+        shipped = {row.get("dedup_key") for row in rows}
+        pending = [
+            job for job in await write_outbox.find_all("jobs", "user_id", str(telegram_id), limit=size)
+            if job.get("dedup_key") not in shipped
+        ]
+        rows = pending + rows
+
+    if not rows:
+        return "🧾 У вас пока нет объявлений. Разместите первое через «➕ Разместить подработку».", None
+
+    blocks = []
+    for n, job in enumerate(rows, (page - 1) * size + 1):
+        dates = []
+        posted = parse_timestamp(job.get("created_at"))
+        if posted:
+            dates.append(f"🗓 {datetime.fromtimestamp(posted):%d.%m.%Y}")
+        expires = parse_timestamp(job.get("expires_at"))
+        if expires:
+            dates.append(f"⏳ до {datetime.fromtimestamp(expires):%d.%m.%Y}")
+        blocks.append(f"{n}. {format_job(job)}" + (f"\n{' · '.join(dates)}" if dates else ""))
+    text = f"🧾 <b>Мои объявления</b> · стр. {page}\n\n" + "\n\n".join(blocks)
+
+    # Cursors come from rows that reached Supabase; pending ones have no id
+    keyed = [row for row in rows if row.get("id") is not None]
+    buttons = []
+    if page > 1 and keyed:
+        buttons.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"my:prev:{page - 1}:{_cursor(keyed[0])}"))
+    if has_older and keyed:
+        buttons.append(InlineKeyboardButton(text="Старше ➡️", callback_data=f"my:next:{page + 1}:{_cursor(keyed[-1])}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+async def _page(telegram_id: int, key: str) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Rendered page ``key`` (``first`` or ``<direction>:<page>:<cursor>``), cached."""
+    pages = _pages.get(telegram_id)
+    if pages is MISSING:
+        pages = {}
+        _pages.set(telegram_id, pages)
+    cached = pages.get(key)
+    if cached is not None:
+        return cached
+    if key == "first":
+        rendered = await _render(telegram_id, 1, None, None)
+    else:
+        direction, page, cursor = key.split(":", 2)
+        page = int(page)
+        if page <= 1:
+            # Back to the start: the first page also lists pending jobs
+            return await _page(telegram_id, "first")
+        rendered = await _render(telegram_id, page, direction, cursor)
+    pages[key] = rendered
+    return rendered
+
+
+# 🧾 Мои объявления
+@router.message(MenuAction("my_jobs"), flags={"throttle": "my_jobs"})
+async def my_jobs(message: Message) -> None:
+    StatsLogger.log(event="click_my_jobs")
+    try:
+        text, keyboard = await _page(message.from_user.id, "first")
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await message.answer("⚠️ Объявления временно недоступны, попробуйте позже.", reply_markup=menu_keyboard)
+        return
+    await message.answer(text, reply_markup=keyboard or menu_keyboard)
+
+
+# ⬅️➡️ Листание страниц: редактируем то же сообщение
+@router.callback_query(F.data.startswith("my:"), flags={"throttle": "my_jobs"})
+async def my_jobs_page(callback: CallbackQuery) -> None:
+    try:
+        text, keyboard = await _page(callback.from_user.id, callback.data[3:])
+    except (ValueError, KeyError):
+        await callback.answer("Страница устарела")
+        return
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await callback.answer("⚠️ Не удалось загрузить страницу")
+        return
+    await callback.answer()
+    StatsLogger.log(event="my_jobs_page", page=callback.data.split(":", 3)[2])
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # Double taps re-render the same page
+        if "message is not modified" not in str(e):
+            raise
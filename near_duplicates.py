@@ -0,0 +1,95 @@
+"""Near-duplicate detection of job postings with SimHash.
+
+A posting's fingerprint is the 64-bit SimHash of its title and
+description: every stemmed word and every pair of adjacent words votes
+for the bits of its hash, and each bit of the fingerprint is the majority
+vote. Reworded, reordered or slightly edited copies of a text differ in
+only a few bits, unrelated texts in about half of them.
+
+Fingerprints are bucketed per city by each of ``BANDS`` 16-bit bands
+(locality-sensitive hashing). Two fingerprints within ``max_distance``
+bits of each other (``max_distance < BANDS``) agree on at least one whole
+band, so a lookup only compares the handful of postings sharing a bucket
+with the new one instead of the whole corpus.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from functools import lru_cache
+from typing import Hashable
+
+BITS = 64
+BANDS = 4
+_BAND_BITS = BITS // BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3"))
+
+
+@lru_cache(maxsize=65536)
+def _feature_bits(feature: str) -> str:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    return format(int.from_bytes(digest, "big"), f"0{BITS}b")
+
+
+def simhash(tokens: list[str]) -> int:
+    """SimHash of words ``tokens`` and their bigrams."""
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        return 0
+    # Column-wise vote over the binary strings of the feature hashes
+    threshold = len(features) / 2
+    columns = zip(*(_feature_bits(feature) for feature in features))
+    bits = "".join("1" if column.count("1") > threshold else "0" for column in columns)
+    return int(bits, 2)
+
+
+def _bands(fingerprint: int) -> list[int]:
+    return [(fingerprint >> (band * _BAND_BITS)) & _BAND_MASK for band in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """LSH buckets of job fingerprints keyed by city and band."""
+
+    def __init__(self, max_distance: int = NEAR_DUP_MAX_DISTANCE) -> None:
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS} for exact band lookup")
+        self.max_distance = max_distance
+        self._entries: dict[Hashable, tuple[str, int]] = {}
+        self._buckets: dict[tuple[str, int, int], set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: Hashable, city: str, fingerprint: int) -> None:
+        self.remove(key)
+        self._entries[key] = (city, fingerprint)
+        for band, value in enumerate(_bands(fingerprint)):
+            self._buckets.setdefault((city, band, value), set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        city, fingerprint = entry
+        for band, value in enumerate(_bands(fingerprint)):
+            bucket = self._buckets.get((city, band, value))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[(city, band, value)]
+
+    def candidates(self, city: str, fingerprint: int) -> list[tuple[int, Hashable]]:
+        """``(distance, key)`` of indexed postings within ``max_distance``, closest first."""
+        keys: set[Hashable] = set()
+        for band, value in enumerate(_bands(fingerprint)):
+            keys.update(self._buckets.get((city, band, value), ()))
+        matches = []
+        for key in keys:
+            distance = (self._entries[key][1] ^ fingerprint).bit_count()
+            if distance <= self.max_distance:
+                matches.append((distance, key))
+        matches.sort(key=lambda match: match[0])
+        return matches
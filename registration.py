@@ -1,9 +1,11 @@
+import json
 import re
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 from aiogram import Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message
@@ -14,11 +16,17 @@ from keyboards import (
     register_keyboard,
     remove_keyboard,
 )
+from delivery import delivery
+from menu_routing import MenuAction
+from log_buffer import log_buffer
 from supabase_client import supabase, with_supabase_retry
 from stats_logger import StatsLogger
+from stats_rollup import STATS_RAW_SAMPLE_RATE
 from log_utils import logger
+from user_cache import user_cache
+from write_outbox import write_outbox
 
-router = Router()
+router = Router(name="registration")
 
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 
@@ -31,13 +39,7 @@ class RegisterState(StatesGroup):
 
 async def user_exists(telegram_id: int) -> bool:
     try:
-        data = await with_supabase_retry(
-            lambda: supabase.table("users")
-            .select("id")
-            .eq("telegram_id", telegram_id)
-            .execute()
-        )
-        return bool(getattr(data, "data", []))
+        return await user_cache.get(telegram_id) is not None
     except Exception as e:
         logger.warning(f"Supabase check failed: {e}")
         StatsLogger.log(event="supabase_error", message=str(e))
@@ -54,28 +56,27 @@ async def start_cmd(message: Message, state: FSMContext) -> None:
     name = message.from_user.full_name
 
     try:
-        result = await with_supabase_retry(
-            lambda: supabase.table("users")
-            .select("id")
-            .eq("telegram_id", user_id)
-            .execute()
-        )
-        if not getattr(result, "data", []):
+        if await user_cache.get(user_id) is None:
             StatsLogger.log(event="register_user_attempt", telegram_id=user_id)
-            logger.info(f"Inserting new user {user_id} into Supabase")
-            await with_supabase_retry(
-                lambda: supabase.table("users").insert(
-                    {
-                        "telegram_id": user_id,
-                        "username": username,
-                        "name": name,
-                        "city": "Не указан",
-                        "phone": "Не указан",
-                        "created_at": datetime.utcnow().isoformat(),
-                    }
-                ).execute()
+            logger.info(f"Queueing new user {user_id} for Supabase")
+            row = {
+                "telegram_id": user_id,
+                "username": username,
+                "name": name,
+                "city": "Не указан",
+                "phone": "Не указан",
+                "created_at": datetime.utcnow().isoformat(),
+            }
+            # ignore_duplicates: a redelivered /start must not overwrite a registration
+            await write_outbox.submit(
+                "users",
+                row,
+                key=f"users:{user_id}:start",
+                on_conflict="telegram_id",
+                ignore_duplicates=True,
             )
-            logger.info("Insert completed")
+            user_cache.invalidate(user_id)
+            logger.info("Insert queued")
     except Exception as e:
         logger.warning(f"Failed to ensure user in Supabase: {e}")
         StatsLogger.log(event="supabase_error", message=str(e))
@@ -84,7 +85,7 @@ async def start_cmd(message: Message, state: FSMContext) -> None:
     await message.answer("👋 Добро пожаловать в Joby! Меню ниже ⬇️", reply_markup=menu_keyboard)
 
 
-@router.message(lambda m: m.text and "зарегистрироваться" in m.text.lower())
+@router.message(MenuAction("register"))
 async def registration_start(message: Message, state: FSMContext) -> None:
     await message.answer("Введите ваше имя:", reply_markup=remove_keyboard)
     await state.set_state(RegisterState.name)
@@ -137,25 +138,32 @@ async def _finish_registration(message: Message, state: FSMContext, phone: str)
         telegram_id=message.from_user.id,
         username=message.from_user.username,
     )
-    logger.info(f"Saving user {message.from_user.id} to Supabase")
+    logger.info(f"Saving user {message.from_user.id}")
+    row = {
+        "telegram_id": message.from_user.id,
+        "username": message.from_user.username,
+        "name": data["name"],
+        "city": data["city"],
+        "phone": data["phone"],
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    # Сначала в локальный outbox: в Supabase строка уйдёт фоном, даже если он сейчас недоступен
     try:
-        await with_supabase_retry(
-            lambda: supabase.table("users").insert(
-                {
-                    "telegram_id": message.from_user.id,
-                    "username": message.from_user.username,
-                    "name": data["name"],
-                    "city": data["city"],
-                    "phone": data["phone"],
-                    "created_at": datetime.utcnow().isoformat(),
-                }
-            ).execute()
+        await write_outbox.submit(
+            "users",
+            row,
+            key=f"users:{message.from_user.id}:{message.message_id}",
+            on_conflict="telegram_id",
         )
-        logger.info("Insert completed")
-        StatsLogger.log(event="registration_success")
     except Exception as e:
+        user_cache.invalidate(message.from_user.id)
         logger.exception(f"Failed to save user: {e}")
-        StatsLogger.log(event="supabase_error", message=str(e))
+        StatsLogger.log(event="outbox_error", message=str(e))
+        await message.answer("⚠️ Не удалось сохранить данные. Попробуйте отправить номер ещё раз.")
+        return
+    user_cache.put(message.from_user.id, row)
+    logger.info("User saved to outbox")
+    StatsLogger.log(event="registration_success")
 
     await message.answer("✅ Регистрация завершена!", reply_markup=menu_keyboard)
     await state.clear()
@@ -205,26 +213,197 @@ async def get_phone(message: Message, state: FSMContext) -> None:
     await _finish_registration(message, state, valid)
 
 
+LOGS_DEFAULT_COUNT = 10
+LOGS_MAX_COUNT = 50
+# gunicorn's worker count: with several workers the others' records are
+# only in Supabase, so /logs reads it for the whole window
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+_LEVELS = {"debug", "info", "warning", "error", "critical", "action"}
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_LOGS_USAGE = (
+    "Использование: /logs [уровень] [событие] [окно] [N]\n"
+    "например: /logs error 2h, /logs search_query 30m 20, "
+    "/logs level=warning event=supabase_error since=1d n=5"
+)
+
+
+def _parse_logs_args(args: str | None) -> tuple[str | None, str | None, float | None, int]:
+    """``(level, event, since, count)`` from ``/logs`` arguments."""
+    level = event = since = None
+    count = LOGS_DEFAULT_COUNT
+    for token in (args or "").split():
+        key, _, value = token.rpartition("=")
+        key = key.lower()
+        if key == "n" or (not key and value.isdigit()):
+            count = min(int(value), LOGS_MAX_COUNT)
+        elif key in {"since", "window"} or (not key and re.fullmatch(r"\d+[smhd]", value.lower())):
+            match = re.fullmatch(r"(\d+)([smhd])", value.lower())
+            if not match:
+                raise ValueError(token)
+            since = time.time() - int(match[1]) * _WINDOW_UNITS[match[2]]
+        elif key == "level" or (not key and value.lower() in _LEVELS):
+            level = value.upper()
+        elif key in {"event", ""}:
+            event = value
+        else:
+            raise ValueError(token)
+    if count < 1:
+        raise ValueError("n")
+    return level, event, since, count
+
+
+async def _older_logs(level: str | None, event: str | None, since: float | None, until: float, count: int) -> list[dict]:
+    """``logs`` rows from Supabase older than ``until``."""
+    def query():
+        q = supabase.table("logs").select("timestamp,type,message")
+        q = q.lt("timestamp", datetime.utcfromtimestamp(until).isoformat())
+        if since is not None:
+            q = q.gte("timestamp", datetime.utcfromtimestamp(since).isoformat())
+        if level is not None:
+            q = q.eq("type", level)
+        if event is not None:
+            q = q.eq("message", event)
+        return q.order("timestamp", desc=True).limit(count).execute()
+
+    result = await with_supabase_retry(query)
+    return getattr(result, "data", []) or []
+
+
 @router.message(Command("logs"))
-async def last_logs(message: Message) -> None:
-    """Send last 10 logs from Supabase to the admin."""
+async def last_logs(message: Message, command: CommandObject) -> None:
+    """Send recent logs to the admin, from memory when possible."""
     if message.from_user.id != ADMIN_ID:
         return
+    try:
+        level, event, since, count = _parse_logs_args(command.args)
+    except ValueError:
+        await message.answer(_LOGS_USAGE)
+        return
+
+    # (время, уровень, текст), новые первыми
+    records = []
+    for entry in log_buffer.query(level, event, since, count):
+        ts = datetime.utcfromtimestamp(entry.timestamp).isoformat(" ", "seconds")
+        text = entry.message
+        if entry.details:
+            text += " " + json.dumps(entry.details, ensure_ascii=False, default=str)
+        records.append((ts, entry.level, text[:300]))
+
+    # Записи других воркеров и периоды старше буфера есть только в Supabase
+    source = f"память воркера {os.getpid()}"
+    if WEB_CONCURRENCY > 1:
+        source += f" (из {WEB_CONCURRENCY})"
+    error = None
+    if not supabase.dummy and (
+        WEB_CONCURRENCY > 1 or (len(records) < count and not log_buffer.covers(since or 0))
+    ):
+        if WEB_CONCURRENCY > 1:
+            until, limit = time.time(), count
+        else:
+            until, limit = max(log_buffer.evicted_until, log_buffer.started), count - len(records)
+        try:
+            rows = await _older_logs(level, event, since, until, limit)
+        except Exception as e:
+            error = f"Ошибка получения логов из Supabase: {e}"
+            rows = []
+        # Записи этого воркера уровня WARNING и выше есть и в буфере, и в Supabase
+        seen = {(ts, lvl, text[:100]) for ts, lvl, text in records}
+        for row in rows:
+            ts = row.get("timestamp", "")[:19].replace("T", " ")
+            lvl, text = str(row.get("type")), str(row.get("message"))[:300]
+            if (ts, lvl, text[:100]) not in seen:
+                records.append((ts, lvl, text))
+        records = sorted(records, key=lambda record: record[0], reverse=True)[:count]
+        source += f" + Supabase (без INFO, ACTION — выборка {STATS_RAW_SAMPLE_RATE:.0%})"
+
+    lines = [f"{ts} [{lvl}] {text}" for ts, lvl, text in records]
+    if error:
+        lines.append(error)
+    footer = f"ℹ️ Источник: {source}"
+    # Без разметки: в логах бывают "<" и ">"
+    body = "\n".join(lines)[:4000 - len(footer) - 2] or "Нет логов"
+    await message.answer(f"{body}\n\n{footer}", parse_mode=None)
+
+
+@router.message(Command("stats"))
+async def stats_summary(message: Message, command: CommandObject) -> None:
+    """Event counts for the last N hours (24 by default) from the rollups."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    hours = int(command.args) if command.args and command.args.isdigit() else 24
+    # Строки представления почасовые: час, в который попадает начало окна, тоже считаем
+    since = (datetime.utcnow() - timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0).isoformat()
     try:
         result = await with_supabase_retry(
-            lambda: supabase.table("logs")
-            .select("timestamp,type,message")
-            .order("timestamp", desc=True)
-            .limit(10)
+            lambda: supabase.table("stats_rollups_hourly")
+            .select("event,count")
+            .gte("hour", since)
             .execute()
         )
         rows = getattr(result, "data", [])
     except Exception as e:
-        await message.answer(f"Ошибка получения логов: {e}")
+        await message.answer(f"Ошибка получения статистики: {e}")
         return
 
-    lines = []
+    totals: dict[str, int] = {}
     for row in rows:
-        ts = row.get("timestamp", "")[:19].replace("T", " ")
-        lines.append(f"{ts} [{row.get('type')}] {row.get('message')}")
-    await message.answer("\n".join(lines) or "Нет логов")
+        totals[row["event"]] = totals.get(row["event"], 0) + int(row["count"])
+    lines = [f"{event}: {count}" for event, count in sorted(totals.items(), key=lambda item: -item[1])]
+    await message.answer(f"📊 События за {hours} ч:\n" + ("\n".join(lines) or "нет данных"))
+
+
+async def _all_user_ids(page_size: int = 1000) -> list[int]:
+    ids: list[int] = []
+    start = 0
+    while True:
+        result = await with_supabase_retry(
+            lambda: supabase.table("users")
+            .select("telegram_id")
+            .order("id")
+            .range(start, start + page_size)
+            .execute()
+        )
+        rows = getattr(result, "data", [])
+        ids.extend(int(row["telegram_id"]) for row in rows)
+        if len(rows) < page_size:
+            return ids
+        start += page_size
+
+
+@router.message(Command("broadcast"))
+async def broadcast(message: Message, command: CommandObject) -> None:
+    """Queue a message for every registered user (admin only)."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    if not command.args:
+        await message.answer("Использование: /broadcast текст сообщения")
+        return
+    try:
+        recipients = await _all_user_ids()
+    except Exception as e:
+        await message.answer(f"Ошибка получения пользователей: {e}")
+        return
+    batch = await delivery.enqueue(recipients, command.args)
+    StatsLogger.log(event="broadcast_queued", batch=batch, recipients=len(recipients))
+    await message.answer(
+        f"📨 Рассылка {batch} поставлена в очередь: {len(recipients)} получателей.\n"
+        "Прогресс: /broadcast_status"
+    )
+
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status(message: Message, command: CommandObject) -> None:
+    """Show delivery progress of a broadcast (the latest one by default)."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    batch = command.args or await delivery.last_batch()
+    if batch is None:
+        await message.answer("Рассылок ещё не было")
+        return
+    progress = await delivery.progress(batch)
+    counters = ", ".join(f"{k}={v}" for k, v in delivery.stats().items())
+    await message.answer(
+        f"📨 Рассылка {batch}: "
+        + (", ".join(f"{status}={count}" for status, count in sorted(progress.items())) or "нет сообщений")
+        + f"\nПланировщик: {counters}"
+    )
@@ -0,0 +1,111 @@
+"""Retry and circuit-breaker primitives for calls to external services."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from typing import Any
+
+# PostgreSQL/PostgREST error codes that mean "try again later" rather than
+# "this request is wrong": connection failures, cancelled statements,
+# resource exhaustion, serialization conflicts.
+_TRANSIENT_PG_PREFIXES = ("08", "53", "57", "40001", "40P01", "PGRST000", "PGRST001", "PGRST002")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the service while its circuit is open."""
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether ``exc`` is worth retrying and counts as a service failure."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, json.JSONDecodeError):
+        # A gateway error page instead of a PostgREST JSON body
+        return True
+    if type(exc).__module__.split(".")[0] in {"httpx", "httpcore"}:
+        return True
+    code = getattr(exc, "code", None)
+    if code is None:
+        return False
+    code = str(code)
+    if code.isdigit() and len(code) == 3:
+        return code.startswith("5") or code == "429"
+    return code.startswith(_TRANSIENT_PG_PREFIXES)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the ``attempt``-th retry."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Fail fast while a service keeps failing, probe it now and then.
+
+    After ``failure_threshold`` consecutive transient failures the circuit
+    opens and :meth:`allow` refuses calls. Once ``reset_timeout`` seconds
+    have passed the circuit is half-open: one probe call is let through per
+    ``reset_timeout``; a success closes the circuit, a failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_count = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._next_probe_at = 0.0
+        self._state = self.CLOSED
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def available(self) -> bool:
+        """Whether a call could be made now, without taking a probe slot."""
+        state = self.state
+        return state == self.CLOSED or (
+            state == self.HALF_OPEN and time.monotonic() >= self._next_probe_at
+        )
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if state == self.HALF_OPEN and now >= self._next_probe_at:
+            self._next_probe_at = now + self.reset_timeout
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._state = self.CLOSED
+        self._next_probe_at = 0.0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        state = self.state
+        if state == self.OPEN:
+            return  # a call that started before the circuit opened
+        if state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.opened_count += 1
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened_count,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,258 @@
+"""Background jobs that must run once per host, not once per worker.
+
+Every gunicorn worker runs ``on_startup``, so without coordination N
+workers mean N health-check loops, N "bot started" messages and N
+delivery schedulers sharing one Telegram rate limit. (``set_webhook`` is
+idempotent and deliberately runs in every worker: a worker replacing a
+crashed one must not depend on a lease taken by its predecessor.) The
+workers of one host coordinate through leases in a local SQLite
+database (see :mod:`local_db`): a lease is a named row with an owner and
+an expiry, taken with a single atomic upsert.
+
+Three kinds of jobs register with the :data:`scheduler`:
+
+* :meth:`Scheduler.once` - runs in one worker per ``window`` seconds,
+  e.g. on startup; the other workers skip it;
+* :meth:`Scheduler.every` - runs every ``interval`` seconds in whichever
+  worker claims the run first, so the schedule survives worker restarts;
+* :meth:`Scheduler.service` - a long-running task (delivery scheduler)
+  that runs in the leader only. The leader renews its lease every
+  ``SCHEDULER_TICK`` seconds; if it dies, another worker takes over within
+  ``SCHEDULER_LEASE_TTL`` seconds and starts the services.
+
+Leases are only as good as the host clock and assume all workers share
+the database file, i.e. run on one host.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from local_db import DATA_DIR, LocalDB
+from log_utils import logger
+from stats_logger import StatsLogger
+
+SCHEDULER_DB_PATH = os.getenv("SCHEDULER_DB_PATH", str(DATA_DIR / "scheduler.sqlite3"))
+SCHEDULER_TICK = float(os.getenv("SCHEDULER_TICK", "5"))
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))
+# Startup jobs of workers booting within this many seconds run once
+SCHEDULER_ONCE_WINDOW = float(os.getenv("SCHEDULER_ONCE_WINDOW", "120"))
+
+LEADER = "leader"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class _Job:
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    interval: float
+    runs: int = 0
+    failures: int = 0
+    last_duration: float = 0.0
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+
+@dataclass
+class _Service:
+    name: str
+    start: Callable[[], Any]
+    stop: Callable[[], Awaitable[Any]]
+    running: bool = False
+
+
+class Scheduler:
+    """Lease-based coordination of singleton jobs between local workers."""
+
+    def __init__(
+        self,
+        path: str = SCHEDULER_DB_PATH,
+        tick: float = SCHEDULER_TICK,
+        lease_ttl: float = SCHEDULER_LEASE_TTL,
+    ) -> None:
+        self.tick = tick
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._db = LocalDB(path, _SCHEMA)
+        self._jobs: dict[str, _Job] = {}
+        self._services: dict[str, _Service] = {}
+        self._task: asyncio.Task | None = None
+        # Until when this worker may act as the leader without renewing
+        self._leader_until = 0.0
+
+    # --- registration -----------------------------------------------------------------
+
+    def every(self, name: str, interval: float, func: Callable[[], Awaitable[Any]]) -> None:
+        """Run ``func`` every ``interval`` seconds in one of the workers."""
+        self._jobs[name] = _Job(name, func, interval)
+
+    def service(self, name: str, start: Callable[[], Any], stop: Callable[[], Awaitable[Any]]) -> None:
+        """Keep ``start()``-ed only in the leader; ``stop()`` on losing leadership."""
+        self._services[name] = _Service(name, start, stop)
+
+    async def once(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        window: float = SCHEDULER_ONCE_WINDOW,
+    ) -> bool:
+        """Run ``func`` unless another worker already ran it within ``window``.
+
+        Returns whether this worker ran it. A failed run is not retried.
+        """
+        try:
+            if not await self._db.run(self._acquire, f"once:{name}", self.owner, window, False):
+                return False
+        except Exception:
+            logger.exception(f"Scheduler lease for {name} failed; running it anyway")
+        job = _Job(name, func, 0)
+        await self._execute(job)
+        return True
+
+    @property
+    def is_leader(self) -> bool:
+        return time.time() < self._leader_until
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        running = [job.task for job in self._jobs.values() if job.task is not None]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        await self._stop_services()
+        if self._leader_until:
+            # Hand over at once instead of after the lease expires
+            try:
+                await self._db.run(self._release, LEADER, self.owner)
+            except Exception:
+                logger.exception("Scheduler failed to release the leader lease")
+            self._leader_until = 0.0
+        await self._db.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._elect()
+                for job in self._jobs.values():
+                    if job.task is None and await self._db.run(
+                        self._acquire, f"every:{job.name}", self.owner, job.interval, False
+                    ):
+                        job.task = asyncio.create_task(self._execute(job))
+                        job.task.add_done_callback(lambda _task, job=job: setattr(job, "task", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(self.tick)
+
+    async def _elect(self) -> None:
+        try:
+            leader = await self._db.run(self._acquire, LEADER, self.owner, self.lease_ttl, True)
+        except Exception:
+            # Keep running services until our lease would have run out
+            if not self.is_leader:
+                await self._stop_services()
+            raise
+        if leader:
+            if not self._leader_until:
+                logger.info(f"Scheduler: {self.owner} is the leader")
+            self._leader_until = time.time() + self.lease_ttl
+            for service in self._services.values():
+                if not service.running:
+                    service.start()
+                    service.running = True
+        elif self._leader_until:
+            logger.warning(f"Scheduler: {self.owner} lost the leader lease")
+            self._leader_until = 0.0
+            await self._stop_services()
+
+    async def _stop_services(self) -> None:
+        for service in self._services.values():
+            if service.running:
+                service.running = False
+                try:
+                    await service.stop()
+                except Exception:
+                    logger.exception(f"Failed to stop {service.name}")
+
+    async def _execute(self, job: _Job) -> None:
+        start = time.perf_counter()
+        try:
+            await job.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            logger.exception(f"Scheduled job {job.name} failed")
+            StatsLogger.log(event="scheduled_job_error", job=job.name, message=str(e))
+        finally:
+            job.runs += 1
+            job.last_duration = time.perf_counter() - start
+
+    # --- database thread ------------------------------------------------------------------------
+
+    @staticmethod
+    def _acquire(conn: sqlite3.Connection, name: str, owner: str, ttl: float, renew: bool) -> bool:
+        """Take lease ``name`` for ``ttl`` seconds if it is free or expired.
+
+        With ``renew`` the current owner may extend its own lease.
+        """
+        now = time.time()
+        condition = "leases.expires_at <= ?" + (" OR leases.owner = excluded.owner" if renew else "")
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner,"
+                f" expires_at = excluded.expires_at WHERE {condition}",
+                (name, owner, now + ttl, now),
+            )
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, name: str, owner: str) -> None:
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    # --- metrics ------------------------------------------------------------------------------
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "owner": self.owner,
+            "leader": self.is_leader,
+            "services": [name for name, service in self._services.items() if service.running],
+            "jobs": {
+                name: {
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "running": job.task is not None,
+                    "last_duration": round(job.last_duration, 3),
+                }
+                for name, job in self._jobs.items()
+            },
+        }
+
+
+scheduler = Scheduler()
@@ -1,15 +1,22 @@
 import json
+import time
 from datetime import datetime
-from pathlib import Path
 from typing import Any
 
+from log_buffer import ACTION, LogEntry, log_buffer
+from log_shipper import log_shipper
+from stats_rollup import keep_raw, stats_rollup
 from supabase_client import supabase
 
 
 class StatsLogger:
-    """Simple event logger for monitoring bot statistics."""
+    """Simple event logger for monitoring bot statistics.
 
-    path = Path("logs/stats.log")
+    Entries are appended to ``logs/stats.log`` in the background by
+    :mod:`log_shipper` and counted into per-minute rollups (see
+    :mod:`stats_rollup`); only a sample of them is sent to Supabase as
+    raw ``logs`` rows.
+    """
 
     @classmethod
     def log(cls, event: str, **data) -> None:
@@ -18,24 +25,27 @@ class StatsLogger:
             "event": event,
             **data,
         }
-        cls.path.parent.mkdir(exist_ok=True)
-        with cls.path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        log_to_supabase("ACTION", event, details=data)
+        stats_rollup.record(event, data)
+        log_buffer.append(LogEntry(time.time(), ACTION, event, event, data))
+        log_shipper.enqueue(
+            line=json.dumps(entry, ensure_ascii=False, default=str),
+            row=_log_row(ACTION, event, details=data) if keep_raw(event) else None,
+        )
+
+
+def _log_row(type_: str, message: str, details: Any | None = None) -> dict[str, Any] | None:
+    if supabase.dummy:
+        return None
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "type": type_,
+        "message": message,
+        "details": details,
+    }
 
 
 def log_to_supabase(type_: str, message: str, details: Any | None = None) -> None:
-    """Send a log record to the ``logs`` table in Supabase."""
-    try:
-        if supabase.dummy:
-            return
-        entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "type": type_,
-            "message": message,
-            "details": details,
-        }
-        supabase.table("logs").insert(entry).execute()
-    except Exception:
-        # Ignore logging failures to avoid interfering with bot
-        pass
+    """Queue a log record for the ``logs`` table in Supabase."""
+    row = _log_row(type_, message, details)
+    if row is not None:
+        log_shipper.enqueue(row=row)
@@ -0,0 +1,215 @@
+"""Per-minute rollups of ``StatsLogger`` events.
+
+Every :meth:`StatsLogger.log` call used to become a row of the Supabase
+``logs`` table, so write volume grew with traffic. Events are now also
+counted in process, per ``STATS_ROLLUP_SECONDS`` bucket and event name,
+together with count/sum/min/max and a power-of-two histogram of every
+numeric field (``results`` of ``search_query``, ``seconds`` of
+``startup_time`` and so on). Closed buckets are flushed every
+``STATS_ROLLUP_FLUSH_INTERVAL`` seconds as one ``stats_rollups`` row per
+event through the write outbox, keyed by bucket, event and worker, so a
+flush is shipped once even across restarts.
+
+With complete counts in the rollups, raw ``logs`` rows only need to be a
+sample: :func:`keep_raw` keeps ``STATS_RAW_SAMPLE_RATE`` of them, and
+always keeps errors and health issues.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from log_utils import logger
+
+STATS_ROLLUP_SECONDS = int(os.getenv("STATS_ROLLUP_SECONDS", "60"))
+STATS_ROLLUP_FLUSH_INTERVAL = float(os.getenv("STATS_ROLLUP_FLUSH_INTERVAL", "15"))
+STATS_RAW_SAMPLE_RATE = float(os.getenv("STATS_RAW_SAMPLE_RATE", "0.1"))
+
+# Events that are always shipped raw: rare and needed in full for debugging
+_ALWAYS_RAW = ("error", "issue", "startup")
+
+
+def keep_raw(event: str) -> bool:
+    """Whether the raw ``logs`` row of ``event`` should be shipped."""
+    if any(marker in event for marker in _ALWAYS_RAW):
+        return True
+    return STATS_RAW_SAMPLE_RATE >= 1 or random.random() < STATS_RAW_SAMPLE_RATE
+
+
+def _bucket_label(value: float) -> str:
+    """Upper bound of the power-of-two histogram bucket holding ``value``."""
+    if value <= 0:
+        return "0"
+    return format(2.0 ** math.ceil(math.log2(value)), "g")
+
+
+class _Field:
+    __slots__ = ("count", "sum", "min", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: dict[str, int] = {}
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        label = _bucket_label(value)
+        self.buckets[label] = self.buckets.get(label, 0) + 1
+
+    def merge(self, other: _Field) -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for label, count in other.buckets.items():
+            self.buckets[label] = self.buckets.get(label, 0) + count
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min,
+            "max": self.max,
+            "buckets": self.buckets,
+        }
+
+
+class _Rollup:
+    __slots__ = ("count", "fields")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.fields: dict[str, _Field] = {}
+
+    def merge(self, other: _Rollup) -> None:
+        self.count += other.count
+        for name, field in other.fields.items():
+            if name in self.fields:
+                self.fields[name].merge(field)
+            else:
+                self.fields[name] = field
+
+
+class StatsRollup:
+    """Counters and histograms per time bucket and event name."""
+
+    def __init__(self, bucket_seconds: int = STATS_ROLLUP_SECONDS) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._buckets: dict[tuple[int, str], _Rollup] = {}
+        # StatsLogger is also called from executor threads
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self.flushed = 0
+
+    def record(self, event: str, data: dict[str, Any]) -> None:
+        start = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        with self._lock:
+            rollup = self._buckets.get((start, event))
+            if rollup is None:
+                rollup = self._buckets[(start, event)] = _Rollup()
+            rollup.count += 1
+            for name, value in data.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    field = rollup.fields.get(name)
+                    if field is None:
+                        field = rollup.fields[name] = _Field()
+                    field.observe(value)
+
+    def _take(self, everything: bool = False) -> list[tuple[int, str, _Rollup]]:
+        """Remove and return closed buckets (all of them with ``everything``)."""
+        current = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        with self._lock:
+            keys = [key for key in self._buckets if everything or key[0] < current]
+            return [(start, event, self._buckets.pop((start, event))) for start, event in keys]
+
+    def _restore(self, taken: list[tuple[int, str, _Rollup]]) -> None:
+        """Put buckets that were not submitted back for the next flush."""
+        with self._lock:
+            for start, event, rollup in taken:
+                current = self._buckets.get((start, event))
+                if current is None:
+                    self._buckets[(start, event)] = rollup
+                else:
+                    # ``everything`` took the open bucket and it got new events
+                    current.merge(rollup)
+
+    def _row(self, start: int, event: str, rollup: _Rollup) -> dict[str, Any]:
+        return {
+            "bucket_start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+            "bucket_seconds": self.bucket_seconds,
+            "event": event,
+            "worker": self.worker,
+            "count": rollup.count,
+            "fields": {name: field.to_dict() for name, field in rollup.fields.items()},
+        }
+
+    async def flush(self, everything: bool = False) -> int:
+        """Queue closed buckets as ``stats_rollups`` rows; returns how many."""
+        from supabase_client import supabase
+        from write_outbox import write_outbox
+
+        taken = self._take(everything)
+        if not taken or supabase.dummy:
+            return 0
+        for done, (start, event, rollup) in enumerate(taken):
+            try:
+                await write_outbox.submit(
+                    "stats_rollups",
+                    self._row(start, event, rollup),
+                    key=f"stats_rollups:{self.worker}:{start}:{event}",
+                    on_conflict="bucket_start,event,worker",
+                    ignore_duplicates=True,
+                )
+            except BaseException:
+                self._restore(taken[done:])
+                self.flushed += done
+                raise
+        self.flushed += len(taken)
+        return len(taken)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """Buckets not flushed yet, oldest first."""
+        with self._lock:
+            items = sorted(self._buckets.items())
+            return [self._row(start, event, rollup) for (start, event), rollup in items]
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush(everything=True)
+        except Exception:
+            logger.exception("Stats rollup flush failed")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_ROLLUP_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Stats rollup flush failed")
+
+
+stats_rollup = StatsRollup()
@@ -0,0 +1,276 @@
+"""Matching of new jobs against user subscriptions.
+
+A subscription holds optional keywords, an optional city and a minimum
+price; a job matches when it contains every keyword (after the same
+stemming as :mod:`job_search`), is in the subscribed city and pays at
+least the minimum. Instead of checking every subscription for each new
+job, subscriptions with keywords are listed under each of their terms and
+counted per job term, and keyword-less subscriptions sit in per-city
+buckets. Matching therefore only touches subscriptions that share a word
+or the city with the job.
+
+Subscriptions are created and deleted in whichever worker the user talks
+to. Every ``SUBSCRIPTION_INDEX_REFRESH_INTERVAL`` seconds each worker
+fetches the rows saved since its last look, the way
+:meth:`job_search.JobIndex.refresh` does for jobs, so another worker's new
+subscriptions reach matching at most that late. Deletions leave no row to
+fetch; they are picked up by a full reload every
+``SUBSCRIPTION_INDEX_RELOAD_INTERVAL`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Hashable
+
+from job_search import city_key, job_price, parse_timestamp, tokenize
+from log_utils import logger
+from supabase_client import supabase, with_supabase_retry
+
+SUBSCRIPTION_INDEX_REFRESH_INTERVAL = float(os.getenv("SUBSCRIPTION_INDEX_REFRESH_INTERVAL", "60"))
+SUBSCRIPTION_INDEX_RELOAD_INTERVAL = float(os.getenv("SUBSCRIPTION_INDEX_RELOAD_INTERVAL", "3600"))
+
+SUBSCRIPTION_COLUMNS = "id,telegram_id,keywords,city,min_price,created_at"
+
+
+def subscription_key(sub: dict[str, Any]) -> Hashable:
+    return sub.get("id") or (sub.get("telegram_id"), sub.get("created_at"))
+
+
+class SubscriptionIndex:
+    """Term → subscriptions map plus city buckets for keyword-less ones."""
+
+    page_size = 1000
+    # Rows created this much before the newest one seen are fetched again:
+    # ``created_at`` comes from the clocks of different workers
+    refresh_overlap = 300.0
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._subs: dict[Hashable, dict[str, Any]] = {}
+        self._terms: dict[Hashable, frozenset[str]] = {}
+        self._by_term: dict[str, set[Hashable]] = {}
+        # city_key → keyword-less subscriptions; "" holds "any city"
+        self._by_city: dict[str, set[Hashable]] = {}
+        self._by_user: dict[int, set[Hashable]] = {}
+        # add/remove calls made while a reload is fetching the table
+        self._changes: list[tuple[str, Any]] | None = None
+        # Newest ``id`` and ``created_at`` seen in Supabase, for refreshes
+        self._seen_id = 0
+        self._seen_created = 0.0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def add(self, sub: dict[str, Any]) -> None:
+        if self._changes is not None:
+            self._changes.append(("add", sub))
+        key = subscription_key(sub)
+        if key in self._subs:
+            self.remove(key)
+        terms = frozenset(tokenize(sub.get("keywords") or ""))
+        self._subs[key] = sub
+        self._terms[key] = terms
+        if terms:
+            for term in terms:
+                self._by_term.setdefault(term, set()).add(key)
+        else:
+            self._by_city.setdefault(city_key(sub.get("city")), set()).add(key)
+        self._by_user.setdefault(int(sub["telegram_id"]), set()).add(key)
+
+    def remove(self, key: Hashable) -> dict[str, Any] | None:
+        if self._changes is not None:
+            self._changes.append(("remove", key))
+        sub = self._subs.pop(key, None)
+        if sub is None:
+            return None
+        terms = self._terms.pop(key)
+        buckets = (
+            [(self._by_term, term) for term in terms]
+            if terms
+            else [(self._by_city, city_key(sub.get("city")))]
+        )
+        buckets.append((self._by_user, int(sub["telegram_id"])))
+        for mapping, bucket in buckets:
+            keys = mapping.get(bucket)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del mapping[bucket]
+        return sub
+
+    def for_user(self, telegram_id: int) -> list[dict[str, Any]]:
+        subs = [self._subs[key] for key in self._by_user.get(telegram_id, ())]
+        return sorted(subs, key=lambda s: s.get("created_at") or "")
+
+    def match(self, job: dict[str, Any]) -> set[int]:
+        """Return telegram ids of subscribers interested in ``job``."""
+        job_city = city_key(job.get("city"))
+        price = job_price(job)
+        hits: dict[Hashable, int] = {}
+        for term in set(tokenize(f"{job.get('title', '')} {job.get('description', '')}")):
+            for key in self._by_term.get(term, ()):
+                hits[key] = hits.get(key, 0) + 1
+        candidates = [key for key, count in hits.items() if count == len(self._terms[key])]
+        candidates.extend(self._by_city.get(job_city, ()))
+        if job_city:
+            candidates.extend(self._by_city.get("", ()))
+
+        recipients: set[int] = set()
+        for key in candidates:
+            sub = self._subs[key]
+            sub_city = city_key(sub.get("city"))
+            if sub_city and sub_city != job_city:
+                continue
+            min_price = sub.get("min_price") or 0
+            if min_price and (price is None or price < min_price):
+                continue
+            recipients.add(int(sub["telegram_id"]))
+        recipients.discard(_poster_id(job))
+        return recipients
+
+    async def ensure_loaded(self) -> None:
+        async with self._load_lock:
+            if not self.loaded:
+                await self.load()
+
+    async def load(self) -> None:
+        """Fill the index from the ``subscriptions`` table page by page."""
+        await self._fill()
+        self.loaded = True
+        logger.info(f"Subscription index loaded: {len(self)} subscriptions")
+
+    async def reload(self) -> None:
+        """Replace the contents with a fresh copy of the table.
+
+        Subscriptions added or removed in this worker while the table is
+        being read are applied to the copy before it replaces the index.
+        """
+        fresh = SubscriptionIndex()
+        self._changes = []
+        try:
+            await fresh._fill()
+            for method, arg in self._changes:
+                getattr(fresh, method)(arg)
+        finally:
+            self._changes = None
+        self._subs, self._terms = fresh._subs, fresh._terms
+        self._by_term, self._by_city, self._by_user = fresh._by_term, fresh._by_city, fresh._by_user
+        self._seen_id, self._seen_created = fresh._seen_id, fresh._seen_created
+        self.loaded = True
+
+    async def refresh(self) -> int:
+        """Add subscriptions saved since the last load or refresh; returns how many.
+
+        Fetches rows with a newer ``id`` or a ``created_at`` within
+        ``refresh_overlap`` of the newest one seen, page by page in ``id``
+        order. A subscription this worker deletes meanwhile is not brought
+        back by a response read before the delete.
+        """
+        if supabase.dummy:
+            return 0
+        since = datetime.utcfromtimestamp(max(0.0, self._seen_created - self.refresh_overlap))
+        # Quoted: timestamps contain reserved characters (":", ".")
+        changes = f'(id.gt.{self._seen_id},created_at.gt."{since.isoformat()}")'
+        rows: list[dict[str, Any]] = []
+        self._changes = []
+        try:
+            cursor = 0
+            while True:
+                def query(cursor=cursor) -> Any:
+                    q = (
+                        supabase.table("subscriptions")
+                        .select(SUBSCRIPTION_COLUMNS)
+                        .gt("id", cursor)
+                        .order("id")
+                        .limit(self.page_size)
+                    )
+                    q.params = q.params.add("or", changes)
+                    return q.execute()
+
+                page = getattr(await with_supabase_retry(query), "data", []) or []
+                rows.extend(page)
+                if len(page) < self.page_size:
+                    break
+                cursor = page[-1]["id"]
+            removed = {arg for method, arg in self._changes if method == "remove"}
+        finally:
+            self._changes = None
+        added = 0
+        for row in rows:
+            key = subscription_key(row)
+            if key not in self._subs and key not in removed:
+                self.add(row)
+                added += 1
+            self._track(row)
+        return added
+
+    def _track(self, row: dict[str, Any]) -> None:
+        if isinstance(row.get("id"), int):
+            self._seen_id = max(self._seen_id, row["id"])
+        created = parse_timestamp(row.get("created_at"))
+        if created is not None:
+            self._seen_created = max(self._seen_created, created)
+
+    async def _fill(self) -> None:
+        start = 0
+        while True:
+            result = await with_supabase_retry(
+                lambda: supabase.table("subscriptions")
+                .select(SUBSCRIPTION_COLUMNS)
+                .order("id")
+                .range(start, start + self.page_size)
+                .execute()
+            )
+            rows = getattr(result, "data", [])
+            for row in rows:
+                self.add(row)
+                self._track(row)
+            if len(rows) < self.page_size:
+                break
+            start += self.page_size
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Load the index and keep it up to date in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            await self.ensure_loaded()
+        except Exception:
+            logger.exception("Subscription index load failed; retrying on the next refresh")
+        next_reload = time.monotonic() + SUBSCRIPTION_INDEX_RELOAD_INTERVAL
+        while True:
+            await asyncio.sleep(SUBSCRIPTION_INDEX_REFRESH_INTERVAL)
+            try:
+                if not self.loaded or time.monotonic() >= next_reload:
+                    await self.reload()
+                    next_reload = time.monotonic() + SUBSCRIPTION_INDEX_RELOAD_INTERVAL
+                else:
+                    await self.refresh()
+            except Exception:
+                logger.exception("Subscription index refresh failed")
+
+
+def _poster_id(job: dict[str, Any]) -> int | None:
+    try:
+        return int(job.get("user_id"))
+    except (TypeError, ValueError):
+        return None
+
+
+subscription_index = SubscriptionIndex()
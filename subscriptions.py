@@ -0,0 +1,182 @@
+from datetime import datetime
+from html import escape
+
+from aiogram import F, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from delivery import delivery
+from keyboards import menu_keyboard, remove_keyboard
+from menu_routing import MenuAction
+from stats_logger import StatsLogger
+from subscription_index import subscription_index, subscription_key
+from supabase_client import supabase, with_supabase_retry
+
+router = Router(name="subscriptions")
+
+MAX_SUBSCRIPTIONS = 10
+
+# 🔔 Состояния FSM
+class Subscribe(StatesGroup):
+    keywords = State()
+    city = State()
+    min_price = State()
+
+
+def _describe(sub: dict) -> str:
+    parts = [f"🔑 {escape(sub['keywords'])}" if sub.get("keywords") else "🔑 любые"]
+    parts.append(f"📍 {escape(sub['city'])}" if sub.get("city") else "📍 любой город")
+    if sub.get("min_price"):
+        parts.append(f"💰 от {sub['min_price']} руб.")
+    return " · ".join(parts)
+
+
+def _subscriptions_view(telegram_id: int) -> tuple[str, InlineKeyboardMarkup]:
+    subs = subscription_index.for_user(telegram_id)
+    buttons = [
+        [InlineKeyboardButton(text=f"❌ Удалить #{n}", callback_data=f"sub:del:{sub.get('id')}")]
+        for n, sub in enumerate(subs, 1)
+        if sub.get("id") is not None
+    ]
+    if len(subs) < MAX_SUBSCRIPTIONS:
+        buttons.append([InlineKeyboardButton(text="➕ Новая подписка", callback_data="sub:new")])
+    if subs:
+        lines = [f"#{n} {_describe(sub)}" for n, sub in enumerate(subs, 1)]
+        text = "🔔 <b>Ваши подписки</b>\n\n" + "\n".join(lines)
+    else:
+        text = "🔔 У вас пока нет подписок. Мы сообщим о новых подработках по вашим условиям."
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# 🔔 Список подписок
+@router.message(MenuAction("subscriptions"), flags={"throttle": "subscriptions"})
+async def show_subscriptions(message: Message, state: FSMContext) -> None:
+    StatsLogger.log(event="click_subscriptions")
+    await state.clear()
+    try:
+        await subscription_index.ensure_loaded()
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await message.answer("⚠️ Подписки временно недоступны, попробуйте позже.", reply_markup=menu_keyboard)
+        return
+    text, keyboard = _subscriptions_view(message.from_user.id)
+    await message.answer(text, reply_markup=keyboard)
+
+
+# ➕ Новая подписка
+@router.callback_query(F.data == "sub:new")
+async def new_subscription(callback: CallbackQuery, state: FSMContext) -> None:
+    await callback.answer()
+    if len(subscription_index.for_user(callback.from_user.id)) >= MAX_SUBSCRIPTIONS:
+        await callback.message.answer(f"⚠️ Можно оформить не больше {MAX_SUBSCRIPTIONS} подписок.")
+        return
+    await callback.message.answer(
+        "🔑 Введите ключевые слова (например: <i>курьер</i>) или «-» для любых подработок:",
+        reply_markup=remove_keyboard,
+    )
+    await state.set_state(Subscribe.keywords)
+
+
+@router.message(Subscribe.keywords)
+async def get_keywords(message: Message, state: FSMContext) -> None:
+    if not (message.text and message.text.strip()):
+        await message.answer("⚠️ Напишите ключевые слова текстом или «-».")
+        return
+    keywords = message.text.strip()
+    await state.update_data(keywords="" if keywords == "-" else keywords)
+    await message.answer("📍 Укажите город или «-» для любого:")
+    await state.set_state(Subscribe.city)
+
+
+@router.message(Subscribe.city)
+async def get_city(message: Message, state: FSMContext) -> None:
+    if not (message.text and message.text.strip()):
+        await message.answer("⚠️ Напишите город текстом или «-».")
+        return
+    city = message.text.strip()
+    await state.update_data(city="" if city == "-" else city)
+    await message.answer("💰 Минимальная оплата в рублях (0 — без ограничения):")
+    await state.set_state(Subscribe.min_price)
+
+
+@router.message(Subscribe.min_price)
+async def get_min_price(message: Message, state: FSMContext) -> None:
+    price_text = (message.text or "").strip()
+    if not price_text.isdigit():
+        await message.answer("⚠️ Укажите сумму числом, без символов.")
+        return
+
+    data = await state.get_data()
+    await state.clear()
+    sub = {
+        "telegram_id": message.from_user.id,
+        "keywords": data["keywords"],
+        "city": data["city"],
+        "min_price": int(price_text),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    try:
+        result = await with_supabase_retry(
+            lambda: supabase.table("subscriptions").insert(sub).execute()
+        )
+        saved = getattr(result, "data", [])
+        subscription_index.add(saved[0] if saved else sub)
+        StatsLogger.log(event="subscription_created")
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await message.answer("⚠️ Не удалось сохранить подписку, попробуйте позже.", reply_markup=menu_keyboard)
+        return
+
+    await message.answer(f"✅ Подписка оформлена!\n{_describe(sub)}", reply_markup=menu_keyboard)
+
+
+# ❌ Удаление подписки
+@router.callback_query(F.data.startswith("sub:del:"))
+async def delete_subscription(callback: CallbackQuery) -> None:
+    sub_id = callback.data.rsplit(":", 1)[1]
+    user_id = callback.from_user.id
+    sub = next(
+        (s for s in subscription_index.for_user(user_id) if str(s.get("id")) == sub_id),
+        None,
+    )
+    if sub is None:
+        await callback.answer("Подписка не найдена")
+        return
+    try:
+        await with_supabase_retry(
+            lambda: supabase.table("subscriptions")
+            .delete()
+            .eq("id", sub["id"])
+            .eq("telegram_id", user_id)
+            .execute()
+        )
+    except Exception as e:
+        StatsLogger.log(event="supabase_error", message=str(e))
+        await callback.answer("⚠️ Не удалось удалить подписку")
+        return
+
+    subscription_index.remove(subscription_key(sub))
+    StatsLogger.log(event="subscription_deleted")
+    await callback.answer("Подписка удалена")
+    text, keyboard = _subscriptions_view(user_id)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+
+
+# 📨 Рассылка о новой подработке
+async def notify_subscribers(job: dict) -> None:
+    """Queue notifications about ``job`` for all matching subscribers."""
+    await subscription_index.ensure_loaded()
+    recipients = subscription_index.match(job)
+    if not recipients:
+        return
+    StatsLogger.log(event="subscription_matches", count=len(recipients))
+    text = (
+        "🔔 <b>Новая подработка по вашей подписке</b>\n\n"
+        f"<b>{escape(str(job['title']))}</b>\n"
+        f"{escape(str(job['description']))}\n"
+        f"💰 {escape(str(job['price']))} руб.\n"
+        f"📍 {escape(str(job['city']))}\n"
+        f"📞 {escape(str(job['contact']))}"
+    )
+    await delivery.enqueue(recipients, text)
@@ -9,18 +9,39 @@ first use and return a no-op stub when credentials are missing or set to
 
 from __future__ import annotations
 
-import os
-from typing import Any, Callable
 import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable
+
 from log_utils import logger
+from metrics import SUPABASE_DURATION, SUPABASE_REQUESTS, track
+from resilience import CircuitBreaker, CircuitOpenError, backoff_delay, is_transient
 
 from dotenv import load_dotenv
-from supabase import Client, create_client
+
+if TYPE_CHECKING:
+    # The SDK (supabase, gotrue, postgrest, httpx) takes a large share of
+    # the bot's import time; it is imported on the first query instead
+    from supabase import Client
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "")
+# Upper bound on PostgREST round-trips running at the same time
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "8"))
+# Seconds a single ``.execute()`` may take before the caller gives up
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+# Total time budget of one operation including all retries
+SUPABASE_DEADLINE = float(os.getenv("SUPABASE_DEADLINE", "15"))
+SUPABASE_RETRY_BASE = float(os.getenv("SUPABASE_RETRY_BASE", "0.5"))
+SUPABASE_RETRY_CAP = float(os.getenv("SUPABASE_RETRY_CAP", "4"))
+SUPABASE_BREAKER_THRESHOLD = int(os.getenv("SUPABASE_BREAKER_THRESHOLD", "5"))
+SUPABASE_BREAKER_RESET = float(os.getenv("SUPABASE_BREAKER_RESET", "30"))
 
 # Debug output to verify credentials
 logger.info("SUPABASE_URL present: %s", bool(SUPABASE_URL))
@@ -36,20 +57,61 @@ class _DummyResponse:
     data: list[Any] = []
 
 
+class _DummyParams:
+    """Stand-in for the query string of a request builder."""
+    def add(self, *args: Any, **kwargs: Any) -> "_DummyParams":
+        return self
+
+    def set(self, *args: Any, **kwargs: Any) -> "_DummyParams":
+        return self
+
+
 class _DummyTable:
     """Mimic Supabase table/query interface and return empty data."""
+    params = _DummyParams()
+
     def select(self, *args: Any, **kwargs: Any) -> "_DummyTable":
         return self
 
     def insert(self, *args: Any, **kwargs: Any) -> "_DummyTable":
         return self
 
+    def upsert(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
     def update(self, *args: Any, **kwargs: Any) -> "_DummyTable":
         return self
 
+    def delete(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
     def eq(self, *args: Any, **kwargs: Any) -> "_DummyTable":
         return self
 
+    def gt(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def gte(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def lt(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def is_(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def in_(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def order(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def limit(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
+    def range(self, *args: Any, **kwargs: Any) -> "_DummyTable":
+        return self
+
     def execute(self) -> _DummyResponse:
         return _DummyResponse()
 
@@ -59,11 +121,58 @@ class _DummySupabase:
         return _DummyTable()
 
 
+class _TimedQuery:
+    """Proxy for a query builder that times ``execute()`` per table and operation.
+
+    The operation is the first builder method called on the table
+    (``select``, ``insert``, ``upsert``, ``update`` or ``delete``); filters
+    and modifiers chained after it are passed through.
+    """
+
+    __slots__ = ("_query", "_table", "_op")
+
+    def __init__(self, query: Any, table: str, op: str | None = None) -> None:
+        object.__setattr__(self, "_query", query)
+        object.__setattr__(self, "_table", table)
+        object.__setattr__(self, "_op", op)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._query, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return _TimedQuery(result, self._table, self._op or name)
+            return result
+
+        return call
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._query, name, value)
+
+    def execute(self) -> Any:
+        op = self._op or "unknown"
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            result = self._query.execute()
+            outcome = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            SUPABASE_DURATION.observe(elapsed, self._table, op)
+            SUPABASE_REQUESTS.inc(self._table, op, outcome)
+            track(f"supabase {self._table}.{op}", elapsed)
+
+
 class LazySupabase:
     """Wrapper that lazily creates the Supabase client."""
 
     def __init__(self) -> None:
         self._client: Client | None = None
+        self._lock = threading.Lock()
         self.dummy = _is_dummy(SUPABASE_URL) or _is_dummy(SUPABASE_KEY)
         logger.info("Dummy mode: %s", self.dummy)
 
@@ -71,24 +180,105 @@ class LazySupabase:
         if self.dummy:
             return _DummySupabase()
         if self._client is None:
-            logger.info("Creating Supabase client")
-            self._client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            # First queries usually arrive together from the pool threads
+            with self._lock:
+                if self._client is None:
+                    start = time.perf_counter()
+                    from supabase import create_client
+
+                    self._client = create_client(SUPABASE_URL, SUPABASE_KEY)
+                    logger.info("Supabase client created in %.2f sec", time.perf_counter() - start)
         return self._client
 
     def table(self, name: str) -> Any:
-        return self._ensure_client().table(name)
+        return _TimedQuery(self._ensure_client().table(name), name)
 
 
 supabase = LazySupabase()
 
+# Shared by every call so that an outage makes all of them fail fast
+supabase_breaker = CircuitBreaker(
+    "supabase",
+    failure_threshold=SUPABASE_BREAKER_THRESHOLD,
+    reset_timeout=SUPABASE_BREAKER_RESET,
+)
+
+# The SDK is synchronous, so queries run on a dedicated bounded pool instead
+# of the event loop. The pool size doubles as the concurrency limit.
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=SUPABASE_MAX_CONCURRENCY,
+            thread_name_prefix="supabase",
+        )
+    return _executor
+
+
+async def run_supabase(func: Callable[[], Any], timeout: float | None = None) -> Any:
+    """Run blocking ``func`` on the Supabase pool without blocking the loop.
+
+    Raises ``asyncio.TimeoutError`` when the call takes longer than
+    ``timeout`` seconds (``SUPABASE_TIMEOUT`` by default). The worker thread
+    cannot be interrupted, but the caller is released immediately.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    future = loop.run_in_executor(_get_executor(), ctx.run, func)
+    return await asyncio.wait_for(future, timeout or SUPABASE_TIMEOUT)
 
-async def with_supabase_retry(func: Callable[[], Any], max_retries: int = 3) -> Any:
-    """Execute ``func`` with retries for transient Supabase errors."""
+
+def shutdown_supabase_executor() -> None:
+    """Release pool threads without waiting for them.
+
+    Queries already running finish in their threads; queries still waiting
+    for a free thread are cancelled. Called last on shutdown, after the
+    components that write to Supabase have flushed.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def with_supabase_retry(
+    func: Callable[[], Any],
+    max_retries: int = 3,
+    timeout: float | None = None,
+    deadline: float | None = None,
+) -> Any:
+    """Execute ``func`` off the event loop with retries for transient errors.
+
+    Transient errors (timeouts, network failures, 5xx/429, retryable
+    PostgreSQL codes) are retried with exponential backoff and full jitter
+    for at most ``deadline`` seconds (``SUPABASE_DEADLINE``); other errors
+    are raised at once. Raises :class:`CircuitOpenError` without calling
+    Supabase while :data:`supabase_breaker` is open.
+    """
+    deadline_at = time.monotonic() + (deadline or SUPABASE_DEADLINE)
     for attempt in range(1, max_retries + 1):
+        if not supabase_breaker.allow():
+            raise CircuitOpenError("Supabase circuit is open")
+        remaining = deadline_at - time.monotonic()
         try:
-            return func()
+            result = await run_supabase(func, min(timeout or SUPABASE_TIMEOUT, remaining))
         except Exception as e:
-            logger.warning(f"Supabase error on attempt {attempt}: {e}")
-            if attempt >= max_retries or not any(code in str(e) for code in ("500", "503")):
+            transient = is_transient(e)
+            if transient:
+                supabase_breaker.record_failure()
+            else:
+                # The service answered; the request itself was rejected
+                supabase_breaker.record_success()
+            logger.warning(f"Supabase error on attempt {attempt}: {type(e).__name__}: {e}")
+            if not transient or attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, SUPABASE_RETRY_BASE, SUPABASE_RETRY_CAP)
+            if time.monotonic() + delay >= deadline_at:
                 raise
-            await asyncio.sleep(1)
+            await asyncio.sleep(delay)
+        else:
+            supabase_breaker.record_success()
+            return result
@@ -0,0 +1,58 @@
+"""Shared fixtures: the bot's modules run against the bench fake PostgREST.
+
+The Supabase settings are read when :mod:`supabase_client` is imported, so
+the fake server is started and the environment set up here, before any
+test module imports the bot. The working directory is a scratch one, as in
+:mod:`bench.harness`, so ``logs/`` and ``data/`` stay out of the tree.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from bench.harness import BENCH_KEY, ServerThread  # noqa: E402
+
+_postgrest = FakePostgrest()
+_servers = ServerThread()
+_workdir = tempfile.TemporaryDirectory(prefix="joby-tests-")
+(_postgrest_url,) = _servers.start(_postgrest.app())
+os.environ.update({"SUPABASE_URL": _postgrest_url, "SUPABASE_KEY": BENCH_KEY, "BOT_TOKEN": "dummy"})
+os.chdir(_workdir.name)
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    _servers.stop()
+    os.chdir(REPO_ROOT)
+    _workdir.cleanup()
+
+
+@pytest.fixture
+def postgrest() -> FakePostgrest:
+    """The fake server with empty tables and a closed Supabase circuit."""
+    from supabase_client import supabase_breaker
+
+    _postgrest.tables.clear()
+    _postgrest.faults.error_rate = 0.0
+    supabase_breaker.record_success()
+    return _postgrest
+
+
+async def eventually(check: Callable[[], Awaitable[bool]], timeout: float = 5.0) -> None:
+    """Wait until ``await check()`` is true or fail after ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    while not await check():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.02)
@@ -0,0 +1,31 @@
+from action_log import ActionLogWriter, rotated_files
+
+
+def test_rotated_files_oldest_first_and_live_last(tmp_path):
+    for name in (
+        "actions.log", "actions.log.lock", "actions.log.20260102-000000",  # still compressing
+        "actions.log.20260102-000000-1.gz", "actions.log.20260101-120000.gz",
+        "actions.log.20260102-000000.gz", "actions.log.bak",
+    ):
+        (tmp_path / name).write_text("")
+
+    assert [path.name for path in rotated_files(tmp_path)] == [
+        "actions.log.20260101-120000.gz",
+        "actions.log.20260102-000000.gz",
+        "actions.log.20260102-000000-1.gz",
+        "actions.log",
+    ]
+
+
+def test_writer_rotation_is_discovered(tmp_path):
+    path = tmp_path / "actions.log"
+    writer = ActionLogWriter(str(path), max_bytes=1, rotate_seconds=0)
+    for n in range(3):
+        writer.write({"n": n})
+        writer.close()
+    writer.max_bytes = 0
+    writer.write({"n": "live"})
+    writer.close()
+    names = [file.name for file in rotated_files(tmp_path)]
+    assert names[-1] == "actions.log"
+    assert len(names) >= 2 and all(name.endswith(".gz") for name in names[:-1])
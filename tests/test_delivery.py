@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from conftest import eventually
+from delivery import PENDING, SENT, DeliveryScheduler
+
+
+class FloodingBot:
+    """Answers the first ``floods`` sends with a flood wait."""
+
+    def __init__(self, floods: int, retry_after: int = 1) -> None:
+        self.floods = floods
+        self.retry_after = retry_after
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None) -> None:
+        if self.floods:
+            self.floods -= 1
+            method = SendMessage(chat_id=chat_id, text=text)
+            raise TelegramRetryAfter(method, "Too Many Requests", self.retry_after)
+        self.sent.append(chat_id)
+
+
+def test_flood_waits_requeue_and_lower_the_rate(tmp_path):
+    async def scenario() -> None:
+        scheduler = DeliveryScheduler(str(tmp_path / "outbox.sqlite3"), rate=20, per_chat_rate=100)
+        scheduler.poll_interval = 0.05
+        bot = FloodingBot(floods=3)
+        scheduler.setup(bot)
+        batch = await scheduler.enqueue([1, 2, 3, 4], "Привет")
+
+        async def delivered() -> bool:
+            return (await scheduler.progress(batch)).get(SENT) == 4
+
+        await eventually(delivered, timeout=10)
+        await scheduler.stop()
+        assert scheduler.flood_waits == 3
+        assert scheduler.stats()["rate"] < 20
+        assert scheduler.failed == scheduler.retried == 0
+        assert sorted(bot.sent) == [1, 2, 3, 4]
+
+    asyncio.run(scenario())
+
+
+def test_flood_wait_blocks_and_rate_recovers(tmp_path):
+    scheduler = DeliveryScheduler(str(tmp_path / "outbox.sqlite3"), rate=20)
+    scheduler._slow_down(5)
+    assert scheduler._global.rate == 10
+    assert not scheduler._global.try_acquire()
+    scheduler._slow_down(5)  # the same flood wait reported by another send
+    assert scheduler._global.rate == 10
+    for _ in range(1000):
+        scheduler._speed_up()
+    assert scheduler._global.rate == 20
+
+
+def test_flooded_message_is_not_an_attempt(tmp_path):
+    async def scenario() -> dict:
+        scheduler = DeliveryScheduler(str(tmp_path / "outbox.sqlite3"))
+        scheduler.setup(FloodingBot(floods=1, retry_after=60), autostart=False)
+        await scheduler.enqueue([1], "Привет")
+        (row,) = await scheduler._db.run(scheduler._claim, 10)
+        await scheduler._slots.acquire()
+        await scheduler._deliver(row)
+        await scheduler._flush_results()
+        statuses = await scheduler._db.run(
+            lambda conn: conn.execute("SELECT status, attempts, next_attempt_at > strftime('%s','now') FROM outbox").fetchall()
+        )
+        await scheduler.stop()
+        return statuses
+
+    assert asyncio.run(scenario()) == [(PENDING, 0, 1)]
+
+
+def test_finished_batches_are_purged_while_running(tmp_path, monkeypatch):
+    monkeypatch.setattr("delivery.DELIVERY_RETENTION", 0.0)
+
+    async def scenario() -> None:
+        scheduler = DeliveryScheduler(str(tmp_path / "outbox.sqlite3"), per_chat_rate=100)
+        scheduler.poll_interval = 0.05
+        scheduler.purge_interval = 0.1
+        scheduler.setup(FloodingBot(floods=0))
+        await scheduler.enqueue([1, 2], "Привет")
+
+        async def purged() -> bool:
+            return scheduler.sent == 2 and not await scheduler.progress()
+
+        await eventually(purged)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_while_woken_ends_the_scheduler(tmp_path):
+    async def scenario() -> None:
+        scheduler = DeliveryScheduler(str(tmp_path / "outbox.sqlite3"))
+        scheduler.setup(FloodingBot(floods=0))
+        scheduler.start()
+        await asyncio.sleep(0.05)
+        scheduler._wakeup.set()
+        started = time.monotonic()
+        await asyncio.wait_for(scheduler.stop(), 5)
+        assert time.monotonic() - started < 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import job_expiry
+from job_search import JobIndex
+
+
+def _job(dedup_key: str, expires_in: timedelta) -> dict:
+    return {
+        "user_id": "1", "title": "Курьер", "description": "доставка", "city": "Минск",
+        "dedup_key": dedup_key, "expires_at": (datetime.utcnow() + expires_in).isoformat(),
+    }
+
+
+def test_sweep_archives_and_deletes_expired_jobs(postgrest, monkeypatch):
+    index = JobIndex()
+    monkeypatch.setattr(job_expiry, "job_index", index)
+    postgrest.seed("jobs", [_job("old", timedelta(hours=-1)), _job("new", timedelta(days=1))])
+    for row in postgrest.table("jobs").rows:
+        index.add(dict(row))
+
+    assert asyncio.run(job_expiry.sweep_expired()) == 1
+    assert [row["dedup_key"] for row in postgrest.table("jobs").rows] == ["new"]
+    assert [row["dedup_key"] for row in postgrest.table("jobs_archive").rows] == ["old"]
+    assert [job["dedup_key"] for job in index._jobs.values()] == ["new"]
+
+
+def test_job_extended_during_the_sweep_is_kept(postgrest, monkeypatch):
+    index = JobIndex()
+    monkeypatch.setattr(job_expiry, "job_index", index)
+    postgrest.seed("jobs", [_job("extended", timedelta(hours=-1))])
+    (stored,) = postgrest.table("jobs").rows
+    index.add(dict(stored))
+    calls = 0
+    retry = job_expiry.with_supabase_retry
+
+    async def extend_before_delete(func, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 3:  # select, archive, then the delete
+            stored["expires_at"] = (datetime.utcnow() + timedelta(days=14)).isoformat()
+        return await retry(func, *args, **kwargs)
+
+    monkeypatch.setattr(job_expiry, "with_supabase_retry", extend_before_delete)
+
+    assert asyncio.run(job_expiry.sweep_expired()) == 0
+    assert postgrest.table("jobs").rows == [stored]
+    assert not postgrest.table("jobs_archive").rows
+    assert len(index) == 1
@@ -0,0 +1,50 @@
+import asyncio
+import time
+from datetime import datetime
+
+from job_search import JobIndex
+from supabase_client import supabase
+
+
+def _job(id_: int, expires_in: float) -> dict:
+    return {
+        "id": id_, "user_id": "1", "title": f"Курьер {id_}", "description": "доставка",
+        "city": "Минск", "dedup_key": f"job-{id_}",
+        "expires_at": datetime.utcfromtimestamp(time.time() + expires_in).isoformat(),
+    }
+
+
+def test_refresh_in_dummy_mode_only_prunes(monkeypatch, caplog):
+    monkeypatch.setattr(supabase, "dummy", True)
+    index = JobIndex()
+    index.add(_job(1, -5))
+    index.add(_job(2, 10))  # expiring soon: would be re-checked against Supabase
+
+    assert asyncio.run(index.refresh()) == 0
+    assert [job["id"] for job in index._jobs.values()] == [2]
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+
+
+def _seed(postgrest, id_: int) -> dict:
+    row = _job(id_, 3600)
+    del row["id"]  # serial in the fake
+    postgrest.seed("jobs", [row], unique=("dedup_key",))
+    return postgrest.table("jobs").rows[-1]
+
+
+def test_refresh_picks_up_new_and_extended_jobs(postgrest):
+    index = JobIndex()
+    stored = _seed(postgrest, 1)
+    asyncio.run(index.load())
+    assert len(index) == 1
+
+    _seed(postgrest, 2)
+    assert asyncio.run(index.refresh()) == 1
+    assert len(index) == 2
+
+    # Expired locally but extended by another worker in the meantime
+    stored["expires_at"] = datetime.utcfromtimestamp(time.time() - 1).isoformat()
+    index.add(dict(stored))
+    stored["expires_at"] = datetime.utcfromtimestamp(time.time() + 3600).isoformat()
+    asyncio.run(index.refresh())
+    assert len(index) == 2
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from log_shipper import LogShipper
+
+
+def test_enqueue_after_stop_waits_for_exit_flush(tmp_path):
+    shipper = LogShipper(tmp_path / "stats.log", tmp_path / "spill.jsonl")
+
+    async def scenario() -> None:
+        shipper.start()
+        shipper.enqueue(line="before")
+        await shipper.stop()
+        shipper.enqueue(line="after")
+        assert shipper._task is None
+        assert len(shipper) == 1
+
+    asyncio.run(scenario())
+    shipper.flush_sync()
+    assert (tmp_path / "stats.log").read_text(encoding="utf-8").splitlines() == ["before", "after"]
+
+
+def test_stop_while_woken_ends_the_drain_task(tmp_path):
+    shipper = LogShipper(tmp_path / "stats.log", tmp_path / "spill.jsonl")
+
+    async def scenario() -> None:
+        shipper.start()
+        await asyncio.sleep(0.05)
+        shipper._wakeup.set()
+        started = time.monotonic()
+        await asyncio.wait_for(shipper.stop(), 5)
+        assert time.monotonic() - started < 2
+
+    asyncio.run(scenario())
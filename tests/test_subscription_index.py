@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime
+
+from subscription_index import SubscriptionIndex, subscription_key
+
+
+def _sub(telegram_id: int, keywords: str = "курьер") -> dict:
+    return {
+        "telegram_id": telegram_id, "keywords": keywords, "city": "Минск", "min_price": 0,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+JOB = {"title": "Курьер", "description": "доставка", "city": "Минск", "price": "50", "user_id": "1"}
+
+
+def test_refresh_adds_new_rows_and_reload_drops_deleted_ones(postgrest):
+    postgrest.seed("subscriptions", [_sub(10), _sub(11)])
+    index = SubscriptionIndex()
+    asyncio.run(index.load())
+    assert index.match(JOB) == {10, 11}
+
+    postgrest.seed("subscriptions", [_sub(12)])
+    postgrest.table("subscriptions").rows.pop(0)  # deleted through another worker
+    assert asyncio.run(index.refresh()) == 1
+    assert index.match(JOB) == {10, 11, 12}
+    assert asyncio.run(index.refresh()) == 0
+
+    asyncio.run(index.reload())
+    assert index.match(JOB) == {11, 12}
+    assert asyncio.run(index.refresh()) == 0
+
+
+def test_refresh_does_not_revive_a_subscription_deleted_meanwhile(postgrest):
+    postgrest.seed("subscriptions", [_sub(10)])
+    index = SubscriptionIndex()
+    asyncio.run(index.load())
+    postgrest.seed("subscriptions", [_sub(11)])
+    (row,) = [row for row in postgrest.table("subscriptions").rows if row["telegram_id"] == 11]
+
+    async def scenario() -> None:
+        refresh = asyncio.create_task(index.refresh())
+        await asyncio.sleep(0)  # the refresh request is on its way
+        index.add(dict(row))
+        index.remove(subscription_key(row))  # the user deleted it right away
+        await refresh
+
+    asyncio.run(scenario())
+    assert index.match(JOB) == {10}
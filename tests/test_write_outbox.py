@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+from conftest import eventually
+from write_outbox import DONE, WriteOutbox
+
+ROLLUP_CONFLICT = "bucket_start,event,worker"
+
+
+def _rollup(event: str, count: int) -> dict:
+    return {"bucket_start": "2026-01-01T10:00:00", "event": event, "worker": "w1", "count": count}
+
+
+def test_composite_conflict_keeps_every_key(postgrest, tmp_path):
+    async def scenario() -> None:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        outbox.poll_interval = 0.05
+        for key, row in (("a", _rollup("start", 3)), ("b", _rollup("search", 5))):
+            assert await outbox.submit("stats_rollup", row, key, on_conflict=ROLLUP_CONFLICT)
+
+        async def shipped() -> bool:
+            return (await outbox.backlog()).get(DONE) == 2
+
+        await eventually(shipped)
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    rows = postgrest.table("stats_rollup").rows
+    assert sorted((row["event"], row["count"]) for row in rows) == [("search", 5), ("start", 3)]
+
+
+def test_same_conflict_key_latest_wins(postgrest, tmp_path):
+    async def scenario() -> None:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        # Queue both before the replayer runs so they share one batch
+        await outbox._db.run(outbox._insert, "users", "telegram_id", False, [
+            ("u1", {"telegram_id": 1, "city": "Минск"}),
+            ("u2", {"telegram_id": 1, "city": "Брест"}),
+        ])
+        outbox.start()
+
+        async def shipped() -> bool:
+            return (await outbox.backlog()).get(DONE) == 2
+
+        await eventually(shipped)
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    rows = postgrest.table("users").rows
+    assert [(row["telegram_id"], row["city"]) for row in rows] == [(1, "Брест")]
+
+
+def test_duplicate_idempotency_key_is_recorded_once(postgrest, tmp_path):
+    async def scenario() -> list[bool]:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        row = {"dedup_key": "job-1", "title": "Курьер"}
+        added = [
+            await outbox.submit("jobs", row, "job-1", on_conflict="dedup_key"),
+            await outbox.submit("jobs", row, "job-1", on_conflict="dedup_key"),
+        ]
+        await outbox.stop()
+        return added
+
+    assert asyncio.run(scenario()) == [True, False]
+
+
+def test_transient_failure_is_replayed(postgrest, tmp_path):
+    postgrest.faults.error_rate = 1.0
+
+    async def scenario() -> None:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        outbox.poll_interval = 0.05
+        outbox.retry_base = 0.01
+        outbox.retry_cap = 0.05
+        await outbox.submit("users", {"telegram_id": 7, "city": "Гомель"}, "u7", on_conflict="telegram_id")
+
+        async def retried() -> bool:
+            return outbox.retried > 0
+
+        await eventually(retried)
+        assert not postgrest.table("users").rows
+        postgrest.faults.error_rate = 0.0
+
+        async def shipped() -> bool:
+            return (await outbox.backlog()).get(DONE) == 1
+
+        await eventually(shipped, timeout=30)
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    assert [row["telegram_id"] for row in postgrest.table("users").rows] == [7]
+
+
+def test_submit_after_stop_does_not_restart_the_replayer(postgrest, tmp_path):
+    async def scenario() -> dict:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        outbox.start()
+        await outbox.stop()
+        assert await outbox.submit("users", {"telegram_id": 9}, "late", on_conflict="telegram_id")
+        assert outbox._task is None
+        return await outbox.backlog()
+
+    # Kept for the next process instead of a replayer nobody stops
+    assert asyncio.run(scenario()) == {"pending": 1}
+    assert not postgrest.table("users").rows
+
+
+def test_shipped_writes_are_purged_while_running(postgrest, tmp_path, monkeypatch):
+    monkeypatch.setattr("write_outbox.WRITE_OUTBOX_RETENTION", 0.0)
+
+    async def scenario() -> None:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        outbox.poll_interval = 0.05
+        outbox.purge_interval = 0.1
+        await outbox.submit("users", {"telegram_id": 3}, "u3", on_conflict="telegram_id")
+
+        async def purged() -> bool:
+            return outbox.shipped == 1 and not await outbox.backlog()
+
+        await eventually(purged)
+        await outbox.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stop_while_woken_ends_the_replayer(postgrest, tmp_path):
+    async def scenario() -> None:
+        outbox = WriteOutbox(str(tmp_path / "writes.sqlite3"))
+        outbox.start()
+        await asyncio.sleep(0.05)  # the replayer is waiting for work
+        # wait_for() swallows a cancellation that coincides with the wakeup
+        outbox._wakeup.set()
+        started = time.monotonic()
+        await asyncio.wait_for(outbox.stop(), 5)
+        assert time.monotonic() - started < 2
+
+    asyncio.run(scenario())
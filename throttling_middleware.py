@@ -0,0 +1,122 @@
+import os
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from cache import TTLCache
+from log_utils import logger
+from metrics import registry
+from rate_limit import KeyedBuckets
+from timing_middleware import handler_labels
+
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1").lower() in {"1", "true", "yes"}
+# Default limit of handlers without a ``throttle`` flag: N per second, burst
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "100000"))
+# How often a throttled user is told to slow down
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "10"))
+
+# Named limits for handlers flagged with ``flags={"throttle": name}``:
+# name -> (rate per second, burst). Override with
+# THROTTLE_LIMITS="add_job=0.2:2,search=0.5:3".
+# Buckets live in each worker process: with N gunicorn workers a user whose
+# updates are spread over them gets up to N times these limits.
+THROTTLE_LIMITS = {
+    # Every press reads ``users`` and writes stats
+    "add_job": (0.2, 3),
+    "search": (0.5, 3),
+    "my_jobs": (1.0, 5),
+    "subscriptions": (0.5, 3),
+}
+
+THROTTLED = registry.counter(
+    "bot_throttled_total",
+    "Updates dropped by the per-user throttle.",
+    ("limit",),
+)
+
+
+def parse_limits(spec: str) -> dict[str, tuple[float, float]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+THROTTLE_LIMITS.update(parse_limits(os.getenv("THROTTLE_LIMITS", "")))
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drop messages and callbacks of users who exceed their rate limit.
+
+    Registered right after :class:`menu_routing.RoutingTimer`, ahead of
+    the other inner middlewares, so a flooded handler is skipped before
+    it or the action log touch Supabase or disk. Each
+    limit keeps per-user token buckets in a bounded LRU
+    (:class:`rate_limit.KeyedBuckets`) that forgets users once their
+    bucket has refilled. A handler picks its limit with
+    ``flags={"throttle": "<name>"}`` (see ``THROTTLE_LIMITS``), or opts
+    out with ``flags={"throttle": False}``; the rest share the default
+    limit per user.
+
+    The limits are per process, not per deployment: every gunicorn worker
+    keeps its own buckets, so across ``WEB_CONCURRENCY`` workers a user
+    can get that many times the configured rate. It is a flood guard for
+    the expensive handlers, not an exact quota.
+    """
+
+    def __init__(
+        self,
+        rate: float = THROTTLE_RATE,
+        burst: float = THROTTLE_BURST,
+        limits: dict[str, tuple[float, float]] | None = None,
+        max_users: int = THROTTLE_MAX_USERS,
+        notice_interval: float = THROTTLE_NOTICE_INTERVAL,
+        enabled: bool = THROTTLE_ENABLED,
+    ) -> None:
+        self.enabled = enabled
+        limits = THROTTLE_LIMITS if limits is None else limits
+        self._buckets = {
+            name: KeyedBuckets(rate, capacity=burst, maxsize=max_users)
+            for name, (rate, burst) in {"default": (rate, burst), **limits}.items()
+        }
+        self._noticed = TTLCache(max_users, notice_interval)
+
+    def tracked_users(self) -> int:
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        name = get_flag(data, "throttle", default="default")
+        if not self.enabled or user is None or name is False:
+            return await handler(event, data)
+        buckets = self._buckets.get(name)
+        if buckets is None:
+            logger.warning(f"Unknown throttle limit {name!r}, using the default one")
+            name, buckets = "default", self._buckets["default"]
+        if buckets.try_acquire(user.id):
+            return await handler(event, data)
+
+        THROTTLED.inc(name)
+        if user.id not in self._noticed:
+            self._noticed.set(user.id, True)
+            router, callback = handler_labels(data)
+            logger.info(f"Throttled user {user.id} on {router}.{callback} ({name})")
+            await self._notice(event)
+        elif isinstance(event, CallbackQuery):
+            # Без ответа у пользователя крутится индикатор загрузки
+            await event.answer()
+        return None
+
+    @staticmethod
+    async def _notice(event: Any) -> None:
+        text = "⏳ Слишком много запросов, подождите несколько секунд."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+        elif isinstance(event, Message):
+            await event.answer(text)
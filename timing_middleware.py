@@ -0,0 +1,51 @@
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+from log_utils import logger
+from metrics import HANDLER_DURATION, HANDLER_ERRORS, breakdown, format_breakdown
+
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "1"))
+
+
+def handler_labels(data: dict) -> tuple[str, str]:
+    router = data.get("event_router")
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return (
+        getattr(router, "name", None) or "unknown",
+        getattr(callback, "__qualname__", None) or "unknown",
+    )
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Record the latency of every handler, labelled by router and handler.
+
+    Registered as an inner middleware, so it runs once a handler has
+    matched and measures the handler together with the inner middlewares
+    after it. Handlers slower than ``SLOW_HANDLER_SECONDS`` are logged
+    with the time spent in Supabase and in the local databases. Routing
+    time is recorded separately by :class:`menu_routing.RoutingTimer`.
+    """
+
+    def __init__(self, slow_threshold: float = SLOW_HANDLER_SECONDS) -> None:
+        self.slow_threshold = slow_threshold
+
+    async def __call__(self, handler, event, data):
+        labels = handler_labels(data)
+        start = time.perf_counter()
+        with breakdown() as spans:
+            try:
+                return await handler(event, data)
+            except Exception:
+                HANDLER_ERRORS.inc(*labels)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                HANDLER_DURATION.observe(elapsed, *labels)
+                if elapsed >= self.slow_threshold:
+                    logger.warning(
+                        f"Slow handler {labels[0]}.{labels[1]}: {elapsed:.3f}s"
+                        f" ({format_breakdown(spans) or 'no tracked calls'})"
+                    )
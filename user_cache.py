@@ -0,0 +1,97 @@
+"""Per-process cache of ``users`` rows keyed by ``telegram_id``.
+
+Registration checks used to query Supabase on every ``/start``, on every
+"Разместить подработку" and on the final price step. Rows are now cached
+with a TTL and LRU eviction; missing users are cached for a shorter time
+so that repeated checks of unregistered users stay cheap too. Concurrent
+lookups for the same id share a single query. Code that writes a ``users``
+row must call :meth:`UserCache.put` or :meth:`UserCache.invalidate`.
+Rows still waiting in the write outbox count as registered users.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any
+
+from cache import MISSING, TTLCache
+from supabase_client import supabase, with_supabase_retry
+from write_outbox import write_outbox
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "30"))
+
+
+class UserCache:
+    """Coalescing TTL/LRU cache in front of the ``users`` table."""
+
+    columns = "id,telegram_id,username,name,city,phone"
+
+    def __init__(
+        self,
+        maxsize: int = USER_CACHE_SIZE,
+        ttl: float = USER_CACHE_TTL,
+        negative_ttl: float = USER_CACHE_NEGATIVE_TTL,
+    ) -> None:
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize, ttl)
+        self._pending: dict[int, asyncio.Task] = {}
+
+    async def get(self, telegram_id: int) -> dict[str, Any] | None:
+        """Return the user's row or ``None`` if they are not registered.
+
+        Supabase errors propagate to the caller and are not cached, unless
+        the row is found in the write outbox.
+        """
+        row = self._cache.get(telegram_id)
+        if row is not MISSING:
+            return row
+        task = self._pending.get(telegram_id)
+        if task is None:
+            task = asyncio.create_task(self._load(telegram_id))
+            self._pending[telegram_id] = task
+        # shield: one cancelled caller must not cancel the shared query
+        return await asyncio.shield(task)
+
+    async def _load(self, telegram_id: int) -> dict[str, Any] | None:
+        task = asyncio.current_task()
+        try:
+            try:
+                result = await with_supabase_retry(
+                    lambda: supabase.table("users")
+                    .select(self.columns)
+                    .eq("telegram_id", telegram_id)
+                    .execute()
+                )
+            except Exception:
+                row = await write_outbox.find("users", "telegram_id", telegram_id)
+                if row is None:
+                    raise
+                return row
+            rows = getattr(result, "data", [])
+            row = rows[0] if rows else None
+            if row is None:
+                # Registered, but the row has not reached Supabase yet
+                row = await write_outbox.find("users", "telegram_id", telegram_id)
+            # Skip caching if the entry was invalidated while we were waiting
+            if self._pending.get(telegram_id) is task:
+                ttl = None if row is not None else self.negative_ttl
+                self._cache.set(telegram_id, row, ttl=ttl)
+            return row
+        finally:
+            if self._pending.get(telegram_id) is task:
+                del self._pending[telegram_id]
+
+    def put(self, telegram_id: int, row: dict[str, Any]) -> None:
+        """Store a row that was just written to Supabase or the write outbox."""
+        self._pending.pop(telegram_id, None)
+        self._cache.set(telegram_id, row)
+
+    def invalidate(self, telegram_id: int) -> None:
+        self._pending.pop(telegram_id, None)
+        self._cache.pop(telegram_id)
+
+
+user_cache = UserCache()
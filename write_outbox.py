@@ -0,0 +1,346 @@
+"""Local write-ahead outbox for Supabase writes.
+
+Handlers used to write ``users`` and ``jobs`` rows straight to Supabase and
+only log the exception when that failed, so the user was told the data was
+saved while it was lost. Writes are now appended to a local SQLite
+database first (see :mod:`local_db`) and a background replayer ships them
+to Supabase in multi-row requests. Once :meth:`WriteOutbox.submit` has
+returned the write survives Supabase outages and restarts.
+
+Every record carries an idempotency key. The same key is recorded only
+once within ``WRITE_OUTBOX_RETENTION``, so a redelivered update does not
+queue a second write, and the replayed request itself is an upsert on the
+table's unique column (``users.telegram_id``, ``jobs.dedup_key``), so
+shipping a batch twice after a crash does not duplicate rows either.
+``logs`` rows have no unique column and are delivered at least once.
+
+Transient failures (see :func:`resilience.is_transient`) are retried with
+backoff for as long as it takes; a record Supabase rejects outright is
+marked as failed and kept for inspection.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from local_db import DATA_DIR, LocalDB
+from log_utils import logger
+from resilience import CircuitOpenError, backoff_delay, is_transient
+from supabase_client import supabase, supabase_breaker, with_supabase_retry
+
+WRITE_OUTBOX_PATH = os.getenv("WRITE_OUTBOX_PATH", str(DATA_DIR / "writes.sqlite3"))
+WRITE_OUTBOX_BATCH = int(os.getenv("WRITE_OUTBOX_BATCH", "100"))
+WRITE_OUTBOX_RETENTION = float(os.getenv("WRITE_OUTBOX_RETENTION", str(24 * 3600)))
+
+PENDING, SENDING, DONE, FAILED = "pending", "sending", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    tbl TEXT NOT NULL,
+    on_conflict TEXT,
+    ignore_duplicates INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    owner TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS writes_due ON writes (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS writes_table ON writes (tbl, status);
+"""
+
+
+@dataclass
+class _Write:
+    id: int
+    table: str
+    on_conflict: str | None
+    ignore_duplicates: bool
+    row: dict[str, Any]
+    attempts: int
+
+    @property
+    def group(self) -> tuple:
+        # PostgREST bulk requests need identical options and column sets
+        return (self.table, self.on_conflict, self.ignore_duplicates, tuple(sorted(self.row)))
+
+    @property
+    def conflict_key(self) -> tuple:
+        """Values of the ``on_conflict`` columns, which may be a comma-separated list."""
+        return tuple(self.row.get(column.strip()) for column in (self.on_conflict or "").split(","))
+
+
+class WriteOutbox:
+    """Persist Supabase writes locally and replay them in batches."""
+
+    claim_timeout = 120.0
+    poll_interval = 1.0
+    retry_base = 1.0
+    retry_cap = 60.0
+    # Shipped writes are forgotten this often, not only at startup
+    purge_interval = 3600.0
+
+    def __init__(self, path: str = WRITE_OUTBOX_PATH, batch_size: int = WRITE_OUTBOX_BATCH) -> None:
+        self.batch_size = batch_size
+        # Identifies this process's claims in the shared database
+        self._owner = uuid.uuid4().hex
+        self._db = LocalDB(path, _SCHEMA)
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        # Set by stop(): later submits are stored for the next process to ship
+        self._stopped = False
+        self.shipped = 0
+        self.failed = 0
+        self.retried = 0
+
+    # --- producer side ------------------------------------------------------------------
+
+    async def submit(
+        self,
+        table: str,
+        row: dict[str, Any],
+        key: str,
+        on_conflict: str | None = None,
+        ignore_duplicates: bool = False,
+    ) -> bool:
+        """Record one write; ``False`` if ``key`` was already recorded."""
+        added = await self._db.run(
+            self._insert, table, on_conflict, ignore_duplicates, [(key, row)]
+        )
+        self._wake()
+        return added > 0
+
+    async def submit_many(self, table: str, rows: Iterable[dict[str, Any]]) -> int:
+        """Record plain inserts that have no natural idempotency key."""
+        items = [(uuid.uuid4().hex, row) for row in rows]
+        added = await self._db.run(self._insert, table, None, False, items)
+        self._wake()
+        return added
+
+    async def find(self, table: str, column: str, value: Any) -> dict[str, Any] | None:
+        """Latest row for ``column = value`` that has not reached Supabase yet."""
+        rows = await self.find_all(table, column, value, limit=1)
+        return rows[0] if rows else None
+
+    async def find_all(self, table: str, column: str, value: Any, limit: int = 100) -> list[dict[str, Any]]:
+        """Rows for ``column = value`` that have not reached Supabase yet, newest first."""
+        def _find(conn: sqlite3.Connection) -> list[str]:
+            rows = conn.execute(
+                "SELECT payload FROM writes WHERE tbl = ? AND status IN (?, ?)"
+                " AND json_extract(payload, '$.' || ?) = ? ORDER BY id DESC LIMIT ?",
+                (table, PENDING, SENDING, column, value, limit),
+            ).fetchall()
+            return [row[0] for row in rows]
+
+        return [json.loads(payload) for payload in await self._db.run(_find)]
+
+    @staticmethod
+    def _insert(
+        conn: sqlite3.Connection,
+        table: str,
+        on_conflict: str | None,
+        ignore_duplicates: bool,
+        items: list[tuple[str, dict[str, Any]]],
+    ) -> int:
+        now = time.time()
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO writes"
+                " (key, tbl, on_conflict, ignore_duplicates, payload, created_at, next_attempt_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        key, table, on_conflict, int(ignore_duplicates),
+                        json.dumps(row, ensure_ascii=False, default=str), now, now,
+                    )
+                    for key, row in items
+                ],
+            )
+            return conn.total_changes - before
+
+    def _wake(self) -> None:
+        if self._stopped:
+            return
+        if self._task is None:
+            self.start()
+        elif self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._task is not None or self._stopped:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Anything still claimed goes back to the queue for the next start
+        await self._db.run(self._release_claims)
+        await self._db.close()
+
+    # --- replayer ---------------------------------------------------------------------------
+
+    async def _run(self) -> None:
+        next_purge = 0.0
+        # Not ``while True``: wait_for() below returns normally instead of
+        # raising when stop() cancels it just as a submit sets the event
+        while not self._stopped:
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + self.purge_interval
+                try:
+                    await self._db.run(self._purge)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Write outbox purge failed")
+            try:
+                writes = []
+                if supabase_breaker.available():
+                    writes = await self._db.run(self._claim, self.batch_size)
+                if not writes:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+                groups: dict[tuple, list[_Write]] = {}
+                for write in writes:
+                    groups.setdefault(write.group, []).append(write)
+                results: list[tuple] = []
+                for group in groups.values():
+                    await self._ship(group, results)
+                await self._db.run(self._store_results, results)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Write outbox replayer error")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _ship(self, writes: list[_Write], results: list[tuple]) -> None:
+        """Send one group in a single request and record the outcome of each write."""
+        first = writes[0]
+        rows = [write.row for write in writes]
+        if first.on_conflict:
+            # An upsert may not touch the same row twice; the latest write wins
+            latest = {write.conflict_key: write.row for write in writes}
+            rows = list(latest.values())
+        try:
+            if first.on_conflict:
+                await with_supabase_retry(
+                    lambda: supabase.table(first.table)
+                    .upsert(rows, on_conflict=first.on_conflict, ignore_duplicates=first.ignore_duplicates)
+                    .execute(),
+                    max_retries=1,
+                )
+            else:
+                await with_supabase_retry(
+                    lambda: supabase.table(first.table).insert(rows).execute(),
+                    max_retries=1,
+                )
+        except Exception as e:
+            if isinstance(e, CircuitOpenError) or is_transient(e):
+                # Logged below WARNING so log rows do not pile up during an outage
+                logger.info(f"Write outbox: {len(writes)} {first.table} rows postponed: {e}")
+                for write in writes:
+                    self.retried += 1
+                    delay = backoff_delay(write.attempts + 1, self.retry_base, self.retry_cap)
+                    results.append((PENDING, write.attempts + 1, time.time() + delay, str(e), write.id))
+            elif len(writes) > 1:
+                # Find the offending rows without holding back the rest
+                for write in writes:
+                    await self._ship([write], results)
+            else:
+                self.failed += 1
+                logger.error(f"Write outbox: {first.table} row {first.id} rejected: {e}")
+                results.append((FAILED, first.attempts + 1, 0.0, str(e), first.id))
+        else:
+            self.shipped += len(writes)
+            for write in writes:
+                results.append((DONE, write.attempts + 1, 0.0, None, write.id))
+
+    # --- database thread ----------------------------------------------------------------------
+
+    def _claim(self, conn: sqlite3.Connection, limit: int) -> list[_Write]:
+        now = time.time()
+        with conn:
+            rows = conn.execute(
+                "UPDATE writes SET status = ?, claimed_at = ?, owner = ? WHERE id IN ("
+                " SELECT id FROM writes"
+                " WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND claimed_at < ?)"
+                " ORDER BY id LIMIT ?"
+                ") RETURNING id, tbl, on_conflict, ignore_duplicates, payload, attempts",
+                (SENDING, now, self._owner, PENDING, now, SENDING, now - self.claim_timeout, limit),
+            ).fetchall()
+        # RETURNING does not preserve order; replay in submission order
+        return [
+            _Write(id_, tbl, on_conflict, bool(ignore), json.loads(payload), attempts)
+            for id_, tbl, on_conflict, ignore, payload, attempts in sorted(rows)
+        ]
+
+    @staticmethod
+    def _store_results(conn: sqlite3.Connection, results: list[tuple]) -> None:
+        with conn:
+            conn.executemany(
+                "UPDATE writes SET status = ?, attempts = ?, next_attempt_at = ?,"
+                " last_error = ?, claimed_at = NULL WHERE id = ?",
+                results,
+            )
+
+    @staticmethod
+    def _purge(conn: sqlite3.Connection) -> None:
+        """Forget shipped writes older than ``WRITE_OUTBOX_RETENTION``."""
+        with conn:
+            conn.execute(
+                "DELETE FROM writes WHERE status = ? AND created_at < ?",
+                (DONE, time.time() - WRITE_OUTBOX_RETENTION),
+            )
+
+    def _release_claims(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            conn.execute(
+                "UPDATE writes SET status = ?, claimed_at = NULL WHERE status = ? AND owner = ?",
+                (PENDING, SENDING, self._owner),
+            )
+
+    # --- metrics ------------------------------------------------------------------------------
+
+    async def backlog(self) -> dict[str, int]:
+        """Write counts by status."""
+        return await self._db.run(
+            lambda conn: dict(
+                conn.execute("SELECT status, COUNT(*) FROM writes GROUP BY status").fetchall()
+            )
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "shipped": self.shipped,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+write_outbox = WriteOutbox()